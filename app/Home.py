@@ -1,10 +1,14 @@
 import os
 import shutil
 import streamlit as st  # type: ignore
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 import pydeck as pdk  # type: ignore
 
-from utils.io import load_first_csv
+from utils.io import load_first_csv, dataset_version
+from utils.vcache import cache_report, version_cache
+from utils.search import AddressIndex
+from utils.lod import LOD_POINT_LIMIT, build_lod_pyramid, pick_level
 from utils.style import apply_theme
 from rentCast_collectionV2 import fetch_listings, save_listings_to_csv
 from utils.filters_ui import render_sidebar_filters
@@ -79,42 +83,6 @@ components.html(
             max-width: 600px;
             margin-bottom: 1.8rem;
         }}
-
-        .hero-search-wrapper {{
-            position: absolute;
-            bottom: 20px;
-            width: 100%;
-            display: flex;
-            justify-content: center;
-        }}
-
-        .hero-search {{
-            background: white;
-            padding: 0.75rem 1rem;
-            border-radius: 999px;
-            display: flex;
-            gap: 0.5rem;
-            box-shadow: 0 8px 20px rgba(0,0,0,0.25);
-        }}
-
-        .hero-search input {{
-            padding: 0.55rem 1rem;
-            min-width: 260px;
-            border-radius: 999px;
-            border: none;
-            outline: none;
-            font-size: 0.95rem;
-        }}
-
-        .hero-search button {{
-            padding: 0.55rem 1.2rem;
-            border-radius: 999px;
-            border: none;
-            background: linear-gradient(135deg, #e63946, #b81f2d);
-            color: white;
-            font-weight: 600;
-            cursor: pointer;
-        }}
     </style>
 
     <div class="hero-container">
@@ -126,18 +94,70 @@ components.html(
             </p>
         </div>
 
-        <div class="hero-search-wrapper">
-            <div class="hero-search">
-                <input type="text" placeholder="Search by city, zip code, or neighborhood">
-                <button>Search</button>
-            </div>
-        </div>
-
     </div>
     """,
     height=350
 )
 
+# -----------------------------------------------------------
+# 2️⃣ ADDRESS SEARCH (typeahead over the loaded listings)
+# -----------------------------------------------------------
+
+
+@version_cache
+def _address_index(version: str) -> tuple[pd.DataFrame, AddressIndex]:
+    # version only keys the cache; a new data file builds a new index
+    data = load_first_csv("data")
+    if data is None:
+        data = pd.DataFrame()
+    return data, AddressIndex(data)
+
+
+def _text(value) -> str:
+    return "" if pd.isna(value) else str(value).strip()
+
+
+def _zip_text(value) -> str:
+    # ZIPs read as floats come back as "90005.0"
+    text = _text(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def _use_search_match(zip_value: str, city_value: str, state_value: str) -> None:
+    # runs as a callback, i.e. before the sidebar widgets are created
+    st.session_state["zip_code"] = zip_value
+    st.session_state["city"] = city_value
+    st.session_state["state"] = state_value
+
+
+listings_df, address_index = _address_index(dataset_version("data"))
+
+query = st.text_input(
+    "Search by address, city, or zip code",
+    key="hero_query",
+    placeholder="e.g. 832 S Plymouth or 90005",
+)
+if query:
+    hits = address_index.search(query, limit=8)
+    if not hits:
+        st.caption("No listings match that search.")
+    else:
+        found = listings_df.iloc[[row for row, _ in hits]]
+        show = [c for c in ("formattedAddress", "city", "zipCode", "price",
+                            "bedrooms", "bathrooms", "status") if c in found.columns]
+        st.dataframe(found[show], use_container_width=True, hide_index=True)
+
+        labels = found.get("formattedAddress", found.index.astype(str)).astype(str).tolist()
+        pick = st.selectbox("Matching listings", range(len(labels)),
+                            format_func=lambda i: labels[i], key="hero_pick")
+        best = found.iloc[pick]
+        st.button(
+            "Use this location in the filters",
+            key="hero_apply",
+            on_click=_use_search_match,
+            args=(_zip_text(best.get("zipCode")), _text(best.get("city")), _text(best.get("state"))),
+        )
+
 # -----------------------------------------------------------
 # 3️⃣ SIDEBAR FILTERS
 # -----------------------------------------------------------
@@ -224,6 +244,13 @@ if search_clicked:
 # 5️⃣ LOAD DATA
 # -----------------------------------------------------------
 
+
+@version_cache
+def _mini_map_bins(version: str, _m: pd.DataFrame) -> dict:
+    price = _m["price"].to_numpy(dtype="float64") if "price" in _m else None
+    return build_lod_pyramid(_m["latitude"].to_numpy(), _m["longitude"].to_numpy(), price, None)
+
+
 df = load_first_csv("data")
 
 if df is None:
@@ -239,7 +266,6 @@ else:
     if {"latitude", "longitude"}.issubset(m.columns):
         m = m.dropna(subset=["latitude", "longitude"])
         m = m[(m["latitude"].between(-90, 90)) & (m["longitude"].between(-180, 180))]
-        m = m.head(500)  # cap for speed
     else:
         m = m.iloc[0:0]
 
@@ -276,14 +302,27 @@ else:
         if m.empty:
             st.caption("No listings with coordinates available yet to preview the map.")
         else:
-            layer = pdk.Layer(
-                "ScatterplotLayer",
-                data=m,
-                get_position="[longitude, latitude]",
-                get_radius=60,
-                get_fill_color=[59, 130, 246, 180],
-                pickable=False,
-            )
+            if len(m) > LOD_POINT_LIMIT:
+                # aggregate instead of dropping listings; bubble area ~ count
+                bins = pick_level(_mini_map_bins(dataset_version("data"), m), max_bins=1500).copy()
+                bins["radius"] = np.sqrt(bins["count"]) * bins["cell_m"] * 0.15
+                layer = pdk.Layer(
+                    "ScatterplotLayer",
+                    data=bins[["longitude", "latitude", "radius"]],
+                    get_position="[longitude, latitude]",
+                    get_radius="radius",
+                    get_fill_color=[59, 130, 246, 180],
+                    pickable=False,
+                )
+            else:
+                layer = pdk.Layer(
+                    "ScatterplotLayer",
+                    data=m[["longitude", "latitude"]],
+                    get_position="[longitude, latitude]",
+                    get_radius=60,
+                    get_fill_color=[59, 130, 246, 180],
+                    pickable=False,
+                )
             view_state = pdk.ViewState(
                 longitude=float(m["longitude"].mean()),
                 latitude=float(m["latitude"].mean()),
@@ -397,6 +436,12 @@ else:
     )
     st.dataframe(df, use_container_width=True, hide_index=True)
 
+    with st.expander("Analytics cache", expanded=False):
+        # results cached per dataset version across pages and sessions
+        report = cache_report()
+        report["MB"] = (report.pop("bytes") / 2**20).round(1)
+        st.dataframe(report, use_container_width=True, hide_index=True)
+
 
 
     # -------------------------------------------------------
@@ -10,12 +10,22 @@ import os
 import shutil
 
 from utils.style import apply_theme
-from utils.filters_ui import render_sidebar_filters
+from utils.filters_ui import render_sidebar_filters, filter_signature
+from utils.io import dataset_version
+from utils.vcache import version_cache
+from utils.lod import LOD_POINT_LIMIT, build_lod_pyramid, heat_rasters, pick_level, pick_raster
+from utils.cluster import MAX_ZOOM, MIN_ZOOM, ClusterIndex
+from utils.map_layers import CachedDeck, compact_points, money_labels, point_layers, raster_layer
+from utils.search import AddressIndex
+from utils.spatial import METERS_PER_MILE, SpatialIndex, viewport_bbox
 from rentCast_collectionV2 import fetch_listings, save_listings_to_csv
 
 st.set_page_config(page_title="Map3D", page_icon="🗺️", layout="wide")
 apply_theme()
 
+# camera tilt; the "Only what's in view" box is computed for the same view
+MAP_PITCH, MAP_BEARING = 60, -15
+
 # -----------------------------------------------------------
 # 🔁 Handle map reset (must happen BEFORE sidebar widgets)
 # -----------------------------------------------------------
@@ -133,31 +143,134 @@ def _load_csv_from_repo() -> pd.DataFrame:
         return pd.DataFrame()
 
 
-df = _load_csv_from_repo()
-if df.empty:
+@version_cache(max_bytes=None)
+def _map_base(version: str) -> pd.DataFrame:
+    """Loaded + cleaned rows with valid coordinates, once per dataset version."""
+    df = _load_csv_from_repo()
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    # ---- minimal cleaning for the map ----
+    for c in ("price", "latitude", "longitude", "bedrooms", "bathrooms", "squareFootage", "yearBuilt", "daysOnMarket"):
+        if c in df:
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    if "addr" not in df:
+        a1 = df.get("addressLine1", pd.Series(
+            "", index=df.index)).astype(str).fillna("")
+        c = df.get("city",         pd.Series(
+            "", index=df.index)).astype(str).fillna("")
+        s = df.get("state",        pd.Series(
+            "", index=df.index)).astype(str).fillna("")
+        z = df.get("zipCode",      pd.Series(
+            "", index=df.index)).astype(str).fillna("")
+        df["addr"] = (a1 + ", " + c + ", " + s + " " + z).str.strip(", ")
+
+    m = df.dropna(subset=["latitude", "longitude"])
+    m = m[(m["latitude"].between(-90, 90)) & (m["longitude"].between(-180, 180))]
+    return m[(m["latitude"] != 0) & (m["longitude"] != 0)]
+
+
+version = dataset_version("data")
+base = _map_base(version)
+if base.empty:
     st.warning(
         "No data found under /data. Ensure your CSV is in the data/ folder.")
     st.stop()
 
-# ---- minimal cleaning for the map ----
-for c in ("price", "latitude", "longitude", "bedrooms", "bathrooms", "squareFootage", "yearBuilt", "daysOnMarket"):
-    if c in df:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-if "addr" not in df:
-    a1 = df.get("addressLine1", pd.Series(
-        "", index=df.index)).astype(str).fillna("")
-    c = df.get("city",         pd.Series(
-        "", index=df.index)).astype(str).fillna("")
-    s = df.get("state",        pd.Series(
-        "", index=df.index)).astype(str).fillna("")
-    z = df.get("zipCode",      pd.Series(
-        "", index=df.index)).astype(str).fillna("")
-    df["addr"] = (a1 + ", " + c + ", " + s + " " + z).str.strip(", ")
-
-
-m = df.dropna(subset=["latitude", "longitude"]).copy()
-m = m[(m["latitude"].between(-90, 90)) & (m["longitude"].between(-180, 180))]
-m = m[(m["latitude"] != 0) & (m["longitude"] != 0)]
+
+st.title("🗺️ 3D Map")
+st.caption("Add filters for searching across the map on the sidebar filtered search. Press 'Search listings' to show desired filters.")
+
+
+# this is now red
+if st.button("🔄 Reset map", help="Clear filters and restore full dataset", key="reset_map", type="primary"):
+    base_path = "data/rent_listings.csv"
+    target_path = "data/listings_RentCastAPI.csv"
+
+    if os.path.exists(base_path):
+        shutil.copyfile(base_path, target_path)
+        st.success("Reset complete: full dataset restored.")
+    else:
+        st.warning("Could not find data/rent_listings.csv to restore from.")
+
+    st.session_state["reset_map_flag"] = True
+
+    try:
+        st.rerun()
+    except Exception:
+        st.experimental_rerun()
+
+
+
+st.caption("Press button above to reset map to show all listings.")
+
+
+# -----------------------------------------------------------
+# 📍 Within-radius filter (spatial index over the map rows)
+# -----------------------------------------------------------
+@version_cache
+def _map_indexes(version: str) -> tuple[SpatialIndex, AddressIndex]:
+    base = _map_base(version)
+    return SpatialIndex(base["latitude"].to_numpy(), base["longitude"].to_numpy()), AddressIndex(base)
+
+
+spatial, addresses = _map_indexes(version)
+rows = None  # positions in `base` selected by the radius / viewport queries
+radius_key = None
+center = None
+with st.expander("📍 Within radius of an address", expanded=False):
+    rc1, rc2 = st.columns([3, 1])
+    center_query = rc1.text_input("Center address", key="radius_query",
+                                  placeholder="Search by address, city, or zip code")
+    miles = rc2.number_input("Radius (miles)", min_value=0.1, max_value=50.0,
+                             value=1.0, step=0.25, key="radius_miles")
+    hits = addresses.search(center_query, limit=8) if center_query else []
+    if center_query and not hits:
+        st.caption("No listings match that address.")
+    if hits:
+        labels = base["addr"].astype(str).to_numpy()
+        pick = st.selectbox("Center on", [row for row, _ in hits],
+                            format_func=lambda r: labels[r], key="radius_center")
+        c_lat, c_lon = float(base["latitude"].iat[pick]), float(base["longitude"].iat[pick])
+        center = (c_lat, c_lon)
+
+        _, near, _ = spatial.query_radius(c_lat, c_lon, miles * METERS_PER_MILE)
+        rows = np.sort(near)
+        radius_key = (pick, miles)
+        st.caption(f"{len(rows):,} listings within {miles:g} mi of {labels[pick]} (before sidebar filters).")
+
+        nn, dist = spatial.query_knn(c_lat, c_lon, 10)
+        ok = nn[0] >= 0
+        nearest = base.iloc[nn[0][ok]]
+        cols = [c for c in ("addr", "price", "bedrooms", "bathrooms", "squareFootage", "status")
+                if c in nearest.columns]
+        nearest = nearest[cols].assign(miles=(dist[0][ok] / METERS_PER_MILE).round(2))
+        st.markdown("**10 nearest listings**")
+        st.dataframe(nearest, use_container_width=True, hide_index=True)
+
+# -----------------------------------------------------------
+# 🧭 Viewport: only load the listings the map will show
+# -----------------------------------------------------------
+vc1, vc2, vc3, vc4 = st.columns([2, 1, 1, 1])
+zoom = vc1.slider("Map zoom", MIN_ZOOM, MAX_ZOOM, 10,
+                  help="Sets the starting zoom; clusters are sized for this zoom level.")
+limit_view = vc4.toggle("Only what's in view", value=False,
+                        help="Query the spatial index for the visible box instead of sending every listing.")
+default_center = center or (float(base["latitude"].mean()), float(base["longitude"].mean()))
+view_lat = vc2.number_input("Center lat", -90.0, 90.0, round(default_center[0], 4),
+                            step=0.01, format="%.4f", disabled=not limit_view)
+view_lon = vc3.number_input("Center lon", -180.0, 180.0, round(default_center[1], 4),
+                            step=0.01, format="%.4f", disabled=not limit_view)
+view_key = None
+if limit_view:
+    visible = spatial.query_bbox(*viewport_bbox(view_lat, view_lon, zoom, height_px=600,
+                                                pitch=MAP_PITCH, bearing=MAP_BEARING))
+    rows = visible if rows is None else np.intersect1d(rows, visible, assume_unique=True)
+    view_key = (view_lat, view_lon, zoom)
+    center = (view_lat, view_lon)
+
+# everything below only touches the selected rows
+m = base if rows is None else base.iloc[rows]
 
 # -----------------------------------------------------------
 # 🔍 Apply the same sidebar filters as Home, but to map data
@@ -246,104 +359,199 @@ if sqft_col:
         m = m[m[sqft_col] <= max_sqft]
 
 
-st.title("🗺️ 3D Map")
-st.caption("Add filters for searching across the map on the sidebar filtered search. Press 'Search listings' to show desired filters.")
-
-
-# this is now red
-if st.button("🔄 Reset map", help="Clear filters and restore full dataset", key="reset_map", type="primary"):
-    base_path = "data/rent_listings.csv"
-    target_path = "data/listings_RentCastAPI.csv"
-
-    if os.path.exists(base_path):
-        shutil.copyfile(base_path, target_path)
-        st.success("Reset complete: full dataset restored.")
-    else:
-        st.warning("Could not find data/rent_listings.csv to restore from.")
-
-    st.session_state["reset_map_flag"] = True
-
-    try:
-        st.rerun()
-    except Exception:
-        st.experimental_rerun()
-
+map_filters = filter_signature() + (("radius", radius_key), ("view", view_key))
 
-
-st.caption("Press button above to reset map to show all listings.")
 if m.empty:
     st.info("No valid coordinates to plot.")
     st.stop()
 
 
-# color/size by price
-p = pd.to_numeric(m.get("price"), errors="coerce")
-if p.notna().any():
-    p_min, p_max = float(np.nanmin(p)), float(np.nanmax(p))
-    norm = (p - p_min) / \
-        (p_max - p_min) if p_max > p_min else pd.Series(0.5, index=m.index)
-else:
-    p_min = p_max = 0.0
-    norm = pd.Series(0.5, index=m.index)
-
-m["price_norm"] = norm.fillna(0.5)
-m["price_label"] = p.map(lambda v: f"${v:,.0f}" if pd.notna(v) else "N/A")
-m["col_r"] = (norm * 255).round().astype(int)
-m["col_g"] = 64
-m["col_b"] = (255 - norm * 255).round().astype(int)
-m["radius_m"] = ((norm * 120) + 40).astype(float)
-m.attrs["p_min"] = p_min
-m.attrs["p_med"] = float(np.nanmedian(p)) if p.notna().any() else 0.0
-m.attrs["p_max"] = p_max
-
-left, right = st.columns(2)
+left, mid, right = st.columns(3)
 use_pins = left.toggle("Show pin icons", value=True)
 use_columns = right.toggle("Show 3D columns by price", value=False)
+detail = mid.radio(
+    "Detail", ["Auto", "Points", "Bins", "Clusters", "Heatmap"], horizontal=True,
+    help=f"Auto switches to grid bins above {LOD_POINT_LIMIT:,} listings.")
+use_bins = detail == "Bins" or (detail == "Auto" and len(m) > LOD_POINT_LIMIT)
+use_clusters = detail == "Clusters"
+use_heat = detail == "Heatmap"
+heat_field = "price"
+if use_heat:
+    heat_field = "pps" if mid.radio("Heat by", ["Price", "$ / sqft"], horizontal=True) == "$ / sqft" \
+        else "price"
+
+
+@version_cache(max_entries=32)
+def _lod_pyramid(version: str, filters: tuple, _m: pd.DataFrame) -> dict:
+    # keyed on dataset version + sidebar filters; the frame itself isn't hashed
+    price = _m["price"].to_numpy(dtype="float64") if "price" in _m else None
+    pps = None
+    if price is not None and "squareFootage" in _m:
+        sqft = _m["squareFootage"].to_numpy(dtype="float64")
+        pps = np.where(sqft > 0, price / sqft, np.nan)
+    return build_lod_pyramid(_m["latitude"].to_numpy(), _m["longitude"].to_numpy(), price, pps)
+
+
+@version_cache(max_entries=32)
+def _heat_rasters(version: str, filters: tuple, _m: pd.DataFrame) -> dict:
+    # small int32/float32 histograms per resolution; the map just picks one
+    price = _m["price"].to_numpy(dtype="float64") if "price" in _m else None
+    pps = None
+    if price is not None and "squareFootage" in _m:
+        sqft = _m["squareFootage"].to_numpy(dtype="float64")
+        pps = np.where(sqft > 0, price / sqft, np.nan)
+    return heat_rasters(_m["latitude"].to_numpy(), _m["longitude"].to_numpy(), price, pps)
+
+
+@version_cache(max_entries=32)
+def _cluster_index(version: str, filters: tuple, _m: pd.DataFrame) -> ClusterIndex:
+    price = _m["price"].to_numpy(dtype="float64") if "price" in _m else None
+    return ClusterIndex(_m["latitude"].to_numpy(), _m["longitude"].to_numpy(), price)
+
+
+def _price_norm(m: pd.DataFrame) -> tuple[pd.Series, float, float]:
+    # color/size by price
+    p = pd.to_numeric(m.get("price"), errors="coerce")
+    if p.notna().any():
+        p_min, p_max = float(np.nanmin(p)), float(np.nanmax(p))
+        norm = (p - p_min) / \
+            (p_max - p_min) if p_max > p_min else pd.Series(0.5, index=m.index)
+    else:
+        p_min = p_max = 0.0
+        norm = pd.Series(0.5, index=m.index)
+    return norm.fillna(0.5), p_min, p_max
+
+
+def _bin_colors(frame: pd.DataFrame, price: pd.Series, p_min: float, p_max: float) -> None:
+    n = ((price - p_min) / (p_max - p_min)).clip(0, 1).fillna(0.5) if p_max > p_min \
+        else pd.Series(0.5, index=frame.index)
+    frame["col_r"] = (n * 255).round().astype(int)
+    frame["col_g"] = 64
+    frame["col_b"] = (255 - n * 255).round().astype(int)
+
+
+@version_cache(max_entries=32)
+def _map_deck(version: str, filters: tuple, mode: str, use_pins: bool, use_columns: bool,
+              zoom: int, mapbox: bool, center: tuple | None,
+              _m: pd.DataFrame) -> tuple[CachedDeck, str]:
+    """
+    Layers + serialized Deck for one (dataset, filters, toggles) combination.
+
+    Flipping a toggle back to a previous state is a cache hit, and
+    CachedDeck keeps the JSON so st.pydeck_chart doesn't re-serialize it.
+    `mapbox` only says whether a token is configured (pdk.settings holds
+    it), so the secret never becomes part of a cache key.
+    """
+    m = _m
+    norm, p_min, p_max = _price_norm(m)
+    caption = ""
+    layers = []
+    if mode == "clusters":
+        cl = _cluster_index(version, filters, m).clusters(zoom).copy()
+        _bin_colors(cl, cl["median_price"], p_min, p_max)
+        cl["radius_px"] = (8 + 4 * np.sqrt(cl["count"])).clip(upper=60)
+        cl["count_label"] = cl["count"].astype(str)
+        cl["price_label"] = money_labels(cl["median_price"])
+        cl["min_label"] = money_labels(cl["min_price"])
+        cl["max_label"] = money_labels(cl["max_price"])
+        caption = f"{len(m):,} listings in {len(cl):,} clusters at zoom {zoom}."
+
+        layers.append(pdk.Layer(
+            "ScatterplotLayer", data=cl, get_position="[longitude, latitude]",
+            get_radius="radius_px", radius_units="pixels", pickable=True,
+            get_fill_color="[col_r, col_g, col_b]", opacity=0.6,
+        ))
+        layers.append(pdk.Layer(
+            "TextLayer", data=cl, get_position="[longitude, latitude]", get_text="count_label",
+            get_size=14, get_color=[255, 255, 255], get_alignment_baseline="'center'",
+        ))
+        tooltip = {
+            "html": "<b>{count} listings</b><br/>Median {price_label}<br/>{min_label} – {max_label}",
+            "style": {"backgroundColor": "#1f2937", "color": "white"},
+        }
+    elif mode.startswith("heat:"):
+        field = mode.split(":", 1)[1]
+        raster = pick_raster(_heat_rasters(version, filters, m), zoom)
+        if raster is not None:
+            layers.append(raster_layer(raster, field))
+            ny, nx = raster["count"].shape
+            caption = (f"{len(m):,} listings as a {nx}×{ny} heat raster of {raster['cell_m']:,.0f} m cells, "
+                       f"colored by mean {'$ / sqft' if field == 'pps' else 'price'}.")
+        tooltip = None
+    elif mode == "bins":
+        bins = pick_level(_lod_pyramid(version, filters, m)).copy()
+        _bin_colors(bins, bins["median_price"], p_min, p_max)
+        bins["elev"] = (bins["count"] / max(int(bins["count"].max()), 1) * 1500 + 50).astype(float)
+        bins["price_label"] = money_labels(bins["median_price"])
+        bins["pps_label"] = money_labels(bins["median_pps"])
+        cell = float(bins["cell_m"].iloc[0]) if len(bins) else 0.0
+        caption = f"All {len(m):,} listings aggregated into {len(bins):,} cells of {cell:,.0f} m."
+
+        layers.append(pdk.Layer(
+            "ColumnLayer", data=bins, get_position="[longitude, latitude]", get_elevation="elev",
+            elevation_scale=1, radius=cell * 0.45, extruded=True, pickable=True,
+            get_fill_color="[col_r, col_g, col_b]", opacity=0.8,
+        ))
+        tooltip = {
+            "html": "<b>{count} listings</b><br/>Median {price_label}<br/>Median {pps_label} / sqft",
+            "style": {"backgroundColor": "#1f2937", "color": "white"},
+        }
+    else:
+        layers.extend(point_layers(compact_points(m, norm), use_pins, use_columns))
+
+        tooltip = {
+            "html": (
+                "<b>{addr}</b><br/><b>{price_label}</b>"
+                + (" • {bedrooms} bd" if "bedrooms" in m else "")
+                + (" / {bathrooms} ba" if "bathrooms" in m else "")
+                + ("<br/>{squareFootage} sqft" if "squareFootage" in m else "")
+                + (" • Built {yearBuilt}" if "yearBuilt" in m else "")
+                + ("<br/>DOM: {daysOnMarket}" if "daysOnMarket" in m else "")
+                + (" • {status}" if "status" in m else "")
+            ),
+            "style": {"backgroundColor": "#1f2937", "color": "white"},
+        }
+
+    # Ensure there is at least one visible layer
+    if not layers:
+        layers.append(pdk.Layer(
+            "ScatterplotLayer",
+            data=m[["longitude", "latitude"]],
+            get_position="[longitude, latitude]",
+            get_radius=60,
+            get_fill_color=[59, 130, 246],
+            pickable=False,
+        ))
+
+    lat, lon = center or (float(m["latitude"].mean()), float(m["longitude"].mean()))
+    view_state = pdk.ViewState(
+        longitude=lon,
+        latitude=lat,
+        zoom=zoom, pitch=MAP_PITCH, bearing=MAP_BEARING,
+    )
 
-layers = []
-if use_pins:
-    m["icon"] = [{
-        "url": "https://raw.githubusercontent.com/visgl/deck.gl-data/master/icon/marker.png",
-        "width": 128, "height": 128, "anchorY": 128,
-    }] * len(m)
-    layers.append(pdk.Layer(
-        "IconLayer", data=m, get_icon="icon", get_size=4, size_scale=8,
-        get_position="[longitude, latitude]", pickable=True
-    ))
-
-if use_columns:
-    m["elev"] = (m["price_norm"] * 1200 + 200).astype(float)
-    layers.append(pdk.Layer(
-        "ColumnLayer", data=m, get_position="[longitude, latitude]", get_elevation="elev",
-        elevation_scale=1, radius=40, extruded=True, pickable=True, get_fill_color="[col_r, col_g, col_b]"
-    ))
-
-layers.append(pdk.Layer(
-    "ScatterplotLayer", data=m, get_position="[longitude, latitude]",
-    get_radius="radius_m", pickable=True, get_fill_color="[col_r, col_g, col_b]", opacity=0.35
-))
-
-view_state = pdk.ViewState(
-    longitude=float(m["longitude"].mean()),
-    latitude=float(m["latitude"].mean()),
-    zoom=10, pitch=60, bearing=-15,
-)
-
-tooltip = {
-    "html": (
-        "<b>{addr}</b><br/><b>{price_label}</b>"
-        + (" • {bedrooms} bd" if "bedrooms" in m else "")
-        + (" / {bathrooms} ba" if "bathrooms" in m else "")
-        + ("<br/>{squareFootage} sqft" if "squareFootage" in m else "")
-        + (" • Built {yearBuilt}" if "yearBuilt" in m else "")
-        + ("<br/>DOM: {daysOnMarket}" if "daysOnMarket" in m else "")
-        + (" • {status}" if "status" in m else "")
-    ),
-    "style": {"backgroundColor": "#1f2937", "color": "white"},
-}
-# --- SAFE Mapbox token handling ---
-# ---- Build the Deck (works with or without Mapbox token) ----
+    # ---- Build the Deck (works with or without Mapbox token) ----
+    if mapbox:
+        deck = CachedDeck(
+            layers=layers,
+            initial_view_state=view_state,
+            map_style="mapbox://styles/mapbox/dark-v11",
+            tooltip=tooltip,
+        )
+    else:
+        # Carto provider does not need any key
+        deck = CachedDeck(
+            layers=layers,
+            initial_view_state=view_state,
+            map_provider="carto",   # <- important: use Carto tiles
+            map_style="light",      # 'light' or 'dark'
+            tooltip=tooltip,
+        )
+    deck.to_json()  # serialize now, while we're inside the cache
+    return deck, caption
 
+
+# --- SAFE Mapbox token handling ---
 # Try Mapbox first if you have a token; otherwise fall back to Carto (no token required)
 token = os.getenv("MAPBOX_API_KEY")
 if not token:
@@ -351,40 +559,26 @@ if not token:
         token = st.secrets["MAPBOX_API_KEY"]  # may not exist; that's fine
     except Exception:
         token = None
-
 if token:
     pdk.settings.mapbox_api_key = token
-    deck = pdk.Deck(
-        layers=layers,
-        initial_view_state=view_state,
-        map_style="mapbox://styles/mapbox/dark-v11",
-        tooltip=tooltip,
-    )
-else:
-    # Carto provider does not need any key
-    deck = pdk.Deck(
-        layers=layers,
-        initial_view_state=view_state,
-        map_provider="carto",   # <- important: use Carto tiles
-        map_style="light",      # 'light' or 'dark'
-        tooltip=tooltip,
-    )
 
-# Ensure there is at least one visible layer
-if not layers:
-    layers.append(pdk.Layer(
-        "ScatterplotLayer",
-        data=m,
-        get_position="[longitude, latitude]",
-        get_radius=60,
-        get_fill_color=[59, 130, 246],
-        pickable=False,
-    ))
-    deck.layers = layers
+mode = (f"heat:{heat_field}" if use_heat
+        else "clusters" if use_clusters else ("bins" if use_bins else "points"))
+deck, caption = _map_deck(version, map_filters, mode, use_pins, use_columns, zoom, bool(token),
+                          center if limit_view else None, m)
+if caption:
+    st.caption(caption)
 
 # Render with an explicit height so it’s visible
 st.pydeck_chart(deck, use_container_width=True, height=600)
 
+if limit_view:
+    # same rows as the map: one bbox query feeds both
+    in_view = m[[c for c in ("addr", "price", "bedrooms", "bathrooms", "squareFootage", "status")
+                 if c in m.columns]]
+    st.markdown(f"**Listings in view** ({len(in_view):,})")
+    st.dataframe(in_view.head(500), use_container_width=True, hide_index=True)
+
 
 # -------------------------------------------------------
 # 🔚 Simple Streamlit Footer 
@@ -1,5 +1,6 @@
 # app/pages/Opportunities.py
 from __future__ import annotations
+import threading
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -8,6 +9,12 @@ import altair as alt
 import pydeck as pdk
 
 from utils.style import apply_theme
+from utils.comps import GROUPINGS, ScoreTable, comps_frame, knn_comps, sketch_comps_frame
+from utils.spatial import METERS_PER_MILE
+from utils.hedonic import HedonicModel
+from utils.io import dataset_version
+from utils.vcache import version_cache
+from utils.sketch import SketchStore
 
 st.set_page_config(page_title="Opportunities", page_icon="🎯", layout="wide")
 apply_theme()
@@ -34,8 +41,8 @@ def _s(df: pd.DataFrame, col: str) -> pd.Series:
     return df[col].astype(str).fillna("") if col in df.columns else pd.Series("", index=df.index)
 
 
-@st.cache_data(show_spinner=False)
-def prepare_df() -> pd.DataFrame:
+@version_cache(max_bytes=None)
+def prepare_df(version: str) -> pd.DataFrame:
     df = _load_csv_from_repo()
     if df.empty:
         return df
@@ -68,7 +75,8 @@ def prepare_df() -> pd.DataFrame:
     return df
 
 
-df = prepare_df()
+version = dataset_version("data")
+df = prepare_df(version)
 if df.empty or "price" not in df.columns:
     st.warning("No priced listings found in /data.")
     st.stop()
@@ -103,19 +111,56 @@ with st.expander("Filters", expanded=True):
                    ) if "propertyType" in d4 else []
     type_sel = c5.multiselect("Property Type", types)
     filt = d4[d4["propertyType"].isin(type_sel)] if type_sel else d4
+    filters = tuple(tuple(sel) for sel in (state_sel, city_sel, zip_sel, status_sel, type_sel))
 
 if filt.empty:
     st.warning("No listings after filters.")
     st.stop()
 
+
+@st.cache_resource(show_spinner=False)
+def _hedonic_store() -> tuple[dict, threading.Lock]:
+    return {}, threading.Lock()
+
+
+def hedonic_discount(version: str, df: pd.DataFrame) -> pd.Series:
+    """
+    % below the hedonic model value for every listing.
+
+    The model is fitted once and then synced incrementally when the dataset
+    version changes (only added / removed listings are folded in). The
+    store is shared by every session, so the lock serializes the check and
+    the sync.
+    """
+    store, lock = _hedonic_store()
+    with lock:
+        if store.get("version") != version:
+            model = store.get("model")
+            if model is None:
+                model = HedonicModel().fit(df)
+            else:
+                model.sync(df)
+            store.update(version=version, model=model,
+                         discount=pd.Series(model.discount(df), index=df.index))
+        return store["discount"]
+
 # ------------------ Controls ------------------
 cA, cB, cC, cD = st.columns(4)
 metric = cA.radio("Valuation metric", [
                   "Price", "Price per sqft"], horizontal=True)
 group_choice = cB.radio("Comparables group", [
-                        "ZIP", "Bedrooms", "ZIP+Bedrooms"], horizontal=True)
+                        "ZIP", "Bedrooms", "ZIP+Bedrooms", "Nearby"], horizontal=True)
 min_comps = int(cC.number_input("Min comps per group", 3, 50, 8))
 top_n = int(cD.number_input("Top N undervalued", 5, 100, 15))
+if group_choice == "Nearby":
+    n1, n2, n3 = st.columns(3)
+    k_comps = int(n1.number_input("Nearest comps (k)", 3, 50, 10))
+    radius_mi = float(n2.number_input("Within (miles)", 0.25, 25.0, 2.0, step=0.25))
+    bed_tol = int(n3.number_input("Bedrooms ±", 0, 3, 0))
+approx = st.toggle("Approximate (sketch)", value=False, disabled=group_choice == "Nearby",
+                   help="Read medians and percentiles from per-group quantile sketches "
+                        "(about 1% error) instead of sorting every group.")
+approx = approx and group_choice != "Nearby"
 
 if metric == "Price per sqft":
     if "pps" not in filt:
@@ -128,66 +173,81 @@ else:
     metric_col = "price"
 
 # group key
-if group_choice == "ZIP+Bedrooms":
-    need = {"zipCode", "bedrooms"}
-    if not need.issubset(filt.columns):
-        st.info("Need 'zipCode' and 'bedrooms' for ZIP+Bedrooms.")
-        st.stop()
-    filt["_grp"] = filt["zipCode"].astype(
-        str) + " | " + filt["bedrooms"].astype("Int64").astype(str)
-elif group_choice == "ZIP":
-    if "zipCode" not in filt:
-        st.info("Need zipCode")
-        st.stop()
-    filt["_grp"] = filt["zipCode"].astype(str)
-else:
-    if "bedrooms" not in filt:
-        st.info("Need bedrooms")
-        st.stop()
-    filt["_grp"] = filt["bedrooms"].astype("Int64").astype(str)
-
-# keep only groups with enough comps
-sizes = filt.groupby("_grp")[metric_col].transform("count")
-work = filt[sizes >= min_comps].copy()
-if work.empty:
-    st.warning("No groups meet the minimum comps requirement.")
+need_cols = ("latitude", "longitude", "bedrooms") if group_choice == "Nearby" else GROUPINGS[group_choice]
+if not set(need_cols).issubset(filt.columns):
+    st.info(f"Need {' and '.join(repr(c) for c in need_cols)} for {group_choice}.")
     st.stop()
 
-# robust center / dispersion (median & MAD) per group
-med = work.groupby("_grp")[metric_col].transform("median")
-mad = (work[metric_col] - med).abs().groupby(work["_grp"]).transform("median")
-scale = (1.4826 * mad).replace(0, np.nan)  # Normal-equivalent MAD
-
-# empirical percentile (non-parametric)
 
-
-def _percentile_rank(x, g, series):
-    grp = series[g == x["_grp"]]
-    return (grp.rank(pct=True, method="average")[x.name])
-
-
-prct = work.apply(lambda r: _percentile_rank(
-    r, work["_grp"], work[metric_col]), axis=1)
-
-work["group_median"] = med
-work["robust_z"] = (work[metric_col] - med) / scale
-work["percentile"] = prct  # 0..1 within group
-work["discount_%"] = (1.0 - (work[metric_col] / med)) * 100.0
-
-# probability the listing is below group median = empirical percentile
-work["p_below_median_%"] = (work["percentile"] * 100.0).round(1)
+@st.cache_resource(show_spinner=False)
+def _sketch_store() -> SketchStore:
+    return SketchStore(("price", "pps"))
+
+
+@version_cache(max_entries=16)
+def _score_table(version: str, metric_col: str, group_choice: str, nearby: tuple,
+                 approx: bool, _df: pd.DataFrame) -> ScoreTable:
+    """
+    Scores for every listing in the dataset, built once per (version, metric,
+    grouping) and reused for any filter, min comps or top N.
+    """
+    comp_idx = None
+    if group_choice == "Nearby":
+        # k nearest listings with similar bedrooms, batched through a spatial index
+        k, radius_mi, bed_tol = nearby
+        cols = [pd.to_numeric(_df[c], errors="coerce").to_numpy(dtype="float64")
+                for c in ("latitude", "longitude", "bedrooms", metric_col)]
+        stats = knn_comps(*cols, k=k, radius_m=radius_mi * METERS_PER_MILE, bed_tol=bed_tol)
+        comp_idx = stats.pop("comp_idx")
+        frame = pd.DataFrame(stats, index=_df.index)
+    elif approx:
+        # sketches are fed only the listings that are new since the last version
+        store = _sketch_store()
+        store.sync(version, _df)
+        groups = store.sketches[metric_col].grouped(GROUPINGS[group_choice])
+        frame = sketch_comps_frame(groups, _df, group_choice, metric_col)
+    else:
+        # group median, robust z (median & MAD), percentile and discount
+        # for every listing in one vectorized pass
+        frame = comps_frame(_df, group_choice, metric_col)
+    frame["model_discount_%"] = hedonic_discount(version, _df).to_numpy()
+    frame["p_below_median_%"] = (frame["percentile"] * 100.0).round(1)
+    return ScoreTable(frame, comp_idx)
+
+
+@version_cache(max_entries=64)
+def _select(version: str, metric_col: str, group_choice: str, nearby: tuple, approx: bool,
+            filters: tuple, min_comps: int, _rows: np.ndarray,
+            _df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    # eligible rows and the best 100 of them (the Top N input's max);
+    # changing Top N only slices this
+    table = _score_table(version, metric_col, group_choice, nearby, approx, _df)
+    eligible = table.eligible(_rows, min_comps)
+    return eligible, table.top(eligible, 100)
+
+
+nearby = (k_comps, radius_mi, bed_tol) if group_choice == "Nearby" else ()
+table = _score_table(version, metric_col, group_choice, nearby, approx, df)
+rows = df.index.get_indexer(filt.index)  # filters as row positions
+eligible, best = _select(version, metric_col, group_choice, nearby, approx, filters, min_comps,
+                         rows, df)
+if eligible.size == 0:
+    st.warning("No groups meet the minimum comps requirement.")
+    st.stop()
 
 # rank by strongest undervaluation signal: lower z, higher discount, lower percentile
-ranked = work.sort_values(
-    by=["robust_z", "discount_%", "percentile"], ascending=[True, False, True]
-).head(top_n)
+top_rows = best[:top_n]
+ranked = df.iloc[top_rows].join(table.frame.iloc[top_rows])
 
 st.markdown("### Top candidates (by robust z, discount % and percentile)")
+st.caption("Comps are computed over the full market; the filters only choose which "
+           "listings are ranked.")
 show_cols = [c for c in ["addr", "zipCode", "bedrooms", "price", "pps", "group_median",
-                         "discount_%", "robust_z", "p_below_median_%", "daysOnMarket", "status"] if c in ranked.columns]
+                         "discount_%", "model_discount_%", "robust_z", "p_below_median_%", "comp_miles", "daysOnMarket", "status"] if c in ranked.columns]
 st.dataframe(
     ranked[show_cols].style.format({"price": ",.0f", "pps": ",.0f", "group_median": ",.0f",
-                                    "discount_%": "{:.1f}", "robust_z": "{:.2f}", "p_below_median_%": "{:.1f}"}),
+                                    "discount_%": "{:.1f}", "model_discount_%": "{:.1f}", "robust_z": "{:.2f}", "p_below_median_%": "{:.1f}",
+                                    "comp_miles": "{:.2f}"}),
     use_container_width=True, hide_index=True
 )
 
@@ -211,9 +271,17 @@ if {"latitude", "longitude"}.issubset(ranked.columns):
                             use_container_width=True, height=420)
 
 # distribution peek for any selected group
-grp_to_inspect = st.selectbox(
-    "Inspect distribution for group", sorted(work["_grp"].unique()))
-gdf = work.loc[work["_grp"] == grp_to_inspect, [metric_col]]
+if table.comp_idx is not None:
+    # nearby comps differ per listing: show the comps of one candidate
+    pick = st.selectbox("Inspect comps for listing", top_rows.tolist(),
+                        format_func=lambda r: str(df["addr"].iat[r]))
+    nb = table.comp_idx[pick]
+    gdf = df.iloc[nb[nb >= 0]][[metric_col]]
+else:
+    groups = table.frame["_grp"].to_numpy()[eligible]
+    grp_to_inspect = st.selectbox(
+        "Inspect distribution for group", sorted(pd.unique(groups)))
+    gdf = df.iloc[eligible[groups == grp_to_inspect]][[metric_col]]
 hist = alt.Chart(gdf).transform_bin("bin", field=metric_col).mark_bar().encode(
     x=alt.X("bin:Q", title=f"{metric}"),
     y=alt.Y("count()", title="# Listings"),
@@ -221,7 +289,8 @@ hist = alt.Chart(gdf).transform_bin("bin", field=metric_col).mark_bar().encode(
 ).properties(height=240)
 st.altair_chart(hist, use_container_width=True)
 st.caption(
-    "Probabilities are empirical: each listing’s percentile within its comps group.")
+    "Probabilities are empirical: each listing’s percentile within its comps group "
+    "(for Nearby, the share of its k nearest comps priced below it).")
 
 
 # -------------------------------------------------------
@@ -1,5 +1,7 @@
 # app/pages/ROI.py
 from __future__ import annotations
+import os
+import threading
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -7,6 +9,13 @@ import streamlit as st
 import altair as alt
 
 from utils.style import apply_theme
+from utils.io import dataset_version
+from utils.vcache import version_cache
+from utils.pool import shared_pool
+from utils.montecarlo import MC_MAX_BYTES, PortfolioSimulator
+from utils.repeat_sales import RepeatSalesIndex, cached_sale_pairs
+from utils.returns import ZipReturns, estimate_zip_returns
+from utils.sensitivity import SensitivityGrid, net_factor
 
 st.set_page_config(page_title="ROI", page_icon="⏳", layout="wide")
 apply_theme()
@@ -28,8 +37,8 @@ def _load_csv_from_repo() -> pd.DataFrame:
         return pd.DataFrame()
 
 
-@st.cache_data(show_spinner=False)
-def prepare() -> pd.DataFrame:
+@version_cache(max_bytes=None)
+def prepare(version: str) -> pd.DataFrame:
     df = _load_csv_from_repo()
     if df.empty:
         return df
@@ -51,43 +60,60 @@ def _pick_date_col(df: pd.DataFrame) -> str | None:
     return None
 
 
-def _empirical_returns(df: pd.DataFrame) -> tuple[float, float, dict]:
+@version_cache
+def _empirical_returns(version: str, _df: pd.DataFrame) -> tuple[ZipReturns, np.ndarray]:
     """
-    Compute annual log-return mean & std from median yearly prices.
-    Returns (mu, sigma, per_zip_mu_sigma).
+    Annual log-return mean & std from median yearly prices, overall and per
+    ZIP, plus each row's position in the per-ZIP arrays. Estimated once per
+    dataset version.
     """
-    date_col = _pick_date_col(df)
-    if date_col is None or "price" not in df:
-        return 0.03, 0.12, {}  # default if no dates
-
-    d = df[[date_col, "price", "zipCode"]].dropna().copy()
-    d["year"] = d[date_col].dt.year
-    if d.empty:
-        return 0.03, 0.12, {}
-
-    yearly = d.groupby(["zipCode", "year"])["price"].median().reset_index()
-    # log returns by zip
-    per_zip = {}
-    for z, g in yearly.groupby("zipCode"):
-        g = g.sort_values("year")
-        if len(g) >= 3:
-            r = np.diff(np.log(g["price"].to_numpy()))
-            if np.isfinite(r).any():
-                per_zip[z] = (float(np.mean(r)), float(
-                    np.std(r, ddof=1) if len(r) > 1 else 0.10))
-    # global fallback
-    all_years = yearly.groupby("year")["price"].median().sort_index()
-    if len(all_years) >= 3:
-        r_all = np.diff(np.log(all_years.to_numpy()))
-        mu_g = float(np.mean(r_all))
-        sig_g = float(np.std(r_all, ddof=1))
-    else:
-        mu_g, sig_g = 0.03, 0.12
+    params = estimate_zip_returns(_df, _pick_date_col(_df))
+    codes = params.codes(_df["zipCode"]) if "zipCode" in _df else np.full(len(_df), -1)
+    return params, codes
+
+
+@version_cache
+def _repeat_sales_returns(version: str, by: str,
+                          _df: pd.DataFrame) -> tuple[ZipReturns, np.ndarray]:
+    """Growth and volatility from a repeat-sales index per `by` group, per dataset version."""
+    params = RepeatSalesIndex(_df, cached_sale_pairs(version, _df), by).returns()
+    codes = params.codes(_df[by]) if by in _df else np.full(len(_df), -1)
+    return params, codes
+
+
+@version_cache
+def _sensitivity_grid(version: str, _df: pd.DataFrame) -> tuple[SensitivityGrid, pd.Index]:
+    """Sorted price index per ZIP for grid queries, built once per dataset version."""
+    zips = _df["zipCode"] if "zipCode" in _df else pd.Series(np.nan, index=_df.index)
+    codes, labels = pd.factorize(zips.astype(str), sort=True)
+    codes = np.where(codes < 0, len(labels), codes)  # listings without a ZIP
+    grid = SensitivityGrid(_df["price"].to_numpy(dtype="float64"), codes, len(labels) + 1)
+    return grid, pd.Index(labels).append(pd.Index(["(no ZIP)"]))
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _simulator(version: str, years: int, returns: tuple, hold_rate: float, seed: int,
+               options: tuple, _prices: np.ndarray, _mu: np.ndarray,
+               _sg: np.ndarray) -> tuple[PortfolioSimulator, threading.Lock]:
+    """
+    One simulator per (dataset, horizon, μ/σ source, hold rate, seed, options).
 
-    return mu_g, sig_g, per_zip
+    It is extended in place when more simulations are asked for and read by
+    prefix when fewer are, so changing the count, threshold or unrelated
+    widgets never re-simulates existing draws. The lock serializes sessions
+    sharing it.
+    """
+    dtype, max_bytes, workers, method, path_opts = options
+    sim = PortfolioSimulator(_prices, _mu, _sg, years, hold_rate, seed=seed, dtype=dtype,
+                             max_bytes=max_bytes, workers=workers, method=method,
+                             pool=shared_pool() if workers > 1 else None,
+                             **(dict(zip(("engine", "rent_yield", "take_profit", "stop_loss"),
+                                         ("paths",) + path_opts)) if path_opts else {}))
+    return sim, threading.Lock()
 
 
-df = prepare()
+version = dataset_version("data")
+df = prepare(version)
 if df.empty or "price" not in df.columns:
     st.warning("Need prices in /data.")
     st.stop()
@@ -107,7 +133,17 @@ with c3:
 with c4:
     by_zip = st.checkbox("Summaries by ZIP", value=True)
 
-mu_g, sig_g, per_zip = _empirical_returns(df)
+GROWTH_SOURCES = {"Listing-year medians": None, "Repeat sales · ZIP": "zipCode",
+                  "Repeat sales · city": "city"}
+source = st.radio("Growth source", list(GROWTH_SOURCES), horizontal=True,
+                  help="Repeat sales estimates growth from price changes of the same "
+                       "home across its listing history, so it isn't skewed by which "
+                       "homes happen to be listed each year.")
+if GROWTH_SOURCES[source] is None:
+    zip_returns, zip_rows = _empirical_returns(version, df)
+else:
+    zip_returns, zip_rows = _repeat_sales_returns(version, GROWTH_SOURCES[source], df)
+mu_g, sig_g = zip_returns.mu_g, zip_returns.sig_g
 
 if mode == "Deterministic":
     g = st.number_input("Annual growth assumption %",
@@ -139,6 +175,65 @@ if mode == "Deterministic":
         ).properties(height=360).interactive()
         st.altair_chart(chart, use_container_width=True)
 
+    with st.expander("Sensitivity grid", expanded=False):
+        s1, s2, s3, s4 = st.columns(4)
+        g_lo, g_hi = s1.slider("Growth range %", -10.0, 15.0, (-2.0, 8.0), 0.5)
+        g_step = s2.number_input("Growth step %", value=1.0, min_value=0.25, step=0.25)
+        # the current holding cost is always an option, whatever its value
+        hold_pick = round(float(hold_rate), 2)
+        rates = s3.multiselect("Holding cost %",
+                               sorted({0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, hold_pick}),
+                               default=sorted({0.0, 1.0, 2.0, hold_pick}))
+        sens_metric = s4.radio("Show", ["Median net gain", "Share profitable"])
+        growths = np.round(np.arange(g_lo, g_hi + g_step / 2, g_step), 4)
+        horizons = np.array([1, 5, 10, 25, 50])
+        rates = np.array(sorted(rates) or [hold_rate])
+        # every (growth, horizon, rate) cell in one broadcast; ZIP medians and
+        # shares for all cells come from the cached sorted prices
+        factor = net_factor(growths[:, None, None] / 100, horizons[None, :, None],
+                            rates[None, None, :] / 100)
+        sens, zip_labels = _sensitivity_grid(version, df)
+
+        v1, v2 = st.columns([1, 3])
+        rate_pick = v1.select_slider("Holding cost % (slice)", options=rates.tolist(),
+                                     value=rates[np.argmin(np.abs(rates - hold_rate))].item())
+        layout = v2.radio("Heatmap", ["Growth × horizon", "ZIP × growth"], horizontal=True)
+        ri = int(np.flatnonzero(rates == rate_pick)[0])
+        fmt = ",.0f" if sens_metric == "Median net gain" else ".0%"
+
+        def _cells(values, rows, cols, row_name, col_name):
+            r_, c_ = np.meshgrid(np.arange(len(rows)), np.arange(len(cols)), indexing="ij")
+            return pd.DataFrame({row_name: np.asarray(rows)[r_.ravel()],
+                                 col_name: np.asarray(cols)[c_.ravel()],
+                                 "value": np.asarray(values).ravel()})
+
+        if layout == "Growth × horizon":
+            scope = v1.selectbox("Scope", ["All listings"] + zip_labels[:-1].tolist())
+            gi = -1 if scope == "All listings" else int(zip_labels.get_loc(scope))
+            vals = (sens.medians(factor, gi) if sens_metric == "Median net gain"
+                    else sens.shares(factor, thresh, gi))[:, :, ri]
+            cells = _cells(vals, growths, horizons, "growth_%", "years")
+            x_enc, y_enc = alt.X("years:O", title="Horizon (years)"), \
+                alt.Y("growth_%:O", title="Annual growth %", sort="descending")
+        else:
+            h_pick = v1.select_slider("Horizon (slice)", options=horizons.tolist(),
+                                      value=int(horizon))
+            hi = int(np.flatnonzero(horizons == h_pick)[0])
+            vals = (sens.medians(factor, None) if sens_metric == "Median net gain"
+                    else sens.shares(factor, thresh, None))[:, :, hi, ri]
+            top = np.argsort(-sens.rows[:-1], kind="stable")[:30]  # busiest ZIPs
+            cells = _cells(vals[top], zip_labels[top], growths, "zipCode", "growth_%")
+            x_enc, y_enc = alt.X("growth_%:O", title="Annual growth %"), \
+                alt.Y("zipCode:N", title="ZIP")
+        heat = alt.Chart(cells).mark_rect().encode(
+            x=x_enc, y=y_enc,
+            color=alt.Color("value:Q", title=sens_metric,
+                            scale=alt.Scale(scheme="redyellowgreen", domainMid=0
+                                            if sens_metric == "Median net gain" else 0.5)),
+            tooltip=[c for c in cells.columns[:2]] + [alt.Tooltip("value:Q", format=fmt)],
+        ).properties(height=420)
+        st.altair_chart(heat, use_container_width=True)
+
     with st.expander("Rows with projections", expanded=False):
         cols = [c for c in ("formattedAddress", "zipCode", "bedrooms",
                             "price", "proj_value", "net_gain") if c in out.columns]
@@ -152,46 +247,87 @@ else:  # Monte Carlo
         "Mean annual log-return μ (%)", value=round(mu_g*100, 2), step=0.05)/100.0
     sig_user = st.number_input(
         "Volatility σ (%)", value=round(sig_g*100, 2), step=0.05)/100.0
-    use_zip_params = st.checkbox("Use per-ZIP μ,σ when available", value=True)
+    use_zip_params = st.checkbox("Use per-ZIP (or per-city) μ,σ when available", value=True)
+    engine = st.radio("Engine", ["Terminal value", "Yearly paths"], horizontal=True,
+                      help="Yearly paths step every scenario year by year, so cash flows "
+                           "follow the simulated value and holdings can be sold early.")
+    paths = engine == "Yearly paths"
+    if paths:
+        p1, p2, p3 = st.columns(3)
+        rent_yield = p1.number_input("Net rent yield %", value=0.0, min_value=0.0,
+                                     max_value=20.0, step=0.1,
+                                     help="Annual rent income as % of current value.")
+        take_profit = p2.number_input("Sell at gain ≥ % of price (0 = never)", value=0.0,
+                                      min_value=0.0, step=5.0)
+        stop_loss = p3.number_input("Sell at loss ≥ % of price (0 = never)", value=0.0,
+                                    min_value=0.0, step=5.0)
+    with st.expander("Simulation memory", expanded=False):
+        m1, m2, m3 = st.columns(3)
+        mem_mb = m1.number_input("Memory ceiling (MB)", min_value=16, max_value=8192,
+                                 value=MC_MAX_BYTES // 2**20, step=16)
+        use_f32 = m2.checkbox("Single precision (float32)", value=False,
+                              help="Halves memory; draws differ slightly from float64.")
+        workers = int(m3.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1,
+                                      value=1, step=1,
+                                      help="Split simulations across processes. Results are "
+                                           "reproducible for a given seed and worker count."))
+    with st.expander("Variance reduction", expanded=False):
+        v1, v2, v3 = st.columns(3)
+        sampling = v1.selectbox("Sampling", ["Plain", "Antithetic"] +
+                                ([] if paths else ["Quasi-random (Halton)"]),
+                                help="Antithetic pairs every draw with its mirror image; "
+                                     "Halton uses scrambled low-discrepancy points, which "
+                                     "help most for small portfolios.")
+        use_cv = v2.checkbox("Control variate", value=False, disabled=paths,
+                             help="Corrects estimates using the exact lognormal mean "
+                                  "of the simulated property values (terminal engine).")
+        auto = v3.checkbox("Auto: stop at target SE", value=False,
+                           help="Simulates in batches until the expected net gain's "
+                                "standard error reaches the target; the Simulations "
+                                "slider becomes the maximum.")
+        target_se = v3.number_input("Target SE ($)", min_value=1.0, value=1000.0, step=100.0,
+                                    disabled=not auto)
 
     prices = df["price"].astype("float64").to_numpy()
     r = hold_rate / 100.0
     Y = int(horizon)
 
-    # choose mu,sigma per row
-    if use_zip_params and "zipCode" in df and per_zip:
-        mu = df["zipCode"].map(lambda z: per_zip.get(str(z), (mu_user, sig_user))[
-                               0]).astype("float64").to_numpy()
-        sg = df["zipCode"].map(lambda z: per_zip.get(str(z), (mu_user, sig_user))[
-                               1]).astype("float64").to_numpy()
+    # choose mu,sigma per row (one gather from the per-ZIP arrays)
+    use_zip = use_zip_params and len(zip_returns) > 0
+    if use_zip:
+        mu, sg = zip_returns.take(zip_rows, mu_user, sig_user)
     else:
         mu = np.full(len(prices), mu_user, dtype="float64")
         sg = np.full(len(prices), sig_user, dtype="float64")
 
-    # simulate terminal values (vectorized per listing)
-    rng = np.random.default_rng(42)
-    # log-returns per year summed over horizon ~ Normal(Y*mu, Y*sg^2)
-    mu_T = mu*Y
-    sg_T = sg*np.sqrt(Y)
-    z = rng.normal(loc=0.0, scale=1.0, size=(sims, len(prices)))
-    # terminal gross multiplier
-    mult = np.exp(mu_T + sg_T*z)
-    fv = prices * mult
-    # holding cost (geometric)
-    geom_sum = np.where(mu != 0, (np.exp(mu*Y) - 1.0)/mu, Y)
-    hold = prices * r * geom_sum
-    net = fv - prices - hold
-    # portfolio distribution across listings (median per sim)
-    port_net = np.nanmedian(net, axis=1)
-
-    prob_profit = float((port_net > thresh).mean())
-    var5 = float(np.quantile(port_net, 0.05))
-    mean_net = float(np.mean(port_net))
+    # log-returns per year summed over horizon ~ Normal(Y*mu, Y*sg^2);
+    # simulated in chunks of scenarios under the memory ceiling, keeping
+    # only the portfolio distribution across listings (median per sim)
+    method = {"Plain": "mc", "Antithetic": "antithetic",
+              "Quasi-random (Halton)": "halton"}[sampling]
+    path_opts = (rent_yield / 100.0, take_profit / 100.0 or None,
+                 stop_loss / 100.0 or None) if paths else None
+    returns = ("local" if use_zip else "flat", source,
+               mu_user, sig_user)
+    options = ("float32" if use_f32 else "float64", int(mem_mb) * 2**20, workers, method,
+               path_opts)
+    sim, lock = _simulator(version, Y, returns, r, 42, options, prices, mu, sg)
+    with lock:
+        if auto:
+            n_used = sim.run_until(target_se, sims, thresh=thresh, control=use_cv)
+        else:
+            n_used = min(sims, sim.ensure(sims).sims)
+        port_net = sim.port_net[:n_used]
+        est = sim.summary(thresh, control=use_cv, sims=n_used)
+    prob_profit, var5, mean_net = est["prob"], est["var5"], est["mean"]
 
     k1, k2, k3 = st.columns(3)
     k1.metric("P(net gain > threshold)", f"{prob_profit*100:.1f}%")
     k2.metric("Portfolio VaR (5%)", f"${var5:,.0f}")
     k3.metric("Expected net gain", f"${mean_net:,.0f}")
+    st.caption(f"{est['sims']:,} simulations · standard error ±{est['prob_se']*100:.2f} pts "
+               f"on P(net gain), ±${est['mean_se']:,.0f} on expected net gain."
+               + (f" On average {est['sold']*100:.1f}% of holdings were sold early." if paths else ""))
 
     # distribution chart
     dist = pd.DataFrame({"net_gain": port_net})
@@ -1,11 +1,17 @@
 # app/pages/Stability.py
 from __future__ import annotations
+import os
 from pathlib import Path
 import numpy as np
 import pandas as pd
 import streamlit as st
 import altair as alt
 from utils.style import apply_theme
+from utils.io import dataset_version
+from utils.vcache import version_cache
+from utils.pool import shared_pool
+from utils.bootstrap import BLB_MIN, ASYMPTOTIC_MIN, StabilityStore
+from utils.sketch import SketchStore
 
 st.set_page_config(page_title="Stability", page_icon="🧭", layout="wide")
 apply_theme()
@@ -24,8 +30,8 @@ def _load_csv_from_repo() -> pd.DataFrame:
         return pd.DataFrame()
 
 
-@st.cache_data(show_spinner=False)
-def prepare() -> pd.DataFrame:
+@version_cache(max_bytes=None)
+def prepare(version: str) -> pd.DataFrame:
     df = _load_csv_from_repo()
     if df.empty:
         return df
@@ -42,7 +48,8 @@ def prepare() -> pd.DataFrame:
     return df
 
 
-df = prepare()
+version = dataset_version("data")
+df = prepare(version)
 if df.empty:
     st.warning("No data found.")
     st.stop()
@@ -57,6 +64,20 @@ col_map = {"Price": "price", "Price per sqft": "pps",
            "Days on Market": "daysOnMarket"}
 mcol = col_map[metric]
 gcol = "zipCode" if group_choice == "ZIP" else "bedrooms"
+approx = st.toggle("Approximate (sketch)", value=False,
+                   help="Read medians and quartiles from per-group quantile sketches "
+                        "(about 1% error, no bootstrap CI) instead of recomputing them.")
+with st.expander("Confidence intervals", expanded=False):
+    c1, c2 = st.columns(2)
+    ci_mode = c1.radio("Method", ["Exact bootstrap", "Scalable"], horizontal=True,
+                       help=f"Scalable: Bag of Little Bootstraps for groups of {BLB_MIN:,}+ "
+                            f"listings and an analytic interval from {ASYMPTOTIC_MIN:,}, "
+                            "so CI time stays bounded for very large groups.")
+    ci_workers = int(c2.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1,
+                                     value=1, step=1, disabled=ci_mode != "Scalable",
+                                     help="Spread groups across processes (scalable mode). "
+                                          "Results don't depend on the worker count."))
+ci = "scalable" if ci_mode == "Scalable" else "exact"
 
 if mcol not in df.columns or gcol not in df.columns:
     st.info(f"Need '{mcol}' and '{gcol}' in data.")
@@ -65,45 +86,48 @@ if mcol not in df.columns or gcol not in df.columns:
 # compute stability & CI
 
 
-def stability_score(arr: np.ndarray) -> float:
-    arr = arr[np.isfinite(arr)]
-    if arr.size < 4:
-        return np.nan
-    med = np.median(arr)
-    iqr = np.subtract(*np.percentile(arr, [75, 25]))
-    return float(max(0.0, 1.0 - (iqr/med)) * 100.0) if med > 0 else np.nan
-
-
-@st.cache_data(show_spinner=False)
-def compute_table(df: pd.DataFrame, gcol: str, mcol: str) -> pd.DataFrame:
-    rows = []
-    rng = np.random.default_rng(7)
-    for g, sub in df[[gcol, mcol]].dropna().groupby(gcol):
-        x = sub[mcol].to_numpy(dtype="float64")
-        if x.size < 6:
-            rows.append((g, np.median(x) if x.size else np.nan,
-                        np.nan, np.nan, x.size, np.nan))
-            continue
-        # bootstrap CI
-        B = min(400, 50 + x.size)  # quick & light
-        stats = []
-        for _ in range(B):
-            bs = x[rng.integers(0, x.size, size=x.size)]
-            stats.append(stability_score(bs))
-        stats = np.array(stats, dtype="float64")
-        ci_lo, ci_hi = float(np.nanpercentile(stats, 2.5)), float(
-            np.nanpercentile(stats, 97.5))
-        score = stability_score(x)
-        outlier_share = float(np.mean((x < np.percentile(x, 25)-1.5*np.subtract(*np.percentile(x, [75, 25]))) |
-                                      (x > np.percentile(x, 75)+1.5*np.subtract(*np.percentile(x, [75, 25])))))
-        rows.append((g, float(np.median(x)), score,
-                    outlier_share, x.size, (ci_lo, ci_hi)))
-    tbl = pd.DataFrame(
-        rows, columns=[gcol, "median", "stability", "outlier_share", "n", "ci"])
-    return tbl.sort_values("stability", ascending=False)
-
-
-tbl = compute_table(df, gcol, mcol)
+@st.cache_resource(show_spinner=False)
+def _stability_store() -> StabilityStore:
+    # every metric x grouping table for the current dataset version
+    return StabilityStore()
+
+
+@st.cache_resource(show_spinner=False)
+def _sketch_store() -> SketchStore:
+    return SketchStore(("price", "pps", "daysOnMarket"))
+
+
+def sketch_table(version: str, df: pd.DataFrame, gcol: str, mcol: str) -> pd.DataFrame:
+    """Approximate stability table from the quantile sketches (no CI)."""
+    store = _sketch_store()
+    store.sync(version, df)
+    groups = store.sketches[mcol].grouped((gcol,))
+    q1, med, q3 = (groups.quantile(q) for q in (0.25, 0.5, 0.75))
+    n = groups.n
+    iqr = q3 - q1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = np.where((n >= 6) & (med > 0), np.maximum(0.0, 1.0 - iqr / med) * 100.0, np.nan)
+    g = np.arange(n.size)
+    below_lo, _ = groups.cdf(g, q1 - 1.5 * iqr)
+    below_hi, eq_hi = groups.cdf(g, q3 + 1.5 * iqr)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        outlier = np.where(n >= 6, (below_lo + n - below_hi - eq_hi) / n, np.nan)
+    labels = groups.labels.to_series(index=None)
+    tbl = pd.DataFrame({
+        gcol: pd.to_numeric(labels, errors="coerce").to_numpy(dtype="float64") if gcol == "bedrooms" else labels.to_numpy(),
+        "median": med, "stability": score, "outlier_share": outlier, "n": n, "ci": np.nan,
+    })
+    return tbl[tbl["n"] > 0].sort_values("stability", ascending=False)
+
+
+if approx:
+    tbl = sketch_table(version, df, gcol, mcol)
+else:
+    store = _stability_store()
+    store.sync(version, df)
+    workers = ci_workers if ci == "scalable" else 1
+    tbl = store.table(gcol, mcol, ci, workers, shared_pool() if workers > 1 else None)
+    store.warm_async(ci)  # the other metric/grouping tables, in the background
 
 # show chart with CI bands
 chart_data = tbl.dropna(subset=["stability"]).copy()
@@ -136,7 +160,7 @@ if not dist.empty:
         mcol, as_=[mcol, "density"]
     ).mark_area(opacity=0.6).encode(x=alt.X(f"{mcol}:Q", title=metric), y="density:Q")
     st.altair_chart(density.properties(height=260), use_container_width=True)
-st.caption("Stability = (1 − IQR/median)×100 with 95% bootstrap CI. Lower outlier share and higher stability indicate steadier pricing.")
+st.caption("Stability = (1 − IQR/median)×100 with 95% bootstrap CI (exact mode only). Lower outlier share and higher stability indicate steadier pricing.")
 
 
 # -------------------------------------------------------
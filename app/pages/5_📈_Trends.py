@@ -7,6 +7,10 @@ import altair as alt
 import streamlit as st
 from pathlib import Path
 from utils.style import apply_theme
+from utils.io import dataset_version
+from utils.vcache import version_cache
+from utils.repeat_sales import RepeatSalesIndex, cached_sale_pairs
+from utils.sketch import SketchStore
 
 st.set_page_config(page_title="Trends", page_icon="📈", layout="wide")
 apply_theme()
@@ -44,33 +48,43 @@ def _s(df: pd.DataFrame, col: str) -> pd.Series:
 
 
 # ---------------- load + light clean ----------------
-df = _load_csv_from_repo()
+@version_cache(max_bytes=None)
+def prepare(version: str) -> pd.DataFrame:
+    """Load and clean the listings once per dataset version."""
+    df = _load_csv_from_repo()
+    if df.empty:
+        return df
+
+    # essential numeric coercions
+    for c in ("price", "bedrooms", "bathrooms", "squareFootage", "daysOnMarket", "yearBuilt"):
+        if c in df:
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+
+    # normalize zip as string (keep leading zeros if present)
+    if "zipCode" in df:
+        df["zipCode"] = df["zipCode"].astype(str).str.extract(
+            r"(\d{5})", expand=False).fillna(df["zipCode"].astype(str))
+
+    # $/sqft if available
+    if {"price", "squareFootage"}.issubset(df.columns):
+        df["price_per_sqft"] = np.where(
+            df["squareFootage"] > 0, df["price"] / df["squareFootage"], np.nan)
+
+    # pretty address for tables
+    if "formattedAddress" in df:
+        df["addr"] = df["formattedAddress"].fillna("")
+    else:
+        df["addr"] = (_s(df, "addressLine1") + ", " + _s(df, "city") +
+                      ", " + _s(df, "state") + " " + _s(df, "zipCode")).str.strip(", ")
+    return df
+
+
+version = dataset_version("data")
+df = prepare(version)
 if df.empty:
     st.warning("No data found under /data.")
     st.stop()
 
-# essential numeric coercions
-for c in ("price", "bedrooms", "bathrooms", "squareFootage", "daysOnMarket", "yearBuilt"):
-    if c in df:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-
-# normalize zip as string (keep leading zeros if present)
-if "zipCode" in df:
-    df["zipCode"] = df["zipCode"].astype(str).str.extract(
-        r"(\d{5})", expand=False).fillna(df["zipCode"].astype(str))
-
-# $/sqft if available
-if {"price", "squareFootage"}.issubset(df.columns):
-    df["price_per_sqft"] = np.where(
-        df["squareFootage"] > 0, df["price"] / df["squareFootage"], np.nan)
-
-# pretty address for tables
-if "formattedAddress" in df:
-    df["addr"] = df["formattedAddress"].fillna("")
-else:
-    df["addr"] = (_s(df, "addressLine1") + ", " + _s(df, "city") +
-                  ", " + _s(df, "state") + " " + _s(df, "zipCode")).str.strip(", ")
-
 st.title("📈 Trends")
 
 # ---------------- filters ----------------
@@ -147,12 +161,34 @@ if group_col not in filtered.columns or "price" not in filtered.columns:
     st.info(f"Need '{group_col}' and 'price' columns for this view.")
     st.stop()
 
-agg = (
-    filtered.dropna(subset=[group_col, "price"])
-    .groupby(group_col, dropna=False)["price"]
-    .agg(["count", "mean", "median"]).reset_index()
-    .sort_values("mean", ascending=False)
-)
+approx = st.toggle("Approximate (sketch)", value=False,
+                   help="Merge per-group quantile sketches for these filters instead of "
+                        "grouping the listings (medians/means within about 1%).")
+
+
+@st.cache_resource(show_spinner=False)
+def _sketch_store() -> SketchStore:
+    return SketchStore(("price",))
+
+
+if approx:
+    store = _sketch_store()
+    store.sync(version, df)
+    where = {"state": state_sel, "city": city_sel, "zipCode": zip_sel,
+             "status": status_sel, "propertyType": type_sel}
+    tbl = store.sketches["price"].grouped((group_col,), where).table((0.5,))
+    keys = tbl.index.to_series()
+    agg = pd.DataFrame({
+        group_col: pd.to_numeric(keys, errors="coerce").to_numpy(dtype="float64") if group_col == "bedrooms" else keys.to_numpy(),
+        "count": tbl["n"].to_numpy(), "mean": tbl["mean"].to_numpy(), "median": tbl[0.5].to_numpy(),
+    }).sort_values("mean", ascending=False)
+else:
+    agg = (
+        filtered.dropna(subset=[group_col, "price"])
+        .groupby(group_col, dropna=False)["price"]
+        .agg(["count", "mean", "median"]).reset_index()
+        .sort_values("mean", ascending=False)
+    )
 st.subheader(f"Average Price by {group_col}")
 st.dataframe(
     agg.rename(columns={"count": "# Listings",
@@ -189,6 +225,47 @@ chart = (
 )
 st.altair_chart(chart, use_container_width=True)
 
+# ---------------- repeat-sales price index ----------------
+@version_cache
+def _repeat_sales(version: str, by: str | None, _df: pd.DataFrame) -> RepeatSalesIndex:
+    return RepeatSalesIndex(_df, cached_sale_pairs(version, _df), by)
+
+
+st.subheader("Price index (repeat sales)")
+level = st.radio("Index by", ("Market", "City", "ZIP Code"), horizontal=True,
+                 help="Quarterly index from price changes of the same home across its "
+                      "listing history (first quarter = 100).")
+by = {"Market": None, "City": "city", "ZIP Code": "zipCode"}[level]
+rsi = _repeat_sales(version, by, df)
+if by is None:
+    shown = rsi.groups
+else:
+    # the filtered groups with the most price pairs
+    in_view = pd.Index(filtered[by].dropna().astype(str).unique())
+    shown = pd.Series(rsi.n_pairs, index=rsi.groups)
+    shown = shown[shown.index.isin(in_view)].nlargest(8).index
+idx_df = rsi.frame(shown)
+if idx_df.empty:
+    st.info("Not enough repeat price events in the listing history for an index.")
+else:
+    st.altair_chart(
+        alt.Chart(idx_df).mark_line(point=True).encode(
+            x=alt.X("period:T", title="Quarter"),
+            y=alt.Y("index:Q", title="Index (first quarter = 100)", scale=alt.Scale(zero=False)),
+            color=alt.Color("group:N", title=level, legend=None if by is None else alt.Legend()),
+            tooltip=["group", alt.Tooltip("period:T", format="%Y-Q%q"),
+                     alt.Tooltip("index", format=",.1f"), alt.Tooltip("period_pairs", title="# pairs starting/ending")],
+        ).properties(height=320).interactive(),
+        use_container_width=True)
+    growth = rsi.returns(min_pairs=1)
+    keep = growth.zips.isin(shown)
+    st.dataframe(pd.DataFrame({
+        level: growth.zips[keep],
+        "Annual growth %": (np.expm1(growth.mu[keep]) * 100).round(2),
+        "Volatility %": (growth.sigma[keep] * 100).round(2),
+        "# pairs": pd.Series(rsi.n_pairs, index=rsi.groups).reindex(growth.zips[keep]).to_numpy(),
+    }), use_container_width=True, hide_index=True)
+
 # --- NEW: listings for the selected bar/group ---
 if pick != "(select)":
     sub = filtered[filtered[group_col].astype(str) == pick]
@@ -0,0 +1,442 @@
+# app/utils/bootstrap.py
+from __future__ import annotations
+
+import threading
+import warnings
+from concurrent.futures import Executor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.pool import pool_or_spawn
+
+# Cap on the resample buffers held at once by the batched bootstrap
+BOOT_MAX_BYTES = 64 * 2**20
+
+# Groups smaller than this get a median only
+MIN_GROUP = 6
+
+STABILITY_COLS = ("median", "stability", "outlier_share", "n", "ci_lo", "ci_hi")
+
+# CI modes: "exact" reproduces the serial bootstrap; "scalable" gives every
+# group its own stream, switches to Bag of Little Bootstraps from BLB_MIN
+# rows and to the analytic interval from ASYMPTOTIC_MIN, and can use a pool
+BOOT_CI_METHODS = ("exact", "scalable")
+BLB_MIN = 5_000
+ASYMPTOTIC_MIN = 250_000
+BLB_SUBSETS, BLB_REPS, BLB_GAMMA = 10, 100, 0.7
+
+# Tables the Stability page offers: metric x grouping
+STABILITY_METRICS = ("price", "pps", "daysOnMarket")
+STABILITY_GROUPS = ("zipCode", "bedrooms")
+
+_Z975 = 1.959963984540054
+_QUARTILES = np.array([0.25, 0.5, 0.75])
+
+
+def boot_reps(n: int) -> int:
+    """Bootstrap replicates for a group of n: quick & light."""
+    return min(400, 50 + n)
+
+
+def stability_scores(samples: np.ndarray) -> np.ndarray:
+    """
+    (1 - IQR/median) * 100 along the last axis, floored at 0; NaN where the
+    median isn't positive. Same arithmetic as the per-sample version.
+    """
+    q75, q25 = np.percentile(samples, [75, 25], axis=-1)
+    med = np.median(samples, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(med > 0, np.maximum(0.0, 1.0 - (q75 - q25) / med) * 100.0, np.nan)
+
+
+class _Batches:
+    """
+    Groups waiting for their bootstrap, bucketed by size.
+
+    Same-size groups share B, so their (B x n) resamples stack into one
+    (groups x B x n) array and every quantile is one call per bucket. A
+    bucket is flushed when the pending resamples would pass `max_bytes`.
+    """
+
+    def __init__(self, out: dict[str, np.ndarray], max_bytes: int):
+        self.out, self.max_bytes = out, max_bytes
+        self.pending: dict[int, list[tuple[int, np.ndarray, np.ndarray]]] = {}
+        self.bytes = 0
+
+    def add(self, g: int, x: np.ndarray, idx: np.ndarray) -> None:
+        self.pending.setdefault(x.size, []).append((g, x, idx))
+        self.bytes += 2 * idx.nbytes  # the indices plus the gathered values
+        while self.bytes > self.max_bytes and self.pending:
+            self.flush(max(self.pending, key=lambda n: n * len(self.pending[n])))
+
+    def flush(self, size: int | None = None) -> None:
+        for n in ([size] if size is not None else list(self.pending)):
+            items = self.pending.pop(n)
+            self.bytes -= sum(2 * it[2].nbytes for it in items)
+            gs = np.array([it[0] for it in items])
+            x = np.stack([it[1] for it in items])                        # (k, n)
+            boot = np.take_along_axis(x[:, None, :], np.stack([it[2] for it in items]), axis=-1)
+            _finish(self.out, gs, x, stability_scores(boot))
+
+
+def _point(out: dict[str, np.ndarray], gs: np.ndarray, x: np.ndarray) -> None:
+    """Median, stability and outlier share for groups `gs` (data rows `x`)."""
+    q75, q25 = np.percentile(x, [75, 25], axis=-1)
+    iqr = q75 - q25
+    lo, hi = (q25 - 1.5 * iqr)[:, None], (q75 + 1.5 * iqr)[:, None]
+    out["median"][gs] = np.median(x, axis=-1)
+    out["stability"][gs] = stability_scores(x)
+    out["outlier_share"][gs] = np.mean((x < lo) | (x > hi), axis=-1)
+
+
+def _finish(out: dict[str, np.ndarray], gs: np.ndarray, x: np.ndarray,
+            stats: np.ndarray) -> None:
+    """Point estimates for groups `gs` and percentile CIs from their replicates."""
+    _point(out, gs, x)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN replicates -> NaN CI
+        out["ci_lo"][gs] = np.nanpercentile(stats, 2.5, axis=-1)
+        out["ci_hi"][gs] = np.nanpercentile(stats, 97.5, axis=-1)
+
+
+def _resample(batches: _Batches, g: int, x: np.ndarray, rng: np.random.Generator) -> None:
+    """Queue group g's full bootstrap, or run it in slices of replicates if too big."""
+    n, B = x.size, boot_reps(x.size)
+    if 2 * B * n * 8 <= batches.max_bytes:
+        batches.add(g, x, rng.integers(0, n, size=(B, n)))
+        return
+    step = max(1, batches.max_bytes // (2 * n * 8))
+    stats = np.concatenate([stability_scores(x[rng.integers(0, n, size=(min(step, B - b), n))])
+                            for b in range(0, B, step)])
+    _finish(batches.out, np.array([g]), x[None, :], stats[None, :])
+
+
+def _counted_scores(xs: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Stability scores of resamples given as multiplicities over sorted points.
+
+    xs is a sorted subset of b points, counts (r, b) how often each is drawn
+    in each size-n resample. The quartiles are read off cumulative counts
+    with one searchsorted (rows laid end to end), so a resample costs O(b)
+    rather than O(n); same linear interpolation as np.percentile.
+    """
+    r, b = counts.shape
+    n = int(counts[0].sum())
+    h = (n - 1) * _QUARTILES
+    lo = np.floor(h).astype(np.int64)
+    ranks = np.concatenate([lo, np.minimum(lo + 1, n - 1)])
+    rows = np.arange(r, dtype=np.int64)[:, None]
+    cum = np.cumsum(counts, axis=1) + rows * n
+    pos = np.searchsorted(cum.ravel(), ranks[None, :] + rows * n, side="right") - rows * b
+    v = xs[pos]
+    q25, med, q75 = (v[:, :3] + (v[:, 3:] - v[:, :3]) * (h - lo)).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(med > 0, np.maximum(0.0, 1.0 - (q75 - q25) / med) * 100.0, np.nan)
+
+
+def _blb_ci(x: np.ndarray, rng: np.random.Generator, subsets: int = BLB_SUBSETS,
+            reps: int = BLB_REPS, gamma: float = BLB_GAMMA) -> tuple[float, float]:
+    """
+    Bag of Little Bootstraps 95% CI (Kleiner et al.).
+
+    `subsets` disjoint subsets of b = n^gamma points; each gets `reps`
+    size-n resamples drawn as multinomial counts over its b points. Each
+    subset's percentile interval is taken relative to the subset's own
+    score, and the averaged offsets are applied to the full-sample score:
+    averaging the raw intervals would carry the subsets' scatter around the
+    full score into both endpoints. Cost is subsets x reps x b instead of
+    B x n.
+    """
+    n = x.size
+    b = int(np.ceil(n ** gamma))
+    s = max(1, min(subsets, n // b))
+    idx = rng.permutation(n)[:s * b].reshape(s, b)
+    ci = np.empty((s, 2))
+    for j in range(s):
+        counts = rng.multinomial(n, np.full(b, 1.0 / b), size=reps)
+        xs = np.sort(x[idx[j]])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            ci[j] = np.nanpercentile(_counted_scores(xs, counts), [2.5, 97.5]) \
+                - stability_scores(xs[None, :])[0]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo, hi = stability_scores(x[None, :])[0] + np.nanmean(ci, axis=0)
+    return float(np.clip(lo, 0.0, 100.0)), float(np.clip(hi, 0.0, 100.0))
+
+
+def _asymptotic_ci(x: np.ndarray) -> tuple[float, float]:
+    """
+    Analytic 95% CI from the joint normal limit of the sample quartiles.
+
+    Quantile densities use Siddiqui's difference quotient with an n^(-1/3)
+    bandwidth; the score's variance follows by the delta method. O(n).
+    """
+    n = x.size
+    h = min(n ** (-1.0 / 3.0), 0.1)
+    q = np.percentile(x, np.concatenate([_QUARTILES, _QUARTILES - h, _QUARTILES + h]) * 100)
+    q25, med, q75 = q[:3]
+    if not med > 0:
+        return np.nan, np.nan
+    sparsity = (q[6:] - q[3:6]) / (2 * h)  # 1 / f(Q(p))
+    p = _QUARTILES
+    cov = (np.minimum.outer(p, p) - np.outer(p, p)) * np.outer(sparsity, sparsity) / n
+    grad = 100.0 * np.array([1.0 / med, (q75 - q25) / med ** 2, -1.0 / med])
+    raw = 100.0 * (1.0 - (q75 - q25) / med)
+    half = _Z975 * float(np.sqrt(max(grad @ cov @ grad, 0.0)))
+    return float(np.clip(raw - half, 0.0, 100.0)), float(np.clip(raw + half, 0.0, 100.0))
+
+
+def _scalable_groups(v: np.ndarray, starts: np.ndarray, counts: np.ndarray,
+                     seeds: list[np.random.SeedSequence], max_bytes: int, blb_min: int,
+                     asymptotic_min: int) -> dict[str, np.ndarray]:
+    """Scalable-mode results for the groups at (starts, counts) of sorted values `v`."""
+    out = {c: np.full(counts.size, np.nan) for c in STABILITY_COLS}
+    out["n"] = counts.astype(np.int64)
+    batches = _Batches(out, max_bytes)
+    for i, (s, n) in enumerate(zip(starts.tolist(), counts.tolist())):
+        x = v[s:s + n]
+        if n < MIN_GROUP:
+            out["median"][i] = np.median(x) if n else np.nan
+            continue
+        rng = np.random.default_rng(seeds[i])
+        if n < blb_min:
+            _resample(batches, i, x, rng)
+            continue
+        _point(out, np.array([i]), x[None, :])
+        out["ci_lo"][i], out["ci_hi"][i] = _asymptotic_ci(x) if n >= asymptotic_min \
+            else _blb_ci(x, rng)
+    batches.flush()
+    return out
+
+
+def _worker(shm_name: str, size: int, starts: np.ndarray, counts: np.ndarray,
+            seeds: list[np.random.SeedSequence], max_bytes: int, blb_min: int,
+            asymptotic_min: int) -> dict[str, np.ndarray]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    v = np.ndarray((size,), dtype="float64", buffer=shm.buf)
+    try:
+        return _scalable_groups(v, starts, counts, seeds, max_bytes, blb_min, asymptotic_min)
+    finally:
+        del v  # release the view before closing the mapping
+        shm.close()
+
+
+def _group_cost(n: np.ndarray, blb_min: int, asymptotic_min: int) -> np.ndarray:
+    """Rough work per group in the scalable mode, for balancing the pool."""
+    n = n.astype("float64")
+    boot = np.minimum(400, 50 + n) * n
+    blb = BLB_SUBSETS * BLB_REPS * np.ceil(n ** BLB_GAMMA) + n
+    return np.where(n < blb_min, boot, np.where(n < asymptotic_min, blb, n))
+
+
+def _run_pool(v: np.ndarray, starts: np.ndarray, counts: np.ndarray,
+              seeds: list[np.random.SeedSequence], workers: int, max_bytes: int,
+              blb_min: int, asymptotic_min: int,
+              pool: Executor | None = None) -> dict[str, np.ndarray]:
+    # longest-processing-time-first assignment of groups to workers
+    cost = _group_cost(counts, blb_min, asymptotic_min)
+    load = np.zeros(workers)
+    owner = np.empty(counts.size, dtype=np.int64)
+    for g in np.argsort(-cost, kind="stable"):
+        owner[g] = np.argmin(load)
+        load[owner[g]] += cost[g]
+    parts = [np.flatnonzero(owner == w) for w in range(workers)]
+    parts = [p for p in parts if p.size]
+    shm = shared_memory.SharedMemory(create=True, size=max(v.nbytes, 1))
+    try:
+        np.ndarray(v.shape, dtype=v.dtype, buffer=shm.buf)[:] = v
+        with pool_or_spawn(pool, len(parts)) as ex:
+            res = list(ex.map(
+                _worker, [shm.name] * len(parts), [v.size] * len(parts),
+                [starts[p] for p in parts], [counts[p] for p in parts],
+                [[seeds[g] for g in p] for p in parts],
+                [max(1, max_bytes // len(parts))] * len(parts),
+                [blb_min] * len(parts), [asymptotic_min] * len(parts)))
+    finally:
+        shm.close()
+        shm.unlink()
+    out = {c: np.full(counts.size, np.nan) for c in STABILITY_COLS}
+    out["n"] = counts.astype(np.int64)
+    for p, r in zip(parts, res):
+        for c in STABILITY_COLS:
+            out[c][p] = r[c]
+    return out
+
+
+def bootstrap_stability(codes: np.ndarray, values: np.ndarray, ngroups: int, seed: int = 7,
+                        max_bytes: int = BOOT_MAX_BYTES, ci: str = "exact", workers: int = 1,
+                        blb_min: int = BLB_MIN, asymptotic_min: int = ASYMPTOTIC_MIN,
+                        pool: Executor | None = None) -> dict[str, np.ndarray]:
+    """
+    Median, stability score, outlier share and 95% bootstrap CI per group.
+
+    ci="exact": groups are visited in code order and each draws its (B x n)
+    resample indices from one shared Generator in a single call, which is
+    the same stream as drawing the B resamples one by one; results match the
+    original per-resample loop exactly. Resamples are scored in batches of
+    same-size groups (see _Batches). A group too large for the buffer is
+    scored in slices of replicates instead. Serial; `workers` is ignored.
+
+    ci="scalable": every group gets its own stream (SeedSequence.spawn), so
+    groups can run in a process pool of `workers` (on `pool` if given, else
+    a spawned one) and results don't depend on the worker count. Groups
+    under `blb_min` rows get the same bootstrap; larger ones Bag of Little
+    Bootstraps (_blb_ci), and from `asymptotic_min` rows the analytic
+    interval (_asymptotic_ci), so CI time per group stays bounded however
+    large it grows. Point estimates are always computed on the full group.
+    """
+    if ci not in BOOT_CI_METHODS:
+        raise ValueError(f"ci must be one of {BOOT_CI_METHODS}")
+    values = np.asarray(values, dtype="float64")
+    codes = np.asarray(codes, dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=ngroups)
+    starts = np.cumsum(counts) - counts
+    v = values[order]
+
+    if ci == "scalable":
+        seeds = np.random.SeedSequence(seed).spawn(ngroups)
+        workers = min(max(1, int(workers)), int((counts >= MIN_GROUP).sum()))
+        if workers <= 1:
+            return _scalable_groups(v, starts, counts, seeds, max_bytes, blb_min, asymptotic_min)
+        return _run_pool(v, starts, counts, seeds, workers, max_bytes, blb_min, asymptotic_min,
+                         pool)
+
+    out = {c: np.full(ngroups, np.nan) for c in STABILITY_COLS}
+    out["n"] = counts.astype(np.int64)
+    rng = np.random.default_rng(seed)
+    batches = _Batches(out, max_bytes)
+    for g in range(ngroups):
+        n = int(counts[g])
+        x = v[starts[g]:starts[g] + n]
+        if n < MIN_GROUP:
+            out["median"][g] = np.median(x) if n else np.nan
+            continue
+        _resample(batches, g, x, rng)
+    batches.flush()
+    return out
+
+
+def stability_table(df: pd.DataFrame, gcol: str, mcol: str, seed: int = 7,
+                    ci: str = "exact", workers: int = 1,
+                    pool: Executor | None = None) -> pd.DataFrame:
+    """
+    Stability table per `gcol` group of `mcol`: median, stability,
+    outlier_share, n and ci (lo, hi) tuples, most stable first. `ci`,
+    `workers` and `pool` as in bootstrap_stability.
+    """
+    d = df[[gcol, mcol]].dropna()
+    codes, labels = pd.factorize(d[gcol], sort=True)
+    res = bootstrap_stability(codes, d[mcol].to_numpy(dtype="float64"), len(labels), seed,
+                              ci=ci, workers=workers, pool=pool)
+    ci = [(lo, hi) if n >= MIN_GROUP else np.nan
+          for lo, hi, n in zip(res["ci_lo"].tolist(), res["ci_hi"].tolist(), res["n"].tolist())]
+    tbl = pd.DataFrame({gcol: labels, "median": res["median"], "stability": res["stability"],
+                        "outlier_share": res["outlier_share"], "n": res["n"], "ci": ci})
+    return tbl.sort_values("stability", ascending=False)
+
+
+class StabilityStore:
+    """
+    Stability tables for every metric x grouping of one dataset version.
+
+    sync() drops the tables when the version token changes; table() returns
+    a materialized table (building it on first use) and warm() builds the
+    rest, so switching metric or grouping is a dict lookup and nothing
+    hashes the DataFrame. Safe to share between sessions: concurrent
+    requests for one table wait on a single build (a lock per key, as in
+    VersionCache.get) while other tables stay readable and buildable, and
+    warm_async() runs warm() in one background thread per version. A warm
+    belongs to the version it started on: sync() to a new version stops it
+    before its next table, and nothing it builds afterwards is kept.
+    """
+
+    def __init__(self, metrics: tuple[str, ...] = STABILITY_METRICS,
+                 groups: tuple[str, ...] = STABILITY_GROUPS):
+        self.metrics, self.groups = metrics, groups
+        self.version: str | None = None
+        self.tables: dict[tuple[str, str, str], pd.DataFrame] = {}
+        self._df: pd.DataFrame | None = None
+        self._lock = threading.Lock()
+        self._building: dict[tuple, threading.Lock] = {}
+        self._warming: tuple[threading.Thread, threading.Event] | None = None
+
+    def sync(self, version: str, df: pd.DataFrame) -> bool:
+        """Point the store at `df` for `version`; returns True if the tables were dropped."""
+        with self._lock:
+            if version == self.version:
+                return False
+            self.version, self._df, self.tables = version, df, {}
+            if self._warming is not None:
+                self._warming[1].set()  # superseded: stop before the next table
+                self._warming = None
+            return True
+
+    def table(self, gcol: str, mcol: str, ci: str = "exact", workers: int = 1,
+              pool: Executor | None = None) -> pd.DataFrame:
+        """The (gcol, mcol) table with `ci` intervals; see stability_table."""
+        with self._lock:
+            version, df = self.version, self._df
+        return self._table(version, df, (gcol, mcol, ci), workers, pool)
+
+    def _table(self, version: str | None, df: pd.DataFrame | None, key: tuple[str, str, str],
+               workers: int = 1, pool: Executor | None = None) -> pd.DataFrame:
+        with self._lock:
+            tbl = self.tables.get(key) if self.version == version else None
+            if tbl is not None:
+                return tbl
+            building = self._building.setdefault((version, *key), threading.Lock())
+        with building:
+            with self._lock:
+                tbl = self.tables.get(key) if self.version == version else None
+            if tbl is not None:
+                return tbl
+            try:
+                gcol, mcol, ci = key
+                tbl = stability_table(df, gcol, mcol, ci=ci, workers=workers, pool=pool)
+                with self._lock:
+                    if self.version == version:
+                        self.tables[key] = tbl
+            finally:
+                with self._lock:
+                    self._building.pop((version, *key), None)
+        return tbl
+
+    def pending(self, ci: str = "exact") -> list[tuple[str, str]]:
+        """(gcol, mcol) pairs present in the data whose table isn't built yet."""
+        df = self._df
+        if df is None:
+            return []
+        return [(g, m) for g in self.groups for m in self.metrics
+                if g in df and m in df and (g, m, ci) not in self.tables]
+
+    def warm(self, ci: str = "exact", stop: threading.Event | None = None) -> None:
+        """
+        Build every pending table for the current version. Stops when the
+        version changes or `stop` is set.
+        """
+        with self._lock:
+            version, df = self.version, self._df
+            todo = self.pending(ci)
+        for g, m in todo:
+            if self.version != version or (stop is not None and stop.is_set()):
+                return
+            self._table(version, df, (g, m, ci))
+
+    def warm_async(self, ci: str = "exact") -> None:
+        """
+        warm() in a daemon thread, unless one is already running for this
+        version or nothing is pending.
+        """
+        with self._lock:
+            if self._warming is not None and self._warming[0].is_alive():
+                return
+            if not self.pending(ci):
+                return
+            stop = threading.Event()
+            thread = threading.Thread(target=self.warm, args=(ci, stop), daemon=True)
+            self._warming = (thread, stop)
+            thread.start()
@@ -0,0 +1,83 @@
+# app/utils/cluster.py
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.grouped import group_median
+
+MIN_ZOOM = 3
+MAX_ZOOM = 16
+
+
+def _mercator(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Web-mercator coordinates normalized to [0, 1) like map tiles."""
+    x = lon / 360.0 + 0.5
+    s = np.sin(np.deg2rad(np.clip(lat, -85.0511, 85.0511)))
+    y = 0.5 - 0.25 * np.log((1 + s) / (1 - s)) / np.pi
+    return x, y
+
+
+class ClusterIndex:
+    """
+    Hierarchical grid clustering with one level per integer zoom.
+
+    Works like supercluster: clusters of zoom z + 1 are snapped to a grid of
+    `radius_px` screen pixels at zoom z and merged, so every level is a
+    coarsening of the one below it. Each level keeps the count-weighted
+    centroid and price stats of its clusters, and the number of clusters per
+    level is bounded by screen area rather than by listing count.
+    """
+
+    def __init__(self, lat, lon, price=None, min_zoom: int = MIN_ZOOM,
+                 max_zoom: int = MAX_ZOOM, radius_px: float = 60.0, extent: int = 256):
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        price = np.full(lat.size, np.nan) if price is None else np.asarray(price, dtype="float64")
+        self.min_zoom, self.max_zoom = min_zoom, max_zoom
+        self.levels: dict[int, pd.DataFrame] = {}
+
+        px, py = _mercator(lat, lon)
+        # cluster centroids of the level above (in mercator units) and
+        # the cluster each point belongs to; start with one cluster per point
+        cx, cy, cn = px, py, np.ones(lat.size)
+        labels = np.arange(lat.size)
+        for z in range(max_zoom, min_zoom - 1, -1):
+            cell = radius_px / (extent * 2.0 ** z)
+            ix = np.floor(cx / cell).astype(np.int64)
+            iy = np.floor(cy / cell).astype(np.int64)
+            parent, _ = pd.factorize((iy << 32) + ix)
+            k = int(parent.max()) + 1 if parent.size else 0
+
+            n = np.bincount(parent, weights=cn, minlength=k)
+            cx = np.bincount(parent, weights=cx * cn, minlength=k) / np.maximum(n, 1)
+            cy = np.bincount(parent, weights=cy * cn, minlength=k) / np.maximum(n, 1)
+            cn = n
+            labels = parent[labels]
+            self.levels[z] = self._summarize(labels, k, lat, lon, price)
+
+    @staticmethod
+    def _summarize(labels, k, lat, lon, price) -> pd.DataFrame:
+        count = np.bincount(labels, minlength=k)
+        denom = np.maximum(count, 1)
+        ok = np.isfinite(price)
+        lo = np.full(k, np.inf)
+        hi = np.full(k, -np.inf)
+        np.minimum.at(lo, labels[ok], price[ok])
+        np.maximum.at(hi, labels[ok], price[ok])
+        priced = np.bincount(labels[ok], minlength=k)
+        return pd.DataFrame({
+            "latitude": np.bincount(labels, weights=lat, minlength=k) / denom,
+            "longitude": np.bincount(labels, weights=lon, minlength=k) / denom,
+            "count": count,
+            "median_price": group_median(labels, price, k),
+            "mean_price": np.where(priced > 0, np.bincount(labels[ok], weights=price[ok], minlength=k)
+                                   / np.maximum(priced, 1), np.nan),
+            "min_price": np.where(priced > 0, lo, np.nan),
+            "max_price": np.where(priced > 0, hi, np.nan),
+        })
+
+    def clusters(self, zoom: float) -> pd.DataFrame:
+        """Clusters for a map zoom (clamped to the indexed range)."""
+        z = int(np.clip(np.floor(zoom), self.min_zoom, self.max_zoom))
+        return self.levels[z]
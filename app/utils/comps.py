@@ -0,0 +1,241 @@
+# app/utils/comps.py
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.grouped import group_median
+from utils.spatial import METERS_PER_MILE, SpatialIndex
+
+# Comparables grouping schemes offered on the Opportunities page
+GROUPINGS = {
+    "ZIP": ("zipCode",),
+    "Bedrooms": ("bedrooms",),
+    "ZIP+Bedrooms": ("zipCode", "bedrooms"),
+}
+
+COMPS_COLS = ("_grp", "group_size", "group_median", "robust_z", "percentile", "discount_%")
+
+
+def group_labels(df: pd.DataFrame, grouping: str) -> pd.Series:
+    """Group key per row, formatted like "90001 | 3" for ZIP+Bedrooms."""
+    parts = []
+    for col in GROUPINGS[grouping]:
+        s = df[col]
+        parts.append(s.astype("Int64").astype(str) if col == "bedrooms" else s.astype(str))
+    out = parts[0]
+    for p in parts[1:]:
+        out = out + " | " + p
+    return out
+
+
+def _sorted_stats(codes: np.ndarray, values: np.ndarray,
+                  ngroups: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Group sizes, medians and within-group percentile ranks from one sort."""
+    counts = np.zeros(ngroups, dtype=np.int64)
+    med = np.full(ngroups, np.nan)
+    pct = np.full(values.size, np.nan)
+    ok = np.flatnonzero(np.isfinite(values))
+    if ok.size == 0:
+        return counts, med, pct
+    order = ok[np.lexsort((values[ok], codes[ok]))]
+    k, v = codes[order], values[order]
+
+    counts = np.bincount(k, minlength=ngroups)
+    starts = np.cumsum(counts) - counts
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    med[has] = (v[lo] + v[hi]) / 2.0
+
+    # runs of equal (group, value) share the mean of their 1-based positions,
+    # as in pandas rank(pct=True, method="average")
+    new_run = np.r_[True, (k[1:] != k[:-1]) | (v[1:] != v[:-1])]
+    run = np.cumsum(new_run) - 1
+    run_start = np.flatnonzero(new_run)
+    run_end = np.r_[run_start[1:], k.size] - 1
+    pos = (run_start + run_end)[run] / 2.0
+    pct[order] = (pos - starts[k] + 1.0) / counts[k]
+    return counts, med, pct
+
+
+def comps_stats(codes: np.ndarray, values: np.ndarray, ngroups: int) -> dict[str, np.ndarray]:
+    """
+    Median, MAD-based robust z, percentile and discount for every row at once.
+
+    `codes` are integer group ids in [0, ngroups). Missing values are left out
+    of the group statistics, as pandas' skipna groupby would. Two sorts in
+    total (values, then absolute deviations), whatever the number of groups.
+    """
+    values = np.asarray(values, dtype="float64")
+    codes = np.asarray(codes, dtype=np.int64)
+    size, med, pct = _sorted_stats(codes, values, ngroups)
+    med = med[codes]
+    mad = group_median(codes, np.abs(values - med), ngroups)[codes]
+    scale = 1.4826 * mad  # Normal-equivalent MAD
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(scale > 0, (values - med) / scale, np.nan)
+        discount = (1.0 - values / med) * 100.0
+    return {
+        "group_size": size[codes],
+        "group_median": med,
+        "robust_z": z,
+        "percentile": pct,
+        "discount_%": discount,
+    }
+
+
+def comps_frame(df: pd.DataFrame, grouping: str, metric_col: str) -> pd.DataFrame:
+    """Comps statistics for `df`, one row per listing (same index)."""
+    labels = group_labels(df, grouping)
+    codes, uniques = pd.factorize(labels)
+    values = pd.to_numeric(df[metric_col], errors="coerce").to_numpy(dtype="float64")
+    # rows without a group key (-1) are kept out of every group
+    keyless = codes < 0
+    stats = comps_stats(np.where(keyless, len(uniques), codes),
+                        np.where(keyless, np.nan, values), len(uniques) + 1)
+    return pd.DataFrame({"_grp": labels, **stats}, index=df.index)
+
+
+def knn_comps(lat, lon, beds, values, k: int = 10, radius_m: float = 2 * METERS_PER_MILE,
+              bed_tol: float = 0) -> dict[str, np.ndarray]:
+    """
+    Comps statistics against each listing's `k` nearest similar listings.
+
+    Neighbors have bedrooms within `bed_tol` and lie within `radius_m`; the
+    listing itself is never its own comp. There is one spatial index per
+    bedroom count and every listing with that count is queried in one
+    batch, so the Python loop is over bedroom values, not listings.
+
+    Returns the comps_stats columns plus `comp_idx` (n, k) positions of the
+    neighbors (-1 where fewer than k were found) and `comp_miles`, the
+    median neighbor distance. Percentile is the share of comps priced below
+    the listing (ties count half).
+    """
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    beds = np.asarray(beds, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    n = values.size
+    idx = np.full((n, k), -1, dtype=np.int64)
+    dist = np.full((n, k), np.inf)
+
+    usable = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(beds)
+    pool = usable & np.isfinite(values)
+    bed_values = np.unique(beds[usable])
+    indexes = {}
+    for b in bed_values:
+        rows = np.flatnonzero(pool & (beds == b))
+        if rows.size:
+            indexes[b] = (rows, SpatialIndex(lat[rows], lon[rows]))
+
+    for b in bed_values:
+        q = np.flatnonzero(usable & (beds == b))
+        cand_i, cand_d = [], []
+        for nb, (rows, index) in indexes.items():
+            if abs(nb - b) > bed_tol:
+                continue
+            # one extra neighbor in case the listing finds itself
+            ni, nd = index.query_knn(lat[q], lon[q], k + 1, max_radius_m=radius_m)
+            ni = np.where(ni >= 0, rows[np.maximum(ni, 0)], -1)
+            nd = np.where((ni == q[:, None]) | (nd > radius_m), np.inf, nd)
+            cand_i.append(ni)
+            cand_d.append(nd)
+        if not cand_i:
+            continue
+        ci, cd = np.hstack(cand_i), np.hstack(cand_d)
+        best = np.argsort(cd, axis=1, kind="stable")[:, :k]
+        d = np.take_along_axis(cd, best, axis=1)
+        idx[q] = np.where(np.isfinite(d), np.take_along_axis(ci, best, axis=1), -1)
+        dist[q] = d
+
+    found = idx >= 0
+    codes = np.repeat(np.arange(n), found.sum(axis=1))
+    comp = values[idx[found]]
+    size, med, _ = _sorted_stats(codes, comp, n)
+    mad = group_median(codes, np.abs(comp - med[codes]), n)
+    own = values[codes]
+    below = np.bincount(codes, weights=(comp < own) + 0.5 * (comp == own), minlength=n)
+    scale = 1.4826 * mad
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(scale > 0, (values - med) / scale, np.nan)
+        discount = (1.0 - values / med) * 100.0
+        pct = np.where(size > 0, below / size, np.nan)
+    miles = group_median(codes, dist[found], n) / METERS_PER_MILE
+    return {
+        "group_size": size,
+        "group_median": med,
+        "robust_z": z,
+        "percentile": np.where(np.isfinite(values), pct, np.nan),
+        "discount_%": discount,
+        "comp_miles": miles,
+        "comp_idx": idx,
+    }
+
+
+def sketch_comps_frame(groups, df: pd.DataFrame, grouping: str, metric_col: str) -> pd.DataFrame:
+    """
+    Approximate comps_frame read from a quantile sketch (utils.sketch).
+
+    `groups` is the sketch merged by GROUPINGS[grouping]. Medians and
+    percentiles carry the sketch's relative error, and the robust z scale is
+    IQR / 1.349 (equal to 1.4826 * MAD for normal data), since a value sketch
+    can't give the MAD without a second pass.
+    """
+    g = groups.codes(df)
+    has = g >= 0
+    gi = np.maximum(g, 0)
+    values = pd.to_numeric(df[metric_col], errors="coerce").to_numpy(dtype="float64")
+    med = np.where(has, groups.quantile(0.5)[gi], np.nan)
+    scale = np.where(has, (groups.quantile(0.75) - groups.quantile(0.25))[gi] / 1.349, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(scale > 0, (values - med) / scale, np.nan)
+        discount = (1.0 - values / med) * 100.0
+    return pd.DataFrame({
+        "_grp": group_labels(df, grouping),
+        "group_size": np.where(has, groups.n[gi], 0),
+        "group_median": med,
+        "robust_z": z,
+        "percentile": groups.rank(df, values),
+        "discount_%": discount,
+    }, index=df.index)
+
+
+class ScoreTable:
+    """
+    Materialized opportunity scores for one (dataset, metric, grouping).
+
+    `frame` holds the comps columns for every listing, in table row order.
+    Filters are applied as arrays of row positions, and the best rows come
+    from a partial selection on robust z, so a top-N query never sorts the
+    whole market.
+    """
+
+    def __init__(self, frame: pd.DataFrame, comp_idx: np.ndarray | None = None):
+        self.frame = frame
+        self.comp_idx = comp_idx
+        self.size = frame["group_size"].to_numpy()
+        self._z = frame["robust_z"].to_numpy(dtype="float64")
+        self._disc = frame["discount_%"].to_numpy(dtype="float64")
+        self._pct = frame["percentile"].to_numpy(dtype="float64")
+
+    def eligible(self, rows: np.ndarray, min_comps: int) -> np.ndarray:
+        """The given row positions whose comps group is big enough."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[self.size[rows] >= min_comps]
+
+    def top(self, rows: np.ndarray, n: int) -> np.ndarray:
+        """
+        Up to `n` row positions, most undervalued first.
+
+        Order: lower robust z, then higher discount, then lower percentile,
+        with missing values last. Only the rows tied with or below the n-th
+        smallest z are sorted.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size > n > 0:
+            z = np.nan_to_num(self._z[rows], nan=np.inf)
+            kth = np.partition(z, n - 1)[n - 1]
+            rows = rows[z <= kth]
+        order = np.lexsort((self._pct[rows], -self._disc[rows], self._z[rows]))
+        return rows[order[:n]]
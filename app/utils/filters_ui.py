@@ -1,5 +1,22 @@
 import streamlit as st
 
+# Session-state keys written by the sidebar filters below
+FILTER_KEYS = (
+    "zip_code", "state", "city", "min_price", "max_price", "min_beds", "max_beds",
+    "property_type_options", "status_option", "min_year", "max_year",
+    "min_sqft", "max_sqft", "min_ppsqft", "max_ppsqft",
+)
+
+
+def filter_signature() -> tuple:
+    """Hashable snapshot of the sidebar filters, for use in cache keys."""
+    out = []
+    for k in FILTER_KEYS:
+        v = st.session_state.get(k)
+        out.append((k, tuple(v) if isinstance(v, list) else v))
+    return tuple(out)
+
+
 def render_sidebar_filters():
     """
     Shared sidebar filters for all pages.
@@ -0,0 +1,27 @@
+# app/utils/grouped.py
+from __future__ import annotations
+
+import numpy as np
+
+
+def group_median(codes: np.ndarray, values: np.ndarray, ngroups: int) -> np.ndarray:
+    """
+    Median of `values` per integer group code in one sort (NaNs ignored).
+
+    `codes` must lie in [0, ngroups); groups without finite values get NaN.
+    Matches np.median for every group, including the even-count average.
+    """
+    values = np.asarray(values, dtype="float64")
+    ok = np.isfinite(values)
+    k = np.asarray(codes)[ok]
+    v = values[ok]
+    order = np.lexsort((v, k))
+    v = v[order]
+    counts = np.bincount(k, minlength=ngroups)
+    starts = np.cumsum(counts) - counts
+    out = np.full(ngroups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    out[has] = (v[lo] + v[hi]) / 2.0
+    return out
@@ -0,0 +1,168 @@
+# app/utils/hedonic.py
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+HEDONIC_FEATURES = ("bedrooms", "bathrooms", "squareFootage", "yearBuilt", "lotSize", "hoa")
+
+# skewed features enter the model as log1p
+_LOG_FEATURES = ("squareFootage", "lotSize", "hoa")
+
+
+class HedonicModel:
+    """
+    Ridge regression of log price on listing features plus ZIP fixed effects.
+
+    The fit is kept as sufficient statistics (X'X, X'y and per-ZIP sums), so
+    listings can be added or removed by updating those sums and re-solving,
+    without another pass over the table. ZIP effects form a diagonal block,
+    which is eliminated with a Schur complement: the solve costs
+    O(zips * features^2), not O(zips^3).
+
+    Missing features are imputed with the fit-time median plus a 0/1
+    "missing" column. Centering and scaling are frozen at the first fit so
+    incremental updates stay on the same footing.
+    """
+
+    def __init__(self, alpha: float = 1.0, zip_alpha: float = 5.0, key: str = "id"):
+        self.alpha = alpha
+        self.zip_alpha = zip_alpha
+        self.key = key
+        self.features = list(HEDONIC_FEATURES)
+        self.zips: dict[str, int] = {}
+        self.n = 0
+
+    # ---------- design ----------
+
+    def _raw(self, df: pd.DataFrame) -> np.ndarray:
+        cols = []
+        for c in self.features:
+            v = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype="float64") if c in df \
+                else np.full(len(df), np.nan)
+            if c in _LOG_FEATURES:
+                v = np.log1p(np.where(v >= 0, v, np.nan))
+            cols.append(v)
+        return np.column_stack(cols) if cols else np.empty((len(df), 0))
+
+    def _design(self, df: pd.DataFrame) -> np.ndarray:
+        raw = self._raw(df)
+        miss = ~np.isfinite(raw)
+        x = (np.where(miss, self.fill, raw) - self.center) / self.scale
+        return np.column_stack([np.ones(len(df)), x, miss.astype("float64")])
+
+    def _zip_codes(self, df: pd.DataFrame, grow: bool) -> np.ndarray:
+        z = df["zipCode"].astype(str).to_numpy() if "zipCode" in df else np.full(len(df), "")
+        uniq, inv = np.unique(z, return_inverse=True)
+        if grow:
+            for u in uniq:
+                self.zips.setdefault(u, len(self.zips))
+        return np.array([self.zips.get(u, -1) for u in uniq], dtype=np.int64)[inv]
+
+    @staticmethod
+    def _target(df: pd.DataFrame) -> np.ndarray:
+        p = pd.to_numeric(df["price"], errors="coerce").to_numpy(dtype="float64")
+        return np.log(np.where(p > 0, p, np.nan))
+
+    # ---------- sufficient statistics ----------
+
+    def _accumulate(self, df: pd.DataFrame, sign: float) -> None:
+        y = self._target(df)
+        ok = np.isfinite(y)
+        df, y = df[ok], y[ok]
+        x = self._design(df)
+        z = self._zip_codes(df, grow=sign > 0)
+        nz = len(self.zips)
+        if self.zip_cnt.size < nz:
+            pad = nz - self.zip_cnt.size
+            self.zip_cnt = np.r_[self.zip_cnt, np.zeros(pad)]
+            self.zip_y = np.r_[self.zip_y, np.zeros(pad)]
+            self.zip_x = np.vstack([self.zip_x, np.zeros((pad, x.shape[1]))])
+
+        keep = z >= 0  # removing rows of a ZIP never seen is a no-op for the ZIP block
+        self.xtx += sign * (x.T @ x)
+        self.xty += sign * (x.T @ y)
+        self.zip_cnt += sign * np.bincount(z[keep], minlength=nz)
+        self.zip_y += sign * np.bincount(z[keep], weights=y[keep], minlength=nz)
+        for j in range(x.shape[1]):
+            self.zip_x[:, j] += sign * np.bincount(z[keep], weights=x[keep, j], minlength=nz)
+        self.n += int(sign) * int(ok.sum())
+
+    def _solve(self) -> None:
+        q = self.xtx.shape[0]
+        ridge = np.full(q, self.alpha)
+        ridge[0] = 0.0  # intercept is not shrunk
+        d = self.zip_cnt + self.zip_alpha
+        cd = self.zip_x / d[:, None]
+        a = self.xtx + np.diag(ridge) - self.zip_x.T @ cd
+        b = self.xty - cd.T @ self.zip_y
+        self.coef = np.linalg.lstsq(a, b, rcond=None)[0] if self.n else np.zeros(q)
+        self.zip_effect = (self.zip_y - self.zip_x @ self.coef) / d
+
+    # ---------- public API ----------
+
+    def fit(self, df: pd.DataFrame) -> HedonicModel:
+        raw = self._raw(df)
+        ok = np.isfinite(raw)
+        self.fill = np.array([np.median(raw[ok[:, j], j]) if ok[:, j].any() else 0.0
+                              for j in range(raw.shape[1])])
+        filled = np.where(ok, raw, self.fill)
+        self.center = filled.mean(axis=0) if len(df) else np.zeros(raw.shape[1])
+        std = filled.std(axis=0) if len(df) else np.ones(raw.shape[1])
+        self.scale = np.where(std > 0, std, 1.0)
+
+        q = 1 + 2 * len(self.features)
+        self.zips, self.n = {}, 0
+        self.xtx, self.xty = np.zeros((q, q)), np.zeros(q)
+        self.zip_cnt, self.zip_y, self.zip_x = np.zeros(0), np.zeros(0), np.zeros((0, q))
+        self._accumulate(df, +1.0)
+        self._solve()
+        self.rows = self._fingerprint(df)
+        return self
+
+    def update(self, added: pd.DataFrame | None = None,
+               removed: pd.DataFrame | None = None) -> HedonicModel:
+        """Fold listings in / out of the fit and re-solve."""
+        if removed is not None and len(removed):
+            self._accumulate(removed, -1.0)
+        if added is not None and len(added):
+            self._accumulate(added, +1.0)
+        self._solve()
+        return self
+
+    def sync(self, df: pd.DataFrame) -> tuple[int, int]:
+        """
+        Bring the fit in line with `df` (an upserted table) incrementally.
+
+        Rows are matched on the listing key and price; a changed price is a
+        remove + add. Returns (added, removed). Tables without the key column
+        are refit from scratch.
+        """
+        if self.key not in df or self.key not in self.rows:
+            self.fit(df)
+            return len(df), 0
+        new = self._fingerprint(df)
+        old_keys = pd.MultiIndex.from_frame(self.rows[[self.key, "price"]])
+        new_keys = pd.MultiIndex.from_frame(new[[self.key, "price"]])
+        gone = self.rows[~old_keys.isin(new_keys)]
+        fresh = new[~new_keys.isin(old_keys)]
+        self.update(added=fresh, removed=gone)
+        self.rows = new
+        return len(fresh), len(gone)
+
+    def _fingerprint(self, df: pd.DataFrame) -> pd.DataFrame:
+        cols = [c for c in (self.key, "price", "zipCode", *self.features) if c in df]
+        return df[cols].copy()
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        """Predicted log price for every row (unseen ZIPs get no ZIP effect)."""
+        z = self._zip_codes(df, grow=False)
+        effect = np.where(z >= 0, self.zip_effect[np.maximum(z, 0)], 0.0) if self.zip_effect.size \
+            else np.zeros(len(df))
+        return self._design(df) @ self.coef + effect
+
+    def discount(self, df: pd.DataFrame) -> np.ndarray:
+        """% below the model value: 100 * (1 - price / exp(prediction))."""
+        price = pd.to_numeric(df["price"], errors="coerce").to_numpy(dtype="float64")
+        with np.errstate(invalid="ignore", over="ignore"):
+            return (1.0 - price / np.exp(self.predict(df))) * 100.0
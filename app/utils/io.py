@@ -3,14 +3,35 @@ import os
 import glob
 import pandas as pd # type: ignore
 
+
+def _first_csv(data_dir: str) -> str | None:
+    csvs = sorted(glob.glob(os.path.join(data_dir, "*.csv")))
+    return csvs[0] if csvs else None
+
+
 def load_first_csv(data_dir: str = "data") -> pd.DataFrame | None:
     os.makedirs(data_dir, exist_ok=True)
-    csvs = sorted(glob.glob(os.path.join(data_dir, "*.csv")))
-    if not csvs:
+    path = _first_csv(data_dir)
+    if path is None:
         return None
     # Adjust parse_dates to match your eventual schema if needed
     try:
-        return pd.read_csv(csvs[0], low_memory=False)
+        return pd.read_csv(path, low_memory=False)
     except Exception:
         # Last resort: read without type hints
-        return pd.read_csv(csvs[0])
+        return pd.read_csv(path)
+
+
+def dataset_version(data_dir: str = "data") -> str:
+    """
+    Cheap token identifying the CSV that load_first_csv() would read.
+
+    Built from the file name, size and modification time, so it changes
+    whenever a search overwrites the data file. Use it as a cache key
+    instead of hashing the loaded DataFrame.
+    """
+    path = _first_csv(data_dir)
+    if path is None:
+        return "empty"
+    st_ = os.stat(path)
+    return f"{os.path.basename(path)}:{st_.st_size}:{st_.st_mtime_ns}"
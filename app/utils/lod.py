@@ -0,0 +1,153 @@
+# app/utils/lod.py
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.grouped import group_median
+
+# Grid cell edge lengths (meters) from coarse to fine
+LOD_CELL_SIZES_M = (4000, 2000, 1000, 500, 250)
+
+# Above this many points the maps switch from raw points to bins
+LOD_POINT_LIMIT = 5000
+
+_M_PER_DEG_LAT = 110_574.0
+_M_PER_DEG_LON = 111_320.0
+
+
+def _project(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Equirectangular meters around the mean latitude (fine at metro scale)."""
+    lat0 = np.deg2rad(np.nanmean(lat)) if lat.size else 0.0
+    return lon * _M_PER_DEG_LON * np.cos(lat0), lat * _M_PER_DEG_LAT
+
+
+def grid_bins(lat, lon, price, pps, cell_m: float) -> pd.DataFrame:
+    """
+    Aggregate points into square cells of `cell_m` meters.
+
+    One row per non-empty cell: centroid latitude/longitude, count,
+    median price and median $/sqft.
+    """
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    price = np.full(lat.size, np.nan) if price is None else np.asarray(price, dtype="float64")
+    pps = np.full(lat.size, np.nan) if pps is None else np.asarray(pps, dtype="float64")
+    x, y = _project(lat, lon)
+    ix = np.floor(x / cell_m).astype(np.int64)
+    iy = np.floor(y / cell_m).astype(np.int64)
+    codes, _ = pd.factorize((iy << 32) + (ix & 0xFFFFFFFF))
+    n = int(codes.max()) + 1 if codes.size else 0
+
+    count = np.bincount(codes, minlength=n)
+    return pd.DataFrame({
+        "latitude": np.bincount(codes, weights=lat, minlength=n) / np.maximum(count, 1),
+        "longitude": np.bincount(codes, weights=lon, minlength=n) / np.maximum(count, 1),
+        "count": count,
+        "median_price": group_median(codes, price, n),
+        "median_pps": group_median(codes, pps, n),
+        "cell_m": float(cell_m),
+    })
+
+
+def build_lod_pyramid(lat, lon, price, pps,
+                      cell_sizes: tuple[float, ...] = LOD_CELL_SIZES_M) -> dict[float, pd.DataFrame]:
+    """Bins for every resolution in `cell_sizes`, keyed by cell size."""
+    return {float(c): grid_bins(lat, lon, price, pps, c) for c in cell_sizes}
+
+
+def pick_level(pyramid: dict[float, pd.DataFrame], max_bins: int = 3000) -> pd.DataFrame:
+    """Finest level with at most `max_bins` cells (coarsest level as a fallback)."""
+    levels = sorted(pyramid.items(), key=lambda kv: kv[0])
+    for _, bins in levels:
+        if len(bins) <= max_bins:
+            return bins
+    return levels[-1][1]
+
+
+def _mercator_m(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Spherical web-mercator meters, the space deck.gl stretches bitmaps in."""
+    r = 6_378_137.0
+    s = np.sin(np.deg2rad(np.clip(lat, -85.0511, 85.0511)))
+    return np.deg2rad(lon) * r, 0.5 * np.log((1 + s) / (1 - s)) * r
+
+
+def heat_rasters(lat, lon, price, pps, cell_sizes: tuple[float, ...] = LOD_CELL_SIZES_M,
+                 max_side: int = 1024) -> dict[float, dict]:
+    """
+    2-D histograms of count, price sum and $/sqft sum at every cell size.
+
+    Pixels are square in web-mercator (cell_m is ground meters at the mean
+    latitude), so a raster can be drawn as one BitmapLayer over `bounds`
+    (west, south, east, north). Levels wider than `max_side` pixels are
+    skipped; if that leaves none, the coarsest cell is doubled until one
+    level fits, so there is always a raster. Arrays are (rows, cols) with row 0 at the north edge; sums
+    ignore missing values and `n_price` / `n_pps` count what was summed.
+    """
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    price = np.full(lat.size, np.nan) if price is None else np.asarray(price, dtype="float64")
+    pps = np.full(lat.size, np.nan) if pps is None else np.asarray(pps, dtype="float64")
+    if lat.size == 0:
+        return {}
+    x, y = _mercator_m(lat, lon)
+    stretch = 1.0 / np.cos(np.deg2rad(np.mean(lat)))
+    x0, x1, y0, y1 = x.min(), x.max(), y.min(), y.max()
+    ok_p, ok_s = np.isfinite(price), np.isfinite(pps)
+
+    def fits(cell_m: float) -> bool:
+        return int(np.floor(max(x1 - x0, y1 - y0) / (cell_m * stretch))) + 1 <= max_side
+
+    sizes = [float(c) for c in cell_sizes]
+    if sizes and not any(fits(c) for c in sizes):
+        coarsest = max(sizes)
+        while not fits(coarsest):
+            coarsest *= 2
+        sizes.append(coarsest)
+
+    out: dict[float, dict] = {}
+    for cell_m in sizes:
+        if not fits(cell_m):
+            continue
+        px = cell_m * stretch
+        nx = int(np.floor((x1 - x0) / px)) + 1
+        ny = int(np.floor((y1 - y0) / px)) + 1
+        # flip y so row 0 is the top of the image
+        col = np.minimum(((x - x0) / px).astype(np.int64), nx - 1)
+        row = np.minimum(((y0 + ny * px - y) / px).astype(np.int64), ny - 1)
+        flat = row * nx + col
+        size = nx * ny
+
+        def hist(mask=None, weights=None):
+            f = flat if mask is None else flat[mask]
+            return np.bincount(f, weights=weights, minlength=size).reshape(ny, nx)
+
+        west = float(np.rad2deg(x0 / 6_378_137.0))
+        east = float(np.rad2deg((x0 + nx * px) / 6_378_137.0))
+        south = float(np.rad2deg(2 * np.arctan(np.exp(y0 / 6_378_137.0)) - np.pi / 2))
+        north = float(np.rad2deg(2 * np.arctan(np.exp((y0 + ny * px) / 6_378_137.0)) - np.pi / 2))
+        out[float(cell_m)] = {
+            "count": hist().astype(np.int32),
+            "sum_price": hist(ok_p, price[ok_p]).astype(np.float32),
+            "n_price": hist(ok_p).astype(np.int32),
+            "sum_pps": hist(ok_s, pps[ok_s]).astype(np.float32),
+            "n_pps": hist(ok_s).astype(np.int32),
+            "bounds": (west, south, east, north),
+            "cell_m": float(cell_m),
+            "pixel_m": float(px),
+        }
+    return out
+
+
+def pick_raster(rasters: dict[float, dict], zoom: float, px_per_cell: float = 6.0) -> dict | None:
+    """
+    Coarsest raster whose cells are no bigger than ~`px_per_cell` screen pixels.
+
+    At zoom z one screen pixel covers about 156543 / 2**z mercator meters.
+    """
+    if not rasters:
+        return None
+    limit = px_per_cell * 156_543.0 / 2.0 ** zoom
+    levels = sorted(rasters.values(), key=lambda r: r["cell_m"], reverse=True)
+    fit = [r for r in levels if r["pixel_m"] <= limit]
+    return fit[0] if fit else levels[-1]
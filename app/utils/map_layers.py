@@ -0,0 +1,150 @@
+# app/utils/map_layers.py
+from __future__ import annotations
+
+import base64
+import io
+import json
+
+import numpy as np
+import pandas as pd  # type: ignore
+import pydeck as pdk  # type: ignore
+from PIL import Image  # type: ignore
+
+# One atlas + mapping for every pin instead of a copied icon dict per row
+ICON_ATLAS = "https://raw.githubusercontent.com/visgl/deck.gl-data/master/icon/marker.png"
+ICON_MAPPING = {"marker": {"x": 0, "y": 0, "width": 128, "height": 128, "anchorY": 128}}
+
+# Columns shown in the point tooltip (only sent once, see point_layers)
+TOOLTIP_COLS = ("addr", "bedrooms", "bathrooms", "squareFootage",
+                "yearBuilt", "daysOnMarket", "status")
+
+_GEOM_COLS = ["longitude", "latitude", "col_r", "col_g", "col_b"]
+
+
+def money_labels(values) -> np.ndarray:
+    """
+    Format prices as "$1,234,567" ("N/A" for missing) without a per-row lambda.
+
+    Thousands groups are peeled off with integer array ops and joined with
+    numpy's string ufuncs, one pass per group of three digits.
+    """
+    v = np.asarray(values, dtype="float64")
+    ok = np.isfinite(v)
+    n = np.rint(np.abs(np.where(ok, v, 0.0))).astype(np.int64)
+    out = (n % 1000).astype(str)
+    rest = n // 1000
+    width = 3
+    while (rest > 0).any():
+        has = rest > 0
+        joined = np.char.add(np.char.add((rest % 1000).astype(str), ","), np.char.zfill(out, width))
+        out = np.where(has, joined, out)
+        rest //= 1000
+        width += 4
+    out = np.char.add(np.where(v < 0, "-$", "$"), out)
+    return np.where(ok, out, "N/A").astype(object)
+
+
+class CachedDeck(pdk.Deck):
+    """
+    pdk.Deck that serializes once, compactly.
+
+    st.pydeck_chart calls to_json() on every rerun; keeping the string lets a
+    cached deck be re-rendered without walking its layer data again.
+    """
+
+    _json: str | None = None
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(json.loads(super().to_json()), separators=(",", ":"))
+        return self._json
+
+
+def compact_points(m: pd.DataFrame, norm: pd.Series) -> pd.DataFrame:
+    """
+    Project the map frame down to what the layers actually read.
+
+    Coordinates are rounded to ~1 m, colors/sizes are small ints, and the
+    tooltip fields are the only strings kept.
+    """
+    norm = norm.fillna(0.5).to_numpy(dtype="float64")
+    out = pd.DataFrame({
+        "longitude": m["longitude"].to_numpy(dtype="float64").round(5),
+        "latitude": m["latitude"].to_numpy(dtype="float64").round(5),
+        "col_r": np.rint(norm * 255).astype(np.int16),
+        "col_g": np.int16(64),
+        "col_b": np.rint(255 - norm * 255).astype(np.int16),
+        "radius_m": np.rint(norm * 120 + 40).astype(np.int16),
+        "elev": np.rint(norm * 1200 + 200).astype(np.int16),
+    })
+    out["price_label"] = money_labels(m["price"]) if "price" in m.columns else "N/A"
+    for c in TOOLTIP_COLS:
+        if c in m.columns:
+            out[c] = m[c].to_numpy()
+    return out
+
+
+def point_layers(data: pd.DataFrame, use_pins: bool, use_columns: bool) -> list[pdk.Layer]:
+    """
+    Pin / column / scatter layers over one projected frame.
+
+    deck.gl JSON has no shared buffers, so each extra layer still carries its
+    own copy of the rows. To keep that small, only one layer is pickable and
+    gets the tooltip strings; the others get the geometry/color columns alone
+    (non-pickable layers don't block picking of the ones beneath).
+    """
+    tooltip_layer = "icon" if use_pins else ("column" if use_columns else "scatter")
+
+    def rows(kind: str, *extra: str) -> pd.DataFrame:
+        return data if kind == tooltip_layer else data[_GEOM_COLS + list(extra)]
+
+    layers = []
+    if use_pins:
+        layers.append(pdk.Layer(
+            "IconLayer", data=rows("icon"), icon_atlas=ICON_ATLAS, icon_mapping=ICON_MAPPING,
+            get_icon="'marker'", get_size=4, size_scale=8,
+            get_position="[longitude, latitude]", pickable=tooltip_layer == "icon",
+        ))
+    if use_columns:
+        layers.append(pdk.Layer(
+            "ColumnLayer", data=rows("column", "elev"), get_position="[longitude, latitude]",
+            get_elevation="elev", elevation_scale=1, radius=40, extruded=True,
+            pickable=tooltip_layer == "column", get_fill_color="[col_r, col_g, col_b]",
+        ))
+    layers.append(pdk.Layer(
+        "ScatterplotLayer", data=rows("scatter", "radius_m"), get_position="[longitude, latitude]",
+        get_radius="radius_m", pickable=tooltip_layer == "scatter",
+        get_fill_color="[col_r, col_g, col_b]", opacity=0.35,
+    ))
+    return layers
+
+
+def raster_layer(raster: dict, field: str = "price", p_min: float = 0.0,
+                 p_max: float = 0.0) -> pdk.Layer:
+    """
+    One BitmapLayer drawing a heat raster from utils.lod.heat_rasters.
+
+    Color is the cell mean of `field` ("price" or "pps") on the same
+    blue-to-red ramp as the points, and opacity grows with log(count). The
+    payload is a PNG of the raster, whatever the number of listings.
+    """
+    count = raster["count"]
+    total, n = raster[f"sum_{field}"], raster[f"n_{field}"]
+    mean = np.where(n > 0, total / np.maximum(n, 1), np.nan)
+    if not p_max > p_min:
+        ok = np.isfinite(mean)
+        p_min, p_max = (float(mean[ok].min()), float(mean[ok].max())) if ok.any() else (0.0, 1.0)
+    norm = np.clip((mean - p_min) / max(p_max - p_min, 1e-9), 0, 1)
+    norm = np.where(np.isfinite(norm), norm, 0.5)
+    alpha = np.log1p(count) / max(np.log1p(count.max()), 1e-9)
+
+    rgba = np.empty(count.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.rint(norm * 255)
+    rgba[..., 1] = 64
+    rgba[..., 2] = np.rint(255 - norm * 255)
+    rgba[..., 3] = np.where(count > 0, np.rint(90 + alpha * 140), 0)
+
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG", optimize=True)
+    url = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+    return pdk.Layer("BitmapLayer", image=url, bounds=list(raster["bounds"]), opacity=0.85)
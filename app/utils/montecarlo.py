@@ -0,0 +1,511 @@
+# app/utils/montecarlo.py
+from __future__ import annotations
+
+from concurrent.futures import Executor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.pool import pool_or_spawn
+
+# Default cap on the working buffer of one simulation chunk
+MC_MAX_BYTES = 256 * 2**20
+
+# Sampling schemes for the standard normals
+MC_METHODS = ("mc", "antithetic", "halton")
+
+# Simulation engines: one terminal draw, or year-by-year paths
+MC_ENGINES = ("terminal", "paths")
+
+
+def chunk_rows(n: int, itemsize: int, max_bytes: int = MC_MAX_BYTES) -> int:
+    """Simulations per chunk so one (rows x n) buffer fits in `max_bytes`."""
+    return max(1, int(max_bytes // max(n * itemsize, 1)))
+
+
+def _inputs(prices, mu, sigma, years: int, hold_rate: float, dtype: np.dtype) -> np.ndarray:
+    """(4, n) array of price, mu*Y, sigma*sqrt(Y) and holding cost per listing."""
+    prices = np.asarray(prices, dtype=dtype)
+    mu = np.asarray(mu, dtype=dtype)
+    sigma = np.asarray(sigma, dtype=dtype)
+    mu_t = mu * dtype.type(years)
+    sg_t = sigma * dtype.type(np.sqrt(years))
+    geom_sum = np.where(mu != 0, (np.exp(mu * years) - 1.0) / np.where(mu != 0, mu, 1), years)
+    hold = (prices * dtype.type(hold_rate) * geom_sum).astype(dtype)
+    return np.stack([prices, mu_t, sg_t, hold])
+
+
+def _path_inputs(prices, mu, sigma, hold_rate: float, rent_yield: float,
+                 dtype: np.dtype) -> np.ndarray:
+    """(4, n) array of price, annual mu, annual sigma and net cash-flow rate per listing."""
+    prices = np.asarray(prices, dtype=dtype)
+    flow = np.full(prices.size, rent_yield - hold_rate, dtype=dtype)
+    return np.stack([prices, np.asarray(mu, dtype=dtype), np.asarray(sigma, dtype=dtype), flow])
+
+
+def _control_weights(inputs: np.ndarray) -> np.ndarray | None:
+    """
+    Weights w with (multipliers @ w) = mean terminal value over priced listings.
+
+    None when some listing has no finite mu/sigma (its multiplier would be
+    NaN and poison the dot product).
+    """
+    prices, mu_t, sg_t, _ = inputs
+    if not (np.isfinite(mu_t).all() and np.isfinite(sg_t).all()):
+        return None
+    ok = np.isfinite(prices)
+    if not ok.any():
+        return None
+    return (np.where(ok, prices, 0) / ok.sum()).astype(inputs.dtype)
+
+
+# ---------- quasi-random normals ----------
+def _primes(k: int) -> np.ndarray:
+    """First k primes (sieve)."""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    limit = max(16, int(k * (np.log(k + 1) + np.log(np.log(k + 2)) + 3)))
+    sieve = np.ones(limit + 1, dtype=bool)
+    sieve[:2] = False
+    for p in range(2, int(limit ** 0.5) + 1):
+        if sieve[p]:
+            sieve[p * p::p] = False
+    return np.flatnonzero(sieve)[:k].astype(np.int64)
+
+
+def _halton(index: np.ndarray, bases: np.ndarray, mult: np.ndarray,
+            add: np.ndarray) -> np.ndarray:
+    """
+    Scrambled radical inverse of every index in every base: (len(index), len(bases)).
+
+    Digit d becomes (mult * d + add) % base, with per-row, per-base `mult`
+    (1 .. base-1) and `add`. Unscrambled, large bases give nearly collinear
+    coordinates for the first points; the scramble breaks that up.
+    """
+    # a fixed digit count per base (enough for indices < 2**31): scrambled
+    # zero digits aren't zero, so the count must not depend on the indices
+    ndig = np.ceil(31 * np.log(2) / np.log(bases)).astype(np.int64)
+    out = np.zeros((index.size, bases.size))
+    i = np.repeat(index.astype(np.int64)[:, None], bases.size, axis=1)
+    f = np.ones(bases.size)
+    for k in range(int(ndig.max(initial=0))):
+        m = int((ndig > k).sum())  # bases still needing digit k (ndig is non-increasing)
+        b = bases[:m]
+        f[:m] /= b
+        out[:, :m] += (((i[:, :m] % b) * mult[:, :m] + add[:, :m]) % b) * f[:m]
+        i[:, :m] //= b
+    return out
+
+
+def _norm_ppf(u: np.ndarray) -> np.ndarray:
+    """Inverse standard normal CDF (Acklam's rational approximation, ~1e-9)."""
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00)
+    u = np.clip(u, 1e-12, 1 - 1e-12)
+    q = np.minimum(u, 1 - u)
+    tail = q < 0.02425
+    out = np.empty_like(u)
+
+    t = np.sqrt(-2 * np.log(q[tail]))
+    x = (((((c[0] * t + c[1]) * t + c[2]) * t + c[3]) * t + c[4]) * t + c[5]) / \
+        ((((d[0] * t + d[1]) * t + d[2]) * t + d[3]) * t + 1)
+    out[tail] = np.where(u[tail] < 0.5, x, -x)
+
+    v = u[~tail] - 0.5
+    r = v * v
+    out[~tail] = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * v / \
+        (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+    return out
+
+
+def _scramble(scramble: tuple[int, int], rep: int,
+              bases: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Uniform shift, digit multiplier and digit offset per dimension for Halton
+    replicate `rep`, derived from the scramble seed. Rebuilt where needed
+    instead of stored, so only (seed, replicates) travels to the workers.
+    """
+    rng = np.random.default_rng([scramble[0], 1, rep])
+    return rng.random(bases.size), rng.integers(1, bases), rng.integers(0, bases)
+
+
+# ---------- simulation kernel ----------
+
+
+def _draw(b: np.ndarray, s: int, start: int, method: str, rng: np.random.Generator,
+          scramble: tuple[int, int] | None, bases: np.ndarray | None) -> np.ndarray:
+    """Fill `b` with normals for chunk rows s..; returns each row's scenario position."""
+    pos = np.arange(s, s + b.shape[0])
+    if method == "antithetic":
+        half = b.shape[0] // 2
+        rng.standard_normal(out=b[:half], dtype=b.dtype)
+        np.negative(b[:half], out=b[half:])
+        pos = s + np.r_[np.arange(half) * 2, np.arange(half) * 2 + 1]
+    elif method == "halton":
+        i = start + pos
+        reps = scramble[1]
+        rep = i % reps
+        for r in np.unique(rep).tolist():
+            rows = np.flatnonzero(rep == r)
+            shift, mult, add = _scramble(scramble, r, bases)
+            u = _halton(i[rows] // reps + 1, bases, mult[None, :], add[None, :])
+            u += shift
+            b[rows] = _norm_ppf(u % 1.0)
+    else:
+        rng.standard_normal(out=b, dtype=b.dtype)
+    return pos
+
+
+def _path_streams(key: int, first: int, k: int, antithetic: bool) -> list[np.random.Generator]:
+    """One Generator per scenario first .. first + k - 1 (per pair for antithetic)."""
+    step = 2 if antithetic else 1
+    return [np.random.default_rng([key, 2, i]) for i in range(first, first + k, step)]
+
+
+def _path_block(inputs: np.ndarray, start: int, sims: int, method: str, key: int,
+                years: int, take_profit: float | None, stop_loss: float | None,
+                max_bytes: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Median net gain of scenarios start .. start + sims - 1 simulated year by year.
+
+    Each year every live holding first books its cash flow (flow rate times
+    the value at the start of the year: rent minus holding cost), then grows
+    by exp(mu + sigma*z). A holding is sold as soon as its running net gain
+    (value + cash - price) reaches +take_profit or -stop_loss times its price;
+    it then keeps that gain. The per-chunk buffers (value, cash, a scratch
+    array and three masks) are allocated once and every yearly update
+    writes into them (out=), so memory doesn't grow with the horizon and
+    the loop allocates no (rows, n) temporaries.
+
+    Scenario i draws its normals year after year from its own stream,
+    default_rng([key, 2, i]); an antithetic pair (2k, 2k + 1) shares the
+    stream of 2k and the second takes -z. A scenario's draws therefore don't
+    depend on the chunk size, on how run() calls split the scenarios or on
+    the worker count.
+
+    Returns (medians, share of holdings sold early per scenario).
+    """
+    prices, mu, sigma, flow = inputs
+    n = prices.size
+    med = np.full(sims, np.nan)
+    sold = np.full(sims, np.nan)
+    if n == 0 or sims <= 0:
+        return med, sold
+    rows = min(chunk_rows(n, 3 * inputs.dtype.itemsize + 3, max_bytes), sims)
+    if method == "antithetic":
+        rows = max(2, rows - rows % 2)
+    value = np.empty((rows, n), dtype=inputs.dtype)
+    cash = np.empty_like(value)
+    tmp = np.empty_like(value)
+    alive = np.empty((rows, n), dtype=bool)
+    hit = np.empty_like(alive)
+    scratch = np.empty_like(alive)
+    exits = take_profit is not None or stop_loss is not None
+    up = None if take_profit is None else prices * inputs.dtype.type(take_profit)
+    down = None if stop_loss is None else -prices * inputs.dtype.type(stop_loss)
+
+    antithetic = method == "antithetic"
+
+    for s in range(0, sims, rows):
+        k = min(rows, sims - s)
+        v, c, t, a, h, m = value[:k], cash[:k], tmp[:k], alive[:k], hit[:k], scratch[:k]
+        v[:] = prices
+        c[:] = 0
+        a[:] = True
+        streams = _path_streams(key, start + s, k, antithetic)
+        for _ in range(years):
+            np.multiply(v, flow, out=t)
+            np.add(c, t, out=c, where=a)
+            if antithetic:
+                for j, g in enumerate(streams):
+                    g.standard_normal(out=t[2 * j], dtype=t.dtype)
+                    np.negative(t[2 * j], out=t[2 * j + 1])
+            else:
+                for j, g in enumerate(streams):
+                    g.standard_normal(out=t[j], dtype=t.dtype)
+            t *= sigma
+            t += mu
+            np.exp(t, out=t)
+            np.multiply(v, t, out=v, where=a)
+            if exits:
+                np.subtract(v, prices, out=t)
+                t += c
+                h[:] = False
+                if up is not None:
+                    np.greater_equal(t, up, out=h)
+                if down is not None:
+                    np.less_equal(t, down, out=m)
+                    h |= m
+                h &= a
+                np.logical_not(h, out=m)
+                a &= m
+                if not a.any():
+                    break  # everything in this chunk has been sold
+        np.subtract(v, prices, out=t)
+        t += c
+        sold[s:s + k] = 1.0 - a.mean(axis=1)
+        med[s:s + k] = np.nanmedian(t, axis=1, overwrite_input=True)
+    return med, sold
+
+
+def _simulate_block(inputs: np.ndarray, start: int, sims: int, method: str,
+                    rng: np.random.Generator, scramble: tuple[int, int] | None,
+                    max_bytes: int, paths: tuple | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Median net gain and mean terminal value of scenarios start .. start + sims - 1.
+
+    With `paths` = (key, years, take_profit, stop_loss) the scenarios run
+    through the yearly engine instead (_path_block), and the second array is
+    the share of holdings sold early.
+
+    "mc" draws normals from `rng` in row order. "antithetic" draws z and
+    also simulates -z; each pair lands at positions (2k, 2k + 1). "halton"
+    maps scenario i to Halton point i // R under random scramble i % R
+    (scramble = (seed, R)), so its output doesn't depend on `rng` at all.
+    """
+    if paths is not None:
+        return _path_block(inputs, start, sims, method, *paths, max_bytes)
+    prices, mu_t, sg_t, hold = inputs
+    n = prices.size
+    med = np.full(sims, np.nan)
+    fv_mean = np.full(sims, np.nan)
+    if n == 0 or sims <= 0:
+        return med, fv_mean
+    # halton builds float64/int64 scratch of the same shape as the buffer
+    per_row = inputs.dtype.itemsize + (56 if method == "halton" else 0)
+    rows = min(chunk_rows(n, per_row, max_bytes), sims)
+    if method == "antithetic":
+        rows = max(2, rows - rows % 2)
+    buf = np.empty((rows, n), dtype=inputs.dtype)
+    w = _control_weights(inputs)
+    bases = _primes(n) if method == "halton" else None
+
+    for s in range(0, sims, rows):
+        b = buf[:min(rows, sims - s)]
+        pos = _draw(b, s, start, method, rng, scramble, bases)
+        b *= sg_t
+        b += mu_t
+        np.exp(b, out=b)
+        if w is not None:
+            fv_mean[pos] = b @ w
+        b *= prices
+        b -= prices
+        b -= hold
+        med[pos] = np.nanmedian(b, axis=1, overwrite_input=True)
+    return med, fv_mean
+
+
+def _worker(shm_name: str, shape: tuple[int, int], dtype: str, start: int, sims: int,
+            method: str, seed: np.random.SeedSequence, scramble: tuple[int, int] | None,
+            max_bytes: int, paths: tuple | None) -> tuple[np.ndarray, np.ndarray]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    inputs = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        return _simulate_block(inputs, start, sims, method, np.random.default_rng(seed),
+                               scramble, max_bytes, paths)
+    finally:
+        del inputs  # release the view before closing the mapping
+        shm.close()
+
+
+class PortfolioSimulator:
+    """
+    Lognormal Monte Carlo of the portfolio's median net gain, extendable in place.
+
+    Each scenario draws one terminal multiplier per listing,
+    exp(mu*Y + sigma*sqrt(Y)*z), and nets out the price and the geometric
+    holding cost. Scenarios are simulated a chunk of rows at a time in one
+    reused buffer: normals are drawn straight into it and every step runs in
+    place, so peak memory is about `max_bytes` whatever the number of
+    scenarios. Only the per-scenario medians (and mean terminal values, for
+    the control variate) are kept.
+
+    run(k) appends k scenarios continuing the same streams, so 500 + 500
+    gives the same draws as 1000 at once; summary(sims=k) reads the first
+    k. Draws don't depend on the chunk size (the memory ceiling); float32
+    halves memory but uses a different normal stream.
+
+    With workers > 1 each batch is split into contiguous blocks run in a
+    process pool: `pool` if given (e.g. the app's long-lived shared_pool),
+    else a spawn pool for the call. Every block gets its own stream from
+    SeedSequence.spawn and the inputs are shared with the workers through
+    shared memory rather than copied; terminal-engine results then depend on
+    (seed, workers, batch sizes).
+
+    Variance reduction:
+    - method="antithetic" pairs every z with -z;
+    - method="halton" uses Halton points under `replicates` independent
+      random digit scrambles and shifts (randomized QMC; the replicates give
+      the standard error). The gain is largest for small portfolios: with
+      thousands of listings the points are high-dimensional and behave much
+      like plain MC;
+    - summary(control=True) corrects the estimates with the scenario's mean
+      terminal value, whose exact expectation is the lognormal mean
+      price * exp(mu*Y + sigma^2*Y/2).
+
+    engine="paths" steps each scenario year by year instead (_path_block):
+    cash flows are booked on the path's value (`rent_yield` income minus
+    `hold_rate` cost) and holdings can be sold early at +take_profit or
+    -stop_loss of their price. It draws Y normals per listing and scenario,
+    so it costs about Y times the terminal engine; Halton and the control
+    variate are not available there. Every scenario has its own stream, so
+    path results depend only on the seed: not on the memory ceiling, the
+    split into run() calls or the worker count.
+    """
+
+    def __init__(self, prices, mu, sigma, years: int, hold_rate: float, seed: int = 42,
+                 dtype: str = "float64", max_bytes: int = MC_MAX_BYTES, workers: int = 1,
+                 method: str = "mc", replicates: int = 16, engine: str = "terminal",
+                 rent_yield: float = 0.0, take_profit: float | None = None,
+                 stop_loss: float | None = None, pool: Executor | None = None):
+        if method not in MC_METHODS:
+            raise ValueError(f"method must be one of {MC_METHODS}")
+        if engine not in MC_ENGINES:
+            raise ValueError(f"engine must be one of {MC_ENGINES}")
+        if engine == "paths" and method == "halton":
+            raise ValueError("the path engine supports method 'mc' or 'antithetic'")
+        dtype = np.dtype(dtype)
+        self._rng = np.random.default_rng(seed)
+        self._seq = np.random.SeedSequence(seed)
+        # paths: (stream key, years, take_profit, stop_loss); see _path_block
+        self.paths = (int(self._seq.entropy), int(years), take_profit, stop_loss) \
+            if engine == "paths" else None
+        self.inputs = _path_inputs(prices, mu, sigma, hold_rate, rent_yield, dtype) \
+            if self.paths else _inputs(prices, mu, sigma, years, hold_rate, dtype)
+        self.max_bytes = max_bytes
+        self.workers = max(1, int(workers))
+        self.pool = pool
+        self.method = method
+        self.port_net = np.empty(0)
+        self.fv_mean = np.empty(0)
+        self.sold = np.empty(0)
+        # halton: (seed, replicates); each replicate's per-dimension scramble
+        # is rebuilt from it chunk by chunk (_scramble), never stored
+        self._scramble = (int(self._seq.entropy), max(2, replicates)) \
+            if method == "halton" else None
+
+        w = None if self.paths else _control_weights(self.inputs.astype("float64"))
+        _, mu_t, sg_t, _ = self.inputs.astype("float64")
+        self.fv_expected = float(np.exp(mu_t + 0.5 * sg_t ** 2) @ w) if w is not None else np.nan
+
+    @property
+    def sims(self) -> int:
+        return self.port_net.size
+
+    def run(self, sims: int) -> PortfolioSimulator:
+        """Simulate `sims` more scenarios (rounded up to whole pairs for antithetic)."""
+        unit = 2 if self.method == "antithetic" else 1
+        sims += -sims % unit
+        if sims <= 0:
+            return self
+        workers = min(self.workers, sims // unit)
+        if workers <= 1:
+            med, aux = _simulate_block(self.inputs, self.sims, sims, self.method, self._rng,
+                                       self._scramble, self.max_bytes, self.paths)
+        else:
+            med, aux = self._run_pool(sims, workers, unit)
+        self.port_net = np.concatenate([self.port_net, med])
+        nan = np.full(sims, np.nan)
+        self.fv_mean = np.concatenate([self.fv_mean, nan if self.paths else aux])
+        self.sold = np.concatenate([self.sold, aux if self.paths else nan])
+        return self
+
+    def _run_pool(self, sims: int, workers: int, unit: int) -> tuple[np.ndarray, np.ndarray]:
+        blocks = [len(b) * unit for b in np.array_split(np.arange(sims // unit), workers)]
+        starts = (self.sims + np.cumsum([0] + blocks[:-1])).tolist()
+        seeds = self._seq.spawn(workers)
+        inputs = self.inputs
+        shm = shared_memory.SharedMemory(create=True, size=max(inputs.nbytes, 1))
+        try:
+            np.ndarray(inputs.shape, dtype=inputs.dtype, buffer=shm.buf)[:] = inputs
+            with pool_or_spawn(self.pool, workers) as pool:
+                parts = list(pool.map(
+                    _worker, [shm.name] * workers, [inputs.shape] * workers,
+                    [inputs.dtype.str] * workers, starts, blocks, [self.method] * workers,
+                    seeds, [self._scramble] * workers,
+                    [max(1, self.max_bytes // workers)] * workers, [self.paths] * workers))
+        finally:
+            shm.close()
+            shm.unlink()
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    # ---------- estimates ----------
+
+    def _units(self, x: np.ndarray) -> np.ndarray:
+        """Independent units behind the standard error: pairs, replicates or draws."""
+        if self.method == "antithetic":
+            return x.reshape(-1, 2).mean(axis=1)
+        if self.method == "halton":
+            r = np.arange(x.size) % self._scramble[1]
+            return np.bincount(r, weights=x) / np.bincount(r)
+        return x
+
+    def _estimate(self, x: np.ndarray, fv: np.ndarray, control: bool) -> tuple[float, float]:
+        """Mean of `x` per scenario and its standard error."""
+        if control and np.isfinite(self.fv_expected) and x.size > 2:
+            c = fv - self.fv_expected
+            var_c = np.var(c)
+            if var_c > 0:
+                x = x - np.mean((x - x.mean()) * c) / var_c * c
+        u = self._units(x)
+        se = float(np.std(u, ddof=1) / np.sqrt(u.size)) if u.size > 1 else np.nan
+        return float(np.mean(x)), se
+
+    def _prefix(self, sims: int | None) -> int:
+        n = self.sims if sims is None else min(int(sims), self.sims)
+        return n - n % 2 if self.method == "antithetic" else n
+
+    def summary(self, thresh: float = 0.0, control: bool = False,
+                sims: int | None = None) -> dict[str, float]:
+        """
+        P(net gain > thresh) and expected net gain with standard errors, 5% VaR,
+        and (path engine) the average share of holdings sold early.
+
+        Estimates use the first `sims` scenarios (all by default), so a
+        simulator run further than needed answers smaller requests as well.
+        """
+        n = self._prefix(sims)
+        x, fv = self.port_net[:n], self.fv_mean[:n]
+        if not n:
+            return dict.fromkeys(("prob", "prob_se", "mean", "mean_se", "var5", "sold"),
+                                 np.nan) | {"sims": 0}
+        prob, prob_se = self._estimate((x > thresh).astype("float64"), fv, control)
+        mean, mean_se = self._estimate(x, fv, control)
+        return {"prob": min(max(prob, 0.0), 1.0), "prob_se": prob_se, "mean": mean,
+                "mean_se": mean_se, "var5": float(np.quantile(x, 0.05)),
+                "sold": float(np.mean(self.sold[:n])) if self.paths else np.nan, "sims": n}
+
+    def ensure(self, sims: int) -> PortfolioSimulator:
+        """Extend the run to at least `sims` scenarios; existing draws are kept."""
+        if sims > self.sims:
+            self.run(sims - self.sims)
+        return self
+
+    def run_until(self, target_se: float, max_sims: int, batch: int = 200,
+                  thresh: float = 0.0, control: bool = False) -> int:
+        """
+        Smallest multiple of `batch` scenarios (capped at `max_sims`) whose
+        expected-gain SE is <= `target_se`, simulating more only as needed.
+        """
+        n = 0
+        while n < max_sims:
+            n = min(n + batch, max_sims)
+            self.ensure(n)
+            if self.summary(thresh, control, n)["mean_se"] <= target_se:
+                break
+        return self._prefix(n)
+
+
+def simulate_portfolio(prices, mu, sigma, years: int, hold_rate: float, sims: int,
+                       seed: int = 42, dtype: str = "float64",
+                       max_bytes: int = MC_MAX_BYTES, workers: int = 1) -> np.ndarray:
+    """Median net gain across listings for each of `sims` plain-MC scenarios."""
+    sim = PortfolioSimulator(prices, mu, sigma, years, hold_rate, seed=seed, dtype=dtype,
+                             max_bytes=max_bytes, workers=workers)
+    return sim.run(sims).port_net
@@ -0,0 +1,39 @@
+# app/utils/pool.py
+from __future__ import annotations
+
+import os
+from collections.abc import Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+import streamlit as st  # type: ignore
+
+
+def spawn_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers are spawned, not forked: forking the
+    multithreaded Streamlit server can copy a held lock into the child and
+    deadlock it.
+    """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                               mp_context=get_context("spawn"))
+
+
+@st.cache_resource(show_spinner=False)
+def shared_pool() -> ProcessPoolExecutor:
+    """One long-lived spawn pool (a worker per CPU) for every page and session."""
+    return spawn_pool()
+
+
+@contextmanager
+def pool_or_spawn(pool: Executor | None, workers: int) -> Iterator[Executor]:
+    """`pool` if given; otherwise a spawn pool of `workers` that is shut down afterwards."""
+    if pool is not None:
+        yield pool
+        return
+    own = spawn_pool(workers)
+    try:
+        yield own
+    finally:
+        own.shutdown()
@@ -0,0 +1,219 @@
+# app/utils/repeat_sales.py
+from __future__ import annotations
+
+import re
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.returns import DEFAULT_MU, DEFAULT_SIGMA, ZipReturns
+from utils.vcache import version_cache
+
+# one event inside the `history` column's dict repr:
+# {'2025-04-22': {'event': 'Sale Listing', 'price': 549000, ...}, ...}
+_EVENT = re.compile(r"'(\d{4}-\d{2}-\d{2})': \{'event': '[^']*'(?:, 'price': ([0-9.]+))?")
+_EVENT_MARK = "': {'event': '"
+
+_PERIODS_PER_YEAR = {"M": 12, "Q": 4, "Y": 1}
+
+
+def price_events(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Dated prices from the `history` column, one row per event.
+
+    Columns: row (position in `df`), date, price (NaN if the event has
+    none). The column is joined and scanned by one regex pass; events are
+    assigned back to rows by counting event markers per row, which avoids a
+    literal_eval (or a regex call) per listing.
+    """
+    if "history" not in df:
+        return pd.DataFrame({"row": np.empty(0, dtype=np.int64),
+                             "date": np.empty(0, dtype="datetime64[ns]"), "price": np.empty(0)})
+    h = df["history"]
+    rows = np.flatnonzero(h.notna().to_numpy())
+    text = h.iloc[rows].astype(str).tolist()
+    found = _EVENT.findall("\n".join(text))
+    counts = np.fromiter((t.count(_EVENT_MARK) for t in text), np.int64, len(text))
+    if counts.sum() != len(found):  # a marker without a dated key: match row by row
+        per_row = [_EVENT.findall(t) for t in text]
+        counts = np.fromiter(map(len, per_row), np.int64, len(per_row))
+        found = [e for p in per_row for e in p]
+    ev = np.array(found, dtype=object).reshape(-1, 2)
+    return pd.DataFrame({
+        "row": np.repeat(rows, counts),
+        "date": np.array(ev[:, 0], dtype="datetime64[D]").astype("datetime64[ns]"),
+        "price": pd.to_numeric(pd.Series(ev[:, 1]).replace("", None),
+                               errors="coerce").to_numpy(dtype="float64"),
+    })
+
+
+def sale_pairs(df: pd.DataFrame, freq: str = "Q", min_gap_days: int = 180) -> pd.DataFrame:
+    """
+    Consecutive priced events of the same listing in different periods.
+
+    Columns: row, t0, t1 (period ordinals at `freq`) and dlog (log price
+    change). Events in the same period are collapsed to the later price;
+    non-positive prices are dropped. As in Case-Shiller, pairs closer than
+    `min_gap_days` are left out: quick relists are mostly price cuts, not
+    market moves.
+    """
+    ev = price_events(df)
+    ev = ev[(ev["price"] > 0) & ev["date"].notna()]
+    date = ev["date"].to_numpy()
+    t = pd.PeriodIndex(ev["date"], freq=freq).asi8
+    row = ev["row"].to_numpy()
+    order = np.lexsort((date, row))
+    row, t, date = row[order], t[order], date[order]
+    logp = np.log(ev["price"].to_numpy()[order])
+    # keep the last event of each (listing, period)
+    last = np.r_[(row[1:] != row[:-1]) | (t[1:] != t[:-1]), True] if row.size else \
+        np.empty(0, dtype=bool)
+    row, t, date, logp = row[last], t[last], date[last], logp[last]
+    keep = (row[1:] == row[:-1]) & (np.diff(date) >= np.timedelta64(min_gap_days, "D"))
+    return pd.DataFrame({"row": row[1:][keep], "t0": t[:-1][keep], "t1": t[1:][keep],
+                         "dlog": np.diff(logp)[keep]})
+
+
+@version_cache
+def cached_sale_pairs(version: str, _df: pd.DataFrame) -> pd.DataFrame:
+    """
+    sale_pairs(_df) once per dataset version, shared by every page.
+
+    `_df` must be the listings CSV as load_first_csv() reads it (rows in
+    file order), since the pairs refer to rows by position.
+    """
+    return sale_pairs(_df)
+
+
+class RepeatSalesIndex:
+    """
+    Repeat-sales log price index per group (Bailey-Muth-Nourse).
+
+    Each pair says dlog = level[g, t1] - level[g, t0] + noise; the levels
+    solve the least-squares problem over all pairs. The normal equations of
+    every group are solved together by Jacobi-preconditioned conjugate
+    gradients whose matrix-vector product is two bincounts over the pairs,
+    so cost is O(pairs x iterations) and nothing of size groups x periods^2
+    is ever built. Levels are relative to each group's first period with
+    data; periods no pair touches are NaN.
+
+    `by` is the grouping column (e.g. zipCode or city), None for one
+    market-wide index. Built from the listing `history` column, whose
+    events are list prices, so this is a repeat-listing index.
+    """
+
+    def __init__(self, df: pd.DataFrame, pairs: pd.DataFrame, by: str | None = None,
+                 freq: str = "Q", tol: float = 1e-10):
+        self.by, self.freq = by, freq
+        labels = df[by].to_numpy()[pairs["row"].to_numpy()] if by and by in df \
+            else np.full(len(pairs), "All", dtype=object)
+        g, groups = pd.factorize(pd.Series(labels, dtype=object).astype(str), sort=True)
+        pairs = pairs[g >= 0]  # listings without a group label
+        g = g[g >= 0]
+        self.groups = pd.Index(groups)
+        t0, t1 = pairs["t0"].to_numpy(), pairs["t1"].to_numpy()
+        start = int(min(t0.min(), t1.min())) if len(pairs) else 0
+        T = int(max(t0.max(), t1.max())) - start + 1 if len(pairs) else 0
+        self.periods = pd.PeriodIndex.from_ordinals(np.arange(start, start + T), freq=freq)
+        G = len(self.groups)
+        a = g * T + (t0 - start)
+        b = g * T + (t1 - start)
+        y = pairs["dlog"].to_numpy(dtype="float64")
+        self.n_pairs = np.bincount(g, minlength=G)
+        deg = np.bincount(a, minlength=G * T) + np.bincount(b, minlength=G * T)
+        self.level = np.where(deg > 0, self._solve(a, b, y, deg, G * T, tol), np.nan).reshape(G, T)
+        self.weight = deg.reshape(G, T)
+        # anchor every group at its first period with data
+        first = np.argmax(self.weight > 0, axis=1)
+        self.level -= self.level[np.arange(G), first][:, None]
+
+    @staticmethod
+    def _solve(a: np.ndarray, b: np.ndarray, y: np.ndarray, deg: np.ndarray, size: int,
+               tol: float) -> np.ndarray:
+        ridge = 1e-9  # keeps the (singular, per-group constant) system definite
+
+        def matvec(x):
+            d = x[b] - x[a]
+            return np.bincount(b, d, size) - np.bincount(a, d, size) + ridge * x
+
+        x = np.zeros(size)
+        r = np.bincount(b, y, size) - np.bincount(a, y, size)
+        m = 1.0 / (deg + ridge)
+        z = m * r
+        p = z.copy()
+        rz = r @ z
+        stop = tol * max(np.sqrt(r @ r), 1e-300)
+        for _ in range(4 * int(np.sqrt(size)) + 200):
+            if np.sqrt(r @ r) <= stop:
+                break
+            q = matvec(p)
+            alpha = rz / (p @ q)
+            x += alpha * p
+            r -= alpha * q
+            z = m * r
+            rz, rz_old = r @ z, rz
+            p = z + (rz / rz_old) * p
+        return x
+
+    def frame(self, groups=None) -> pd.DataFrame:
+        """
+        Long table: group, period (timestamp), index (first period = 100) and
+        period_pairs, the pairs that start or end in the period.
+        """
+        sel = np.arange(len(self.groups)) if groups is None else \
+            self.groups.get_indexer(pd.Index(groups).astype(str))
+        sel = sel[sel >= 0]
+        lv = self.level[sel]
+        ok = np.isfinite(lv)
+        gi, ti = np.nonzero(ok)
+        return pd.DataFrame({
+            "group": self.groups[sel][gi],
+            "period": self.periods[ti].to_timestamp(),
+            "index": 100.0 * np.exp(lv[ok]),
+            "period_pairs": self.weight[sel][ok],
+        })
+
+    def returns(self, min_pairs: int = 10) -> ZipReturns:
+        """
+        Annual log growth (trend of the index) and volatility per group.
+
+        mu is the pair-weighted least-squares slope of the log index on time;
+        sigma is the std of period-to-period changes scaled to a year. Groups
+        need `min_pairs` pairs and 3 periods with data. mu_g / sig_g are the
+        pair-weighted medians over those groups (defaults if none qualify).
+        """
+        ppy = _PERIODS_PER_YEAR.get(self.freq[:1].upper(), 4)
+        G, T = self.level.shape
+        t = np.arange(T) / ppy
+        w = np.where(np.isfinite(self.level), self.weight, 0).astype("float64")
+        lv = np.nan_to_num(self.level)
+        sw = w.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tbar = (w * t).sum(axis=1) / sw
+            ybar = (w * lv).sum(axis=1) / sw
+            dt = t[None, :] - tbar[:, None]
+            mu = (w * dt * (lv - ybar[:, None])).sum(axis=1) / (w * dt * dt).sum(axis=1)
+
+        # changes between consecutive periods with data, per group
+        gi, ti = np.nonzero(w > 0)
+        same = gi[1:] == gi[:-1]
+        step = np.diff(lv[gi, ti])[same] / np.sqrt(np.diff(t[ti])[same])
+        gs = gi[1:][same]
+        n = np.bincount(gs, minlength=G)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            m1 = np.bincount(gs, step, G) / n
+            sigma = np.sqrt(np.bincount(gs, (step - m1[gs]) ** 2, G) / (n - 1))
+
+        keep = (self.n_pairs >= min_pairs) & (n >= 2) & np.isfinite(mu) & np.isfinite(sigma)
+        if keep.any():
+            mu_g = _weighted_median(mu[keep], self.n_pairs[keep])
+            sig_g = _weighted_median(sigma[keep], self.n_pairs[keep])
+        else:
+            mu_g, sig_g = DEFAULT_MU, DEFAULT_SIGMA
+        return ZipReturns(mu_g, sig_g, self.groups[keep], mu[keep], sigma[keep])
+
+
+def _weighted_median(values: np.ndarray, weights: np.ndarray) -> float:
+    order = np.argsort(values)
+    cw = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cw, cw[-1] / 2.0)])
@@ -0,0 +1,93 @@
+# app/utils/returns.py
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+from utils.grouped import group_median
+
+# Fallback annual log-return mean / volatility when the data can't tell
+DEFAULT_MU, DEFAULT_SIGMA = 0.03, 0.12
+
+
+class ZipReturns:
+    """
+    Annual log-return mean and volatility per ZIP, as arrays by ZIP code.
+
+    `zips` lists the ZIPs with an estimate; `mu[i]`, `sigma[i]` belong to
+    zips[i]. codes() maps a column of ZIPs to those positions once (cache it
+    per dataset); take() then builds per-row parameters with one gather.
+    """
+
+    def __init__(self, mu_g: float, sig_g: float, zips: pd.Index,
+                 mu: np.ndarray, sigma: np.ndarray):
+        self.mu_g, self.sig_g = mu_g, sig_g
+        self.zips, self.mu, self.sigma = zips, mu, sigma
+
+    def __len__(self) -> int:
+        return len(self.zips)
+
+    def codes(self, zip_codes) -> np.ndarray:
+        """Position of each row's ZIP in `zips` (-1 without an estimate)."""
+        return np.asarray(self.zips.get_indexer(pd.Index(zip_codes).astype(str)), dtype=np.int64)
+
+    def take(self, codes: np.ndarray, mu_default: float,
+             sig_default: float) -> tuple[np.ndarray, np.ndarray]:
+        """Per-row (mu, sigma) for codes(); rows without an estimate get the defaults."""
+        # a trailing slot holds the defaults, so -1 picks them up
+        mu = np.append(self.mu, mu_default)[codes]
+        sg = np.append(self.sigma, sig_default)[codes]
+        return mu.astype("float64"), sg.astype("float64")
+
+
+def estimate_zip_returns(df: pd.DataFrame, date_col: str | None) -> ZipReturns:
+    """
+    Annual log-return mean & std from median yearly prices, per ZIP and overall.
+
+    Prices are reduced to a median per (ZIP, year); returns are log changes
+    between a ZIP's consecutive observed years. ZIPs need 3+ years. The
+    overall series is the yearly median of the ZIP medians. One sort for the
+    medians and bincounts for the moments, whatever the number of ZIPs.
+    """
+    empty = ZipReturns(DEFAULT_MU, DEFAULT_SIGMA, pd.Index([], dtype=object),
+                       np.empty(0), np.empty(0))
+    if date_col is None or "price" not in df or "zipCode" not in df:
+        return empty
+    d = df[[date_col, "price", "zipCode"]].dropna()
+    if d.empty:
+        return empty
+
+    zcode, zips = pd.factorize(d["zipCode"].astype(str), sort=True)
+    year = d[date_col].dt.year.to_numpy(dtype=np.int64)
+    y0 = int(year.min())
+    span = int(year.max()) - y0 + 1
+    pair, inv = np.unique(zcode.astype(np.int64) * span + (year - y0), return_inverse=True)
+    med = group_median(inv, d["price"].to_numpy(dtype="float64"), pair.size)
+    ok = np.isfinite(med)  # pairs whose prices were all non-finite drop out, like dropna
+    pair, med = pair[ok], med[ok]
+    pz, py = pair // span, pair % span
+
+    # per ZIP: log returns between consecutive observed years (pairs are
+    # sorted by ZIP then year), kept where the ZIP has 3+ years
+    same = pz[1:] == pz[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.diff(np.log(med))[same]
+    g = pz[1:][same]
+    nz = len(zips)
+    n = np.bincount(g, minlength=nz)
+    keep = (np.bincount(pz, minlength=nz) >= 3) & \
+        (np.bincount(g[np.isfinite(r)], minlength=nz) > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu = np.bincount(g, weights=r, minlength=nz) / n
+        var = np.bincount(g, weights=(r - mu[g]) ** 2, minlength=nz) / (n - 1)
+    sigma = np.where(n > 1, np.sqrt(var), 0.10)
+
+    # overall: median over ZIPs of each year's medians
+    all_years = group_median(py, med, span)
+    all_years = all_years[np.isfinite(all_years)]
+    if all_years.size >= 3:
+        r_all = np.diff(np.log(all_years))
+        mu_g, sig_g = float(np.mean(r_all)), float(np.std(r_all, ddof=1))
+    else:
+        mu_g, sig_g = DEFAULT_MU, DEFAULT_SIGMA
+    return ZipReturns(mu_g, sig_g, pd.Index(zips[keep]), mu[keep], sigma[keep])
@@ -0,0 +1,105 @@
+# app/utils/search.py
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+SEARCH_FIELDS = ("formattedAddress", "city", "zipCode")
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def _normalize(text: str) -> str:
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+def _grams(text: str, n: int = 3) -> set[str]:
+    """Character n-grams of each word, padded so prefixes get their own grams."""
+    out: set[str] = set()
+    for word in text.split():
+        padded = f" {word} "
+        if len(padded) <= n:
+            out.add(padded)
+            continue
+        out.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return out
+
+
+class AddressIndex:
+    """
+    In-memory trigram inverted index over address, city and ZIP.
+
+    Built once per dataset version; a query only touches the postings of its
+    own trigrams, so lookups stay in the millisecond range as the table grows.
+    """
+
+    def __init__(self, df: pd.DataFrame, fields: tuple[str, ...] = SEARCH_FIELDS):
+        cols = [c for c in fields if c in df.columns]
+        if cols:
+            text = df[cols[0]].fillna("").astype(str)
+            for c in cols[1:]:
+                text = text + " " + df[c].fillna("").astype(str)
+        else:
+            text = pd.Series("", index=df.index)
+
+        self.docs = [_normalize(t) for t in text]
+        self.size = len(self.docs)
+
+        # Addresses share most of their words (street names, cities, ZIPs), so
+        # grams are computed once per distinct word and mapped back to rows.
+        words = pd.Series(self.docs, dtype=object).str.split().explode().dropna()
+        word_ids, vocab = pd.factorize(words.to_numpy())
+        rows = words.index.to_numpy(dtype=np.int64)
+        order = np.argsort(word_ids, kind="stable")
+        bounds = np.searchsorted(word_ids[order], np.arange(len(vocab) + 1))
+
+        by_gram: dict[str, list[int]] = defaultdict(list)
+        for wid, word in enumerate(vocab):
+            for g in _grams(word):
+                by_gram[g].append(wid)
+
+        self.postings = {}
+        for g, wids in by_gram.items():
+            parts = [rows[order[bounds[w]:bounds[w + 1]]] for w in wids]
+            self.postings[g] = np.unique(np.concatenate(parts)).astype(np.int32)
+
+    def search(self, query: str, limit: int = 10,
+               budget: int = 200_000) -> list[tuple[int, float]]:
+        """
+        Return up to `limit` (row position, score) pairs, best first.
+
+        Grams are weighted by inverse document frequency, and rows that contain
+        the whole query as a substring get a bonus, so "90005" or "123 main"
+        beat rows that merely share a few letters. Rarest grams are scored
+        first and common ones are skipped once `budget` postings have been
+        read, which caps the cost of queries like "los angeles".
+        """
+        q = _normalize(query)
+        if not q or self.size == 0:
+            return []
+        lists = sorted((self.postings[g] for g in _grams(q) if g in self.postings), key=len)
+        if not lists:
+            return []
+        used = np.cumsum([len(p) for p in lists]) <= budget
+        used[0] = True
+        weights = [np.log1p(self.size / len(p)) for p, keep in zip(lists, used) if keep]
+        lists = [p[:budget] for p, keep in zip(lists, used) if keep]
+        rows = np.concatenate(lists)
+        w = np.repeat(np.asarray(weights, dtype=np.float64),
+                      [len(p) for p in lists])
+        cand, inv = np.unique(rows, return_inverse=True)
+        score = np.bincount(inv, weights=w) / float(sum(weights))
+
+        # Only re-check the best few candidates for an exact substring hit
+        k = min(len(cand), max(limit * 5, 50))
+        top = np.argpartition(-score, k - 1)[:k]
+        for i in top:
+            doc = self.docs[cand[i]]
+            if q in doc:
+                score[i] += 1.0 + (0.5 if doc.startswith(q) else 0.0)
+
+        best = top[np.argsort(-score[top], kind="stable")][:limit]
+        return [(int(cand[i]), float(score[i])) for i in best]
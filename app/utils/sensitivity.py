@@ -0,0 +1,92 @@
+# app/utils/sensitivity.py
+from __future__ import annotations
+
+import numpy as np
+
+from utils.grouped import group_median
+
+
+def net_factor(growth, years, hold_rate) -> np.ndarray:
+    """
+    Net gain per $1 of price for constant annual growth, broadcast over inputs.
+
+    (1 + g)^Y - 1 minus holding cost r * sum_t (1 + g)^t, the deterministic
+    ROI model.
+    """
+    g = np.asarray(growth, dtype="float64")
+    y = np.asarray(years, dtype="float64")
+    r = np.asarray(hold_rate, dtype="float64")
+    grow = np.power(1.0 + g, y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        geom = np.where(g == 0, y, (grow - 1.0) / np.where(g == 0, 1.0, g))
+    return grow - 1.0 - r * geom
+
+
+class SensitivityGrid:
+    """
+    Net gain across a growth x horizon x holding-cost grid, per group.
+
+    Net gain is price times a factor that depends only on (g, Y, r), so the
+    whole grid is one broadcast of net_factor. Group medians are the factor
+    times the group's median price (a median commutes with scaling by a
+    constant), and "share with net > threshold" is a price cutoff per cell,
+    answered by one searchsorted over prices sorted within groups. Building
+    sorts once; every query is O(groups x cells), whatever the listing count.
+
+    Group -1 is the whole market. Shares count every listing of the group,
+    priced or not, like the page's "Share profitable".
+    """
+
+    def __init__(self, prices, codes: np.ndarray, ngroups: int):
+        prices = np.asarray(prices, dtype="float64")
+        codes = np.asarray(codes, dtype=np.int64)
+        self.ngroups = ngroups
+        self.rows = np.bincount(codes, minlength=ngroups)
+        self.total = prices.size
+        ok = np.isfinite(prices)
+        self.priced = np.bincount(codes[ok], minlength=ngroups)
+        self.median = group_median(codes, prices, ngroups)
+        self.median_all = float(np.median(prices[ok])) if ok.any() else np.nan
+
+        # prices in one global order, then (group, rank) keys sorted within groups
+        p, k = prices[ok], codes[ok]
+        order = np.argsort(p, kind="stable")
+        self.sorted_prices = p[order]
+        rank = np.empty(p.size, dtype=np.int64)
+        rank[order] = np.arange(p.size)
+        self.keys = np.sort(k * max(p.size, 1) + rank)
+        self.starts = np.searchsorted(self.keys, np.arange(ngroups) * max(p.size, 1))
+
+    def medians(self, factor: np.ndarray, group: int | None = -1) -> np.ndarray:
+        """
+        Median net gain per cell. group -1 = market, None = every group
+        (shape (ngroups, *factor.shape)).
+        """
+        if group is None:
+            return self.median.reshape((-1,) + (1,) * np.ndim(factor)) * factor
+        return factor * (self.median_all if group < 0 else self.median[group])
+
+    def shares(self, factor: np.ndarray, thresh: float = 0.0,
+               group: int | None = -1) -> np.ndarray:
+        """
+        Share of listings with price * factor > thresh per cell; group as in
+        medians().
+        """
+        f = np.asarray(factor, dtype="float64")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cut = np.where(f != 0, thresh / np.where(f != 0, f, 1.0), 0.0)
+        # listings priced <= cut (for f > 0 the rest profit) and < cut (for f < 0)
+        le = np.searchsorted(self.sorted_prices, cut, side="right")
+        lt = np.searchsorted(self.sorted_prices, cut, side="left")
+        if group is None or group >= 0:
+            g = np.arange(self.ngroups) if group is None else np.array([group])
+            g = g.reshape((-1,) + (1,) * f.ndim)
+            n = max(self.sorted_prices.size, 1)
+            le = np.searchsorted(self.keys, g * n + le) - self.starts[g]
+            lt = np.searchsorted(self.keys, g * n + lt) - self.starts[g]
+            priced, total = self.priced[g], self.rows[g]
+        else:
+            priced, total = self.sorted_prices.size, self.total
+        hit = np.where(f > 0, priced - le, np.where(f < 0, lt, np.where(thresh < 0, priced, 0)))
+        out = hit / np.maximum(total, 1)
+        return out[0] if group is not None and group >= 0 else out
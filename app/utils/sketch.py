@@ -0,0 +1,248 @@
+# app/utils/sketch.py
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+# Columns listings are bucketed by; any filter/grouping over these can be
+# answered by merging cells
+SKETCH_DIMS = ("state", "city", "zipCode", "bedrooms", "status", "propertyType")
+
+_BITS = 20
+_OFFSET = 1 << (_BITS - 1)
+_ZERO = 0  # bucket (after offset) holding zeros; real buckets start at 1
+
+
+def dim_labels(df: pd.DataFrame, col: str) -> pd.Series:
+    """String key of a dimension; bedrooms as whole numbers, missing as ""."""
+    if col not in df:
+        return pd.Series("", index=df.index, dtype=object)
+    s = df[col]
+    if col == "bedrooms":
+        s = pd.to_numeric(s, errors="coerce").astype("Int64")
+    return s.astype(str).astype(object).where(s.notna(), "")
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch per cell, with relative-error guarantees.
+
+    Works like DDSketch: a value v > 0 is counted in log bucket
+    ceil(log_gamma(v)), gamma = (1 + rel_err) / (1 - rel_err), so any quantile
+    read back is within `rel_err` of an exact one (relative to its value).
+    Counts are kept per cell, one cell per combination of SKETCH_DIMS values.
+    Merging cells (for any grouping or filter) is adding their bucket counts,
+    and updates only touch the new values. Values must be >= 0.
+    """
+
+    def __init__(self, rel_err: float = 0.01):
+        self.rel_err = rel_err
+        self.gamma = (1 + rel_err) / (1 - rel_err)
+        self._lg = np.log(self.gamma)
+        self.cells = pd.DataFrame(columns=list(SKETCH_DIMS), dtype=object)
+        self._cell_ids: dict[tuple, int] = {}
+        self.keys = np.empty(0, dtype=np.int64)    # cell << _BITS | bucket, sorted
+        self.counts = np.empty(0, dtype=np.int64)
+
+    # ---------- buckets ----------
+
+    def _bucket(self, values: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore"):
+            b = np.ceil(np.log(np.maximum(values, 0)) / self._lg)
+        b = np.where(values > 0, np.clip(b, 1 - _OFFSET, _OFFSET - 1) + _OFFSET, _ZERO)
+        return b.astype(np.int64)
+
+    def _value(self, buckets: np.ndarray) -> np.ndarray:
+        b = buckets.astype("float64") - _OFFSET
+        return np.where(buckets == _ZERO, 0.0, 2.0 * self.gamma ** b / (self.gamma + 1.0))
+
+    # ---------- building ----------
+
+    def _cell_codes(self, df: pd.DataFrame) -> np.ndarray:
+        dims = pd.DataFrame({c: dim_labels(df, c) for c in SKETCH_DIMS})
+        codes, uniq = pd.factorize(pd.MultiIndex.from_frame(dims))
+        new = []
+        for t in uniq:
+            if t not in self._cell_ids:
+                self._cell_ids[t] = len(self._cell_ids)
+                new.append(t)
+        if new:
+            new = pd.DataFrame(new, columns=list(SKETCH_DIMS), dtype=object)
+            self.cells = new if self.cells.empty else pd.concat([self.cells, new], ignore_index=True)
+        return np.array([self._cell_ids[t] for t in uniq], dtype=np.int64)[codes]
+
+    def _add(self, keys: np.ndarray, counts: np.ndarray) -> None:
+        keys = np.concatenate([self.keys, keys])
+        counts = np.concatenate([self.counts, counts])
+        self.keys, inv = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inv, weights=counts).astype(np.int64)
+
+    def update(self, df: pd.DataFrame, values) -> QuantileSketch:
+        """Count `values` (one per row of `df`, NaNs skipped) into their cells."""
+        values = np.asarray(values, dtype="float64")
+        ok = np.isfinite(values)
+        if ok.any():
+            cells = self._cell_codes(df[ok])
+            keys = (cells << _BITS) | self._bucket(values[ok])
+            self._add(keys, np.ones(keys.size, dtype=np.int64))
+        return self
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        """Fold another sketch (same rel_err) into this one."""
+        if other.keys.size:
+            remap = self._cell_codes(other.cells)
+            self._add((remap[other.keys >> _BITS] << _BITS) | (other.keys & ((1 << _BITS) - 1)),
+                      other.counts)
+        return self
+
+    # ---------- queries ----------
+
+    def grouped(self, by: tuple[str, ...], where: dict | None = None) -> "_Groups":
+        """Merge cells into the groups of `by`, keeping cells allowed by `where`."""
+        cells = self.cells
+        # rows missing a grouping value belong to no group
+        keep = (cells[list(by)] != "").all(axis=1).to_numpy()
+        for col, allowed in (where or {}).items():
+            if allowed:
+                keep = keep & cells[col].isin([str(a) for a in allowed]).to_numpy()
+        label = cells[by[0]] if len(by) == 1 else pd.MultiIndex.from_frame(cells[list(by)])
+        gcode, labels = pd.factorize(label)
+        gcode = np.where(keep, gcode, -1)
+
+        g = gcode[self.keys >> _BITS]
+        ok = g >= 0
+        keys = (g[ok].astype(np.int64) << _BITS) | (self.keys[ok] & ((1 << _BITS) - 1))
+        keys, inv = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inv, weights=self.counts[ok]).astype(np.int64)
+        return _Groups(self, by, pd.Index(labels), keys, counts)
+
+
+class _Groups:
+    """Bucket counts of one grouping, sorted by (group, bucket)."""
+
+    def __init__(self, sketch: QuantileSketch, by: tuple[str, ...], labels: pd.Index,
+                 keys: np.ndarray, counts: np.ndarray):
+        self.sketch, self.by, self.labels = sketch, by, labels
+        self.keys, self.counts = keys, counts
+        self.buckets = keys & ((1 << _BITS) - 1)
+        self.n = np.bincount(keys >> _BITS, weights=counts, minlength=len(labels)).astype(np.int64)
+        self.cum = np.cumsum(counts)
+        self.starts = np.cumsum(self.n) - self.n
+
+    def codes(self, df: pd.DataFrame) -> np.ndarray:
+        """Group of each row of `df` (-1 if not in the sketch)."""
+        row = dim_labels(df, self.by[0]) if len(self.by) == 1 else \
+            pd.MultiIndex.from_frame(pd.DataFrame({c: dim_labels(df, c) for c in self.by}))
+        return np.asarray(self.labels.get_indexer(row), dtype=np.int64)
+
+    def quantile(self, q: float) -> np.ndarray:
+        """
+        Approximate q-quantile per group.
+
+        Interpolates between the values at ranks floor/ceil((n - 1) * q), like
+        np.percentile's default, so a two-value median is their midpoint.
+        """
+        if not self.keys.size:
+            return np.full(self.n.size, np.nan)
+
+        def at(rank):
+            pos = np.searchsorted(self.cum, self.starts + rank, side="right")
+            return self.sketch._value(self.buckets[np.minimum(pos, self.keys.size - 1)])
+
+        r = q * np.maximum(self.n - 1, 0)
+        lo = np.floor(r)
+        vals = at(lo) + (r - lo) * (at(np.ceil(r)) - at(lo))
+        return np.where(self.n > 0, vals, np.nan)
+
+    def mean(self) -> np.ndarray:
+        v = self.sketch._value(self.buckets) * self.counts
+        total = np.bincount(self.keys >> _BITS, weights=v, minlength=self.n.size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > 0, total / self.n, np.nan)
+
+    def table(self, qs=(0.5,)) -> pd.DataFrame:
+        """One row per non-empty group: n, approximate mean and quantiles."""
+        frame = pd.DataFrame({"n": self.n, "mean": self.mean(),
+                              **{q: self.quantile(q) for q in qs}}, index=self.labels)
+        return frame[frame["n"] > 0]
+
+    def cdf(self, g: np.ndarray, values) -> tuple[np.ndarray, np.ndarray]:
+        """(# values below, # values in the same bucket) for `values` in groups `g`."""
+        values = np.asarray(values, dtype="float64")
+        below = np.zeros(values.size)
+        eq = np.zeros(values.size)
+        ok = (g >= 0) & np.isfinite(values)
+        if not ok.any() or not self.keys.size:
+            return below, eq
+        key = (g[ok] << _BITS) | self.sketch._bucket(values[ok])
+        pos = np.searchsorted(self.keys, key)
+        last = np.minimum(pos, self.keys.size - 1)
+        hit = (pos < self.keys.size) & (self.keys[last] == key)
+        below[ok] = np.where(pos > 0, self.cum[np.maximum(pos - 1, 0)], 0) - self.starts[g[ok]]
+        eq[ok] = np.where(hit, self.counts[last], 0)
+        return below, eq
+
+    def rank(self, df: pd.DataFrame, values) -> np.ndarray:
+        """
+        Approximate within-group percentile rank of each row's value (0..1).
+
+        Ties share the average rank, as pandas rank(pct=True) with the value
+        itself counted in its group; rows of groups not in the sketch get NaN.
+        """
+        g = self.codes(df)
+        below, eq = self.cdf(g, values)
+        out = np.full(g.size, np.nan)
+        ok = (g >= 0) & np.isfinite(np.asarray(values, dtype="float64"))
+        out[ok] = (below[ok] + (np.maximum(eq[ok], 1) + 1) / 2.0) / self.n[g[ok]]
+        return out
+
+
+class SketchStore:
+    """
+    Quantile sketches per metric, kept in step with the dataset on ingest.
+
+    sync() only feeds listings it hasn't seen, matched on a fingerprint of
+    the listing `key`, the metric values and the sketch dimensions (as
+    HedonicModel.sync matches on key and price). Sketches can't subtract, so
+    if a listing has disappeared or changed it rebuilds instead. sync() is
+    serialized by a lock, since the store is shared between sessions.
+    """
+
+    def __init__(self, metrics: tuple[str, ...], key: str = "id", rel_err: float = 0.01):
+        self.metrics = metrics
+        self.key = key
+        self.rel_err = rel_err
+        self.version: str | None = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.sketches = {m: QuantileSketch(self.rel_err) for m in self.metrics}
+        self.seen = pd.Index([], dtype="uint64")
+
+    def _fingerprint(self, df: pd.DataFrame) -> pd.Index:
+        cols = [c for c in (self.key, *self.metrics, *SKETCH_DIMS) if c in df]
+        return pd.Index(pd.util.hash_pandas_object(df[cols].astype(str), index=False).to_numpy())
+
+    def sync(self, version: str, df: pd.DataFrame) -> int:
+        """Ingest the rows of `df` that are new since the last sync; returns how many."""
+        with self._lock:
+            if version == self.version:
+                return 0
+            if self.key not in df:
+                self._reset()
+                new = df
+            else:
+                fp = self._fingerprint(df)
+                if not self.seen.isin(fp).all():  # a listing was removed or changed
+                    self._reset()
+                fresh = ~fp.isin(self.seen)
+                new = df[fresh]
+                self.seen = self.seen.append(fp[fresh])
+            for m, sk in self.sketches.items():
+                if m in new:
+                    sk.update(new, pd.to_numeric(new[m], errors="coerce").to_numpy(dtype="float64"))
+            self.version = version
+            return len(new)
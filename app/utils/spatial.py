@@ -0,0 +1,258 @@
+# app/utils/spatial.py
+from __future__ import annotations
+
+import numpy as np
+
+_M_PER_DEG_LAT = 110_574.0
+_M_PER_DEG_LON = 111_320.0
+METERS_PER_MILE = 1609.344
+_EARTH_R_M = 6_371_008.8
+
+
+def _haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in meters between points given in radians."""
+    h = (np.sin((lat2 - lat1) / 2.0) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * _EARTH_R_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def _occupancy(x: np.ndarray, y: np.ndarray, cell: float) -> float:
+    """Points sharing the typical point's cell (point-weighted median cell count)."""
+    key = (np.floor(y / cell).astype(np.int64) << 32) + (np.floor(x / cell).astype(np.int64)
+                                                          & 0xFFFFFFFF)
+    counts = np.sort(np.unique(key, return_counts=True)[1])
+    seen = np.cumsum(counts)
+    return float(counts[np.searchsorted(seen, seen[-1] / 2.0)])
+
+
+class SpatialIndex:
+    """
+    Uniform-grid spatial index for radius and nearest-neighbor queries.
+
+    Points are projected to local meters (equirectangular around the mean
+    latitude) and sorted by row-major cell code, so every row of cells is
+    one contiguous slice. A query only binary-searches the cell rows it
+    overlaps and touches the points inside them, which keeps it sublinear in
+    the number of indexed listings. The grid only prunes candidates: its
+    column reach is widened for the query's latitude, and candidates are
+    filtered and ranked by haversine distance, so results stay exact when the
+    listings span many degrees of latitude. All queries are batched: many
+    centers are answered with array ops, not a Python loop per center.
+    """
+
+    def __init__(self, lat, lon, cell_m: float | None = None, per_cell: int = 16):
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        self.size = lat.size
+        self.lat0 = float(np.deg2rad(np.mean(lat))) if lat.size else 0.0
+        x, y = self._project(lat, lon)
+
+        if cell_m is None and self.size:
+            # aim for ~`per_cell` points per cell where listings are densest:
+            # the interquartile box holds about a quarter of the points
+            qx = np.subtract(*np.percentile(x, [75, 25]))
+            qy = np.subtract(*np.percentile(y, [75, 25]))
+            density = 0.25 * self.size / max(qx * qy, 1.0)
+            cell_m = np.sqrt(per_cell / density)
+            # clustered data (several metros) leaves that box mostly empty:
+            # shrink until the typical point's cell holds about `per_cell`
+            for _ in range(4):
+                occupied = _occupancy(x, y, max(cell_m, 25.0))
+                if occupied <= 2 * per_cell:
+                    break
+                cell_m *= np.sqrt(per_cell / occupied)
+        self.per_cell = per_cell
+        self.cell = float(np.clip(cell_m or 1000.0, 25.0, 50_000.0))
+
+        ix = np.floor(x / self.cell).astype(np.int64)
+        iy = np.floor(y / self.cell).astype(np.int64)
+        self.ix0 = int(ix.min()) if ix.size else 0
+        self.iy0 = int(iy.min()) if iy.size else 0
+        self.nx = int(ix.max()) - self.ix0 + 1 if ix.size else 1
+        self.ny = int(iy.max()) - self.iy0 + 1 if iy.size else 1
+        codes = (iy - self.iy0) * self.nx + (ix - self.ix0)
+
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.x = x[self.order]
+        self.y = y[self.order]
+        self.lat = np.deg2rad(lat[self.order])
+        self.lon = np.deg2rad(lon[self.order])
+
+    def _project(self, lat, lon) -> tuple[np.ndarray, np.ndarray]:
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        return lon * _M_PER_DEG_LON * np.cos(self.lat0), lat * _M_PER_DEG_LAT
+
+    def _row_ranges(self, cx_lo, cx_hi, cy) -> tuple[np.ndarray, np.ndarray]:
+        """[start, end) into the sorted points for cell rows cy, columns cx_lo..cx_hi."""
+        valid = (cy >= 0) & (cy < self.ny) & (cx_hi >= 0) & (cx_lo < self.nx)
+        lo = cy * self.nx + np.clip(cx_lo, 0, self.nx - 1)
+        hi = cy * self.nx + np.clip(cx_hi, 0, self.nx - 1)
+        start = np.searchsorted(self.codes, lo, side="left")
+        end = np.searchsorted(self.codes, hi, side="right")
+        return start, np.where(valid, end, start)
+
+    @staticmethod
+    def _expand(start, end) -> tuple[np.ndarray, np.ndarray]:
+        """Flatten ranges: (range id, sorted position) for every point in them."""
+        counts = (end - start).ravel()
+        total = int(counts.sum())
+        rid = np.repeat(np.arange(counts.size), counts)
+        first = np.cumsum(counts) - counts
+        pos = np.repeat(start.ravel() - first, counts) + np.arange(total)
+        return rid, pos
+
+    def query_radius(self, lat, lon, radius_m: float,
+                     chunk: int = 4096) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All (query, point) pairs within `radius_m` meters.
+
+        Returns flat arrays (query index, point index, great-circle meters),
+        grouped by query. Point indices refer to the arrays given to __init__.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype="float64"))
+        lon = np.atleast_1d(np.asarray(lon, dtype="float64"))
+        qx, qy = self._project(lat, lon)
+        qlat, qlon = np.deg2rad(lat), np.deg2rad(lon)
+        # projected meters per degree are at most the true ones north-south,
+        # so `r` rows suffice; east-west, reach the widest longitude span of
+        # the spherical cap around each query
+        r = int(np.ceil(radius_m / self.cell))
+        dy = np.arange(-r, r + 1)
+        arc = min(radius_m / _EARTH_R_M, np.pi / 2)
+        cos_q = np.cos(qlat)
+        dlon = np.where(np.sin(arc) < cos_q,
+                        np.arcsin(np.sin(arc) / np.maximum(cos_q, 1e-12)), np.pi)
+        rx = np.ceil(np.rad2deg(dlon) * _M_PER_DEG_LON * np.cos(self.lat0)
+                     / self.cell).astype(np.int64)
+        out_q, out_p, out_d = [], [], []
+        for s in range(0, qx.size, chunk):
+            x, y, w = qx[s:s + chunk], qy[s:s + chunk], rx[s:s + chunk]
+            cx = np.floor(x / self.cell).astype(np.int64) - self.ix0
+            cy = np.floor(y / self.cell).astype(np.int64)[:, None] - self.iy0 + dy
+            start, end = self._row_ranges((cx - w)[:, None], (cx + w)[:, None], cy)
+            rid, pos = self._expand(start, end)
+            qi = rid // dy.size
+            d = _haversine_m(qlat[s:s + chunk][qi], qlon[s:s + chunk][qi],
+                            self.lat[pos], self.lon[pos])
+            keep = d <= radius_m
+            out_q.append(qi[keep] + s)
+            out_p.append(self.order[pos[keep]])
+            out_d.append(d[keep])
+        if not out_q:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        return np.concatenate(out_q), np.concatenate(out_p), np.concatenate(out_d)
+
+    def query_knn(self, lat, lon, k: int, max_radius_m: float | None = None,
+                  skip_self: bool = False, chunk: int = 4096) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The `k` nearest points to each query, as (indices, distances) of shape (q, k).
+
+        Searches a radius that doubles for the queries that haven't found `k`
+        points yet (up to `max_radius_m`). Missing neighbors are -1 / inf.
+        With skip_self, query i is assumed to be indexed point i and is left out.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype="float64"))
+        lon = np.atleast_1d(np.asarray(lon, dtype="float64"))
+        nq = lat.size
+        idx = np.full((nq, k), -1, dtype=np.int64)
+        dist = np.full((nq, k), np.inf)
+        if nq == 0 or self.size == 0 or k <= 0:
+            return idx, dist
+
+        want = k + 1 if skip_self else k
+        # upper bound on the distance from each query to any indexed point
+        # (haversine with the largest lat / lon gaps and the largest cosine
+        # in the latitude band): past that radius every point has been seen
+        qlat, qlon = np.deg2rad(lat), np.deg2rad(lon)
+        lo = np.minimum(qlat, self.lat.min())
+        hi = np.maximum(qlat, self.lat.max())
+        dlat = np.maximum(qlat - self.lat.min(), self.lat.max() - qlat)
+        dlon = np.minimum(np.maximum(qlon - self.lon.min(), self.lon.max() - qlon), np.pi)
+        cos_max = np.where((lo <= 0) & (hi >= 0), 1.0, np.maximum(np.cos(lo), np.cos(hi)))
+        h = np.sin(dlat / 2.0) ** 2 + cos_max ** 2 * np.sin(dlon / 2.0) ** 2
+        reach = 2.0 * _EARTH_R_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+        for s in range(0, nq, chunk):
+            q = np.arange(s, min(s + chunk, nq))
+            radius = self.cell * max(1.0, np.sqrt(want / self.per_cell))
+            while q.size:
+                if max_radius_m is not None:
+                    radius = min(radius, max_radius_m)
+                qi, pi, d = self.query_radius(lat[q], lon[q], radius)
+                if skip_self:
+                    keep = pi != q[qi]
+                    qi, pi, d = qi[keep], pi[keep], d[keep]
+                o = np.lexsort((d, qi))
+                qi, pi, d = qi[o], pi[o], d[o]
+                found = np.bincount(qi, minlength=q.size)
+                rank = np.arange(qi.size) - np.repeat(np.cumsum(found) - found, found)
+                top = rank < k
+                idx[q[qi[top]], rank[top]] = pi[top]
+                dist[q[qi[top]], rank[top]] = d[top]
+
+                if max_radius_m is not None and radius >= max_radius_m:
+                    break
+                q = q[(found < k) & (radius < reach[q])]
+                radius *= 2.0
+        return idx, dist
+
+    def query_bbox(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """
+        Indices of points inside a lat/lon bounding box.
+
+        Each cell row of the box is one contiguous slice of the sorted points,
+        so the work is one binary search per row plus the points returned.
+        """
+        x0, y0 = self._project(south, west)
+        x1, y1 = self._project(north, east)
+        cy = np.arange(int(np.floor(y0 / self.cell)), int(np.floor(y1 / self.cell)) + 1) - self.iy0
+        cy = cy[(cy >= 0) & (cy < self.ny)]
+        cx_lo = np.full(cy.size, int(np.floor(x0 / self.cell)) - self.ix0)
+        cx_hi = np.full(cy.size, int(np.floor(x1 / self.cell)) - self.ix0)
+        start, end = self._row_ranges(cx_lo, cx_hi, cy)
+        _, pos = self._expand(start, end)
+        x, y = self.x[pos], self.y[pos]
+        keep = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return np.sort(self.order[pos[keep]])
+
+
+def viewport_bbox(lat: float, lon: float, zoom: float, width_px: int = 1100,
+                  height_px: int = 600, pitch: float = 0.0, bearing: float = 0.0,
+                  margin: float = 1.1) -> tuple[float, float, float, float]:
+    """
+    (south, west, north, east) visible in a web-mercator map of the given size.
+
+    A pitched view shows a trapezoid that reaches well past the top of the
+    flat viewport: the camera sits 1.5 viewport heights from the center (as
+    in deck.gl / Mapbox), so the ground under each screen edge follows from
+    the angle of its ray. The bounding box is taken over the trapezoid's
+    corners after rotating them by `bearing`, then padded by `margin`.
+    """
+    scale = 256.0 * 2.0 ** zoom
+    x = lon / 360.0 + 0.5
+    s = np.sin(np.deg2rad(np.clip(lat, -85.0511, 85.0511)))
+    y = 0.5 - 0.25 * np.log((1 + s) / (1 - s)) / np.pi
+
+    # ground offsets (pixels at the center's scale) of the top and bottom
+    # screen edges, and how much wider than the screen each edge is
+    p = np.deg2rad(np.clip(pitch, 0.0, 85.0))
+    f = np.arctan(0.5 / 1.5)
+    top = min(p + f, np.deg2rad(85.0))
+    h = 1.5 * height_px * np.cos(p)
+    far = h * (np.tan(top) - np.tan(p))
+    near = h * (np.tan(p) - np.tan(p - f))
+    far_w = width_px / 2.0 * np.cos(p) * np.cos(f) / np.cos(top)
+    near_w = width_px / 2.0 * np.cos(p) * np.cos(f) / np.cos(p - f)
+    u = np.array([-far_w, far_w, -near_w, near_w])
+    v = np.array([far, far, -near, -near])
+    b = np.deg2rad(bearing)
+    east = (u * np.cos(b) + v * np.sin(b)) * margin / scale
+    north = (v * np.cos(b) - u * np.sin(b)) * margin / scale
+
+    def to_lat(w: float) -> float:
+        return float(np.rad2deg(np.arctan(np.sinh(np.pi * (1 - 2 * w)))))
+
+    return (to_lat(min(y - north.min(), 1.0)), float((x + east.min() - 0.5) * 360.0),
+            to_lat(max(y - north.max(), 0.0)), float((x + east.max() - 0.5) * 360.0))
@@ -0,0 +1,213 @@
+# app/utils/vcache.py
+from __future__ import annotations
+
+import functools
+import inspect
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd  # type: ignore
+
+# Default ceiling on the (estimated) size of one function's cached results
+CACHE_MAX_BYTES = 256 * 2**20
+
+EVICT_REASONS = ("size", "entries", "ttl", "version")
+
+# one cache per page function, kept across reruns (pages re-define their
+# functions); stored with a fingerprint of the code that filled it
+_REGISTRY: dict[str, tuple[tuple, VersionCache]] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _nbytes(obj: Any, seen: set[int] | None = None, depth: int = 0) -> int:
+    """
+    Rough in-memory size of a cached result.
+
+    Arrays and frames count their buffers (object columns from a sample of
+    values); containers and plain objects are walked a few levels deep.
+    Shared sub-objects are counted once.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        frame = obj.to_frame() if isinstance(obj, (pd.Series, pd.Index)) else obj
+        size = int(frame.memory_usage(index=True, deep=False).sum())
+        for c in frame.columns[frame.dtypes.to_numpy() == object]:
+            col = frame[c]
+            sample = col.iloc[:: max(1, len(col) // 256)]
+            if len(sample):
+                size += int(len(col) * np.mean([sys.getsizeof(v) for v in sample]))
+        return size
+    size = sys.getsizeof(obj)
+    if depth >= 4:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_nbytes(k, seen, depth + 1) + _nbytes(v, seen, depth + 1)
+                          for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(_nbytes(v, seen, depth + 1) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return size + _nbytes(vars(obj), seen, depth + 1)
+    return size
+
+
+class VersionCache:
+    """
+    LRU cache of one function's results, keyed on its non-underscore arguments.
+
+    Arguments whose name starts with "_" are not part of the key, as in
+    st.cache_data; pass the data that way and key it with a dataset version
+    token, so nothing is hashed or pickled. Key arguments must be hashable
+    (DataFrames and arrays are refused). Results are returned as stored,
+    shared between reruns and sessions like st.cache_resource: don't mutate
+    them.
+
+    Limits: `max_bytes` on the estimated size of the stored results (None =
+    no limit; a single result above it is returned but not kept),
+    `max_entries`, and `ttl` seconds. A call with a new `version` drops the
+    entries of older versions. stats() counts hits, misses, evictions by
+    reason, entries and bytes.
+    """
+
+    def __init__(self, name: str, max_bytes: int | None = CACHE_MAX_BYTES,
+                 max_entries: int | None = None, ttl: float | None = None):
+        self.name = name
+        self.max_bytes, self.max_entries, self.ttl = max_bytes, max_entries, ttl
+        self.entries: OrderedDict[tuple, tuple[Any, int, float, Any]] = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.oversize = 0
+        self.evictions = dict.fromkeys(EVICT_REASONS, 0)
+        self.version: Any = None
+        self._lock = threading.Lock()
+        self._building: dict[tuple, threading.Lock] = {}
+
+    def _drop(self, key: tuple, reason: str) -> None:
+        _, size, _, _ = self.entries.pop(key)
+        self.bytes -= size
+        self.evictions[reason] += 1
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is not None:
+            for key in [k for k, e in self.entries.items() if now - e[2] > self.ttl]:
+                self._drop(key, "ttl")
+
+    def _lookup(self, key: tuple, version: Any) -> tuple[bool, Any]:
+        with self._lock:
+            now = time.monotonic()
+            if version is not None and version != self.version:
+                for k in [k for k, e in self.entries.items() if e[3] != version]:
+                    self._drop(k, "version")
+                self.version = version
+            self._expire(now)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+            return False, None
+
+    def _store(self, key: tuple, value: Any, version: Any) -> None:
+        size = _nbytes(value)
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.oversize += 1
+                return
+            if key in self.entries:  # replaced, not evicted
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size, time.monotonic(), version)
+            self.bytes += size
+            while self.max_entries is not None and len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)), "entries")
+            while self.max_bytes is not None and self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)), "size")
+
+    def get(self, key: tuple, version: Any, compute: Callable[[], Any]) -> Any:
+        """Cached value for `key`, computing it once even if sessions ask together."""
+        found, value = self._lookup(key, version)
+        if found:
+            return value
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            found, value = self._lookup(key, version)
+            if found:
+                return value
+            with self._lock:
+                self.misses += 1
+            try:
+                value = compute()
+                self._store(key, value, version)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {"function": self.name, "entries": len(self.entries), "bytes": self.bytes,
+                    "hits": self.hits, "misses": self.misses, "oversize": self.oversize,
+                    **{f"evicted_{r}": n for r, n in self.evictions.items()}}
+
+
+def version_cache(func: Callable | None = None, *, max_bytes: int | None = CACHE_MAX_BYTES,
+                  max_entries: int | None = None, ttl: float | None = None,
+                  version_arg: str = "version") -> Callable:
+    """
+    Decorator caching a function in a VersionCache.
+
+    Use bare (@version_cache) or with limits (@version_cache(max_entries=8,
+    ttl=600)). The cache lives per function across reruns and sessions and
+    is reset when the function's code changes. `version_arg` names the
+    dataset version parameter. The wrapper exposes cache_stats() and
+    cache_clear().
+    """
+    def decorate(fn: Callable) -> Callable:
+        sig = inspect.signature(fn)
+        keyed = [p for p in sig.parameters if not p.startswith("_")]
+        # pages all run as __main__, so the source file tells functions apart
+        name = f"{Path(fn.__code__.co_filename).stem}.{fn.__qualname__}"
+        code = (fn.__code__.co_code, fn.__code__.co_consts, max_bytes, max_entries, ttl)
+        with _REGISTRY_LOCK:
+            known, cache = _REGISTRY.get(name, (None, None))
+            if cache is None or known != code:
+                cache = VersionCache(name, max_bytes, max_entries, ttl)
+                _REGISTRY[name] = (code, cache)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments[p] for p in keyed)
+            for p, v in zip(keyed, key):
+                if isinstance(v, (pd.DataFrame, pd.Series, np.ndarray)):
+                    raise TypeError(f"{name}: pass {p!r} as _{p} and key it with a version token")
+            return cache.get(key, bound.arguments.get(version_arg), lambda: fn(*args, **kwargs))
+
+        wrapper.cache_stats = cache.stats
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def cache_report() -> pd.DataFrame:
+    """stats() of every version-cached function, one row each."""
+    with _REGISTRY_LOCK:
+        caches = [cache for _, cache in _REGISTRY.values()]
+    return pd.DataFrame([c.stats() for c in caches],
+                        columns=["function", "entries", "bytes", "hits", "misses", "oversize"] +
+                                [f"evicted_{r}" for r in EVICT_REASONS])
@@ -0,0 +1,40 @@
+"""
+Scaling check for the comps engine: python bench/bench_comps.py [rows ...]
+
+Times comps_frame (grouping + median, MAD z, percentile and discount) on
+synthetic listings for every grouping scheme.
+"""
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from utils.comps import GROUPINGS, comps_frame  # noqa: E402
+
+
+def listings(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "zipCode": rng.integers(10_000, 10_000 + max(n // 200, 1), n).astype(str),
+        "bedrooms": rng.integers(0, 7, n).astype("float64"),
+        "price": rng.lognormal(13, 0.5, n).round(-3),
+    })
+
+
+def main(sizes: list[int]) -> None:
+    for n in sizes:
+        df = listings(n)
+        for grouping in GROUPINGS:
+            t = time.perf_counter()
+            comps_frame(df, grouping, "price")
+            print(f"{n:>10,} rows  {grouping:<13} {time.perf_counter() - t:7.2f} s")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000, 4_000_000])
@@ -0,0 +1,7 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# the app imports its helpers as `utils.*`, relative to app/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import bootstrap
+from utils.bootstrap import StabilityStore, bootstrap_stability, stability_table
+
+
+def _old_score(arr: np.ndarray) -> float:
+    arr = arr[np.isfinite(arr)]
+    if arr.size < 4:
+        return np.nan
+    med = np.median(arr)
+    iqr = np.subtract(*np.percentile(arr, [75, 25]))
+    return float(max(0.0, 1.0 - (iqr / med)) * 100.0) if med > 0 else np.nan
+
+
+def _old_table(df: pd.DataFrame, gcol: str, mcol: str) -> pd.DataFrame:
+    """The Stability page's original per-group, per-resample loop."""
+    rows = []
+    rng = np.random.default_rng(7)
+    for g, sub in df[[gcol, mcol]].dropna().groupby(gcol):
+        x = sub[mcol].to_numpy(dtype="float64")
+        if x.size < 6:
+            rows.append((g, np.median(x) if x.size else np.nan, np.nan, np.nan, x.size, np.nan))
+            continue
+        B = min(400, 50 + x.size)
+        stats = np.array([_old_score(x[rng.integers(0, x.size, size=x.size)]) for _ in range(B)])
+        q1, q3 = np.percentile(x, [25, 75])
+        iqr = q3 - q1
+        rows.append((g, float(np.median(x)), _old_score(x),
+                     float(np.mean((x < q1 - 1.5 * iqr) | (x > q3 + 1.5 * iqr))), x.size,
+                     (float(np.nanpercentile(stats, 2.5)), float(np.nanpercentile(stats, 97.5)))))
+    tbl = pd.DataFrame(rows, columns=[gcol, "median", "stability", "outlier_share", "n", "ci"])
+    return tbl.sort_values("stability", ascending=False)
+
+
+@pytest.fixture(scope="module")
+def listings() -> pd.DataFrame:
+    rng = np.random.default_rng(11)
+    n = 2500
+    zips = rng.choice([f"9000{i}" for i in range(9)] + ["90100", "90200"], n,
+                      p=[0.2, 0.15, 0.15, 0.1, 0.1, 0.1, 0.08, 0.06, 0.04, 0.001, 0.019])
+    price = rng.lognormal(13, 0.35, n).round(-3)
+    price[rng.random(n) < 0.03] = np.nan
+    return pd.DataFrame({"zipCode": zips, "bedrooms": rng.integers(0, 7, n).astype("float64"),
+                         "price": price, "daysOnMarket": rng.integers(1, 120, n).astype("float64")})
+
+
+def _ci_cols(tbl: pd.DataFrame) -> np.ndarray:
+    return np.array([t if isinstance(t, tuple) else (np.nan, np.nan) for t in tbl["ci"]])
+
+
+@pytest.mark.parametrize("gcol", ["zipCode", "bedrooms"])
+@pytest.mark.parametrize("mcol", ["price", "daysOnMarket"])
+def test_exact_mode_reproduces_the_per_resample_loop(listings, gcol, mcol):
+    got = stability_table(listings, gcol, mcol).reset_index(drop=True)
+    want = _old_table(listings, gcol, mcol).reset_index(drop=True)
+    assert got[gcol].tolist() == want[gcol].tolist()
+    for col in ("median", "stability", "outlier_share", "n"):
+        np.testing.assert_array_equal(got[col].to_numpy(dtype="float64"),
+                                      want[col].to_numpy(dtype="float64"), err_msg=col)
+    np.testing.assert_array_equal(_ci_cols(got), _ci_cols(want))
+
+
+def _coded(df: pd.DataFrame, gcol: str, mcol: str):
+    d = df[[gcol, mcol]].dropna()
+    codes, labels = pd.factorize(d[gcol], sort=True)
+    return codes, d[mcol].to_numpy(dtype="float64"), len(labels)
+
+
+@pytest.mark.parametrize("max_bytes", [1 << 10, 1 << 16])
+def test_exact_mode_ignores_max_bytes(listings, max_bytes):
+    codes, values, ngroups = _coded(listings, "zipCode", "price")
+    full = bootstrap_stability(codes, values, ngroups)
+    small = bootstrap_stability(codes, values, ngroups, max_bytes=max_bytes)
+    for col, arr in full.items():
+        np.testing.assert_array_equal(small[col], arr, err_msg=col)
+
+
+def test_scalable_mode_ignores_worker_count(listings):
+    codes, values, ngroups = _coded(listings, "zipCode", "price")
+    kw = dict(ci="scalable", blb_min=200, asymptotic_min=400)
+    serial = bootstrap_stability(codes, values, ngroups, **kw)
+    pooled = bootstrap_stability(codes, values, ngroups, workers=2, **kw)
+    small = bootstrap_stability(codes, values, ngroups, max_bytes=1 << 12, **kw)
+    for col, arr in serial.items():
+        np.testing.assert_array_equal(pooled[col], arr, err_msg=col)
+        np.testing.assert_array_equal(small[col], arr, err_msg=col)
+
+
+@pytest.mark.parametrize("kw", [dict(blb_min=1000), dict(blb_min=1000, asymptotic_min=5000)])
+def test_scalable_intervals_track_the_full_bootstrap(kw):
+    rng = np.random.default_rng(3)
+    sizes = [8000, 12000, 20000]
+    codes = np.repeat(np.arange(len(sizes)), sizes)
+    values = rng.lognormal(13, 0.4, codes.size)
+    full = bootstrap_stability(codes, values, len(sizes), ci="scalable",
+                               blb_min=10**9, asymptotic_min=10**9)
+    fast = bootstrap_stability(codes, values, len(sizes), ci="scalable", **kw)
+    np.testing.assert_array_equal(fast["stability"], full["stability"])
+    width = full["ci_hi"] - full["ci_lo"]
+    assert (width > 0).all()
+    # endpoints agree to within a quarter of the interval's width
+    np.testing.assert_array_less(np.abs(fast["ci_lo"] - full["ci_lo"]), 0.25 * width)
+    np.testing.assert_array_less(np.abs(fast["ci_hi"] - full["ci_hi"]), 0.25 * width)
+
+
+def test_superseded_warm_stops(listings, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    built = []
+
+    def slow_table(df, gcol, mcol, **kw):
+        built.append((len(df), gcol, mcol))
+        started.set()
+        release.wait(10)
+        return pd.DataFrame({"n": [len(df)]})
+
+    monkeypatch.setattr(bootstrap, "stability_table", slow_table)
+    store = StabilityStore()
+    store.sync("v1", listings)
+    store.warm_async()
+    old = store._warming[0]
+    assert started.wait(10)
+
+    newer = listings.head(100)
+    store.sync("v2", newer)
+    store.warm_async()  # not blocked by the v1 warm
+    release.set()
+    old.join(10)
+    store._warming[0].join(10)
+
+    # the v1 warm stopped after the table it was building, which wasn't kept
+    assert [b[0] for b in built].count(len(listings)) == 1
+    assert store.pending() == [] and len(store.tables) == len(built) - 1
+    assert all(t["n"].iloc[0] == len(newer) for t in store.tables.values())
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from utils.hedonic import HedonicModel
+
+
+def _listings(n: int, seed: int = 0, start: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    sqft = rng.uniform(600, 4000, n)
+    beds = rng.integers(1, 6, n).astype("float64")
+    zips = rng.choice(["90001", "90002", "90003", "91101"], n)
+    zip_lift = {"90001": 0.0, "90002": 0.2, "90003": -0.1, "91101": 0.4}
+    effect = pd.Series(zip_lift)[zips].to_numpy()
+    price = np.exp(11 + 0.8 * np.log(sqft) + 0.05 * beds + effect + rng.normal(0, 0.1, n))
+    df = pd.DataFrame({
+        "id": [f"L{i}" for i in range(start, start + n)],
+        "zipCode": zips, "bedrooms": beds, "bathrooms": rng.integers(1, 4, n).astype("float64"),
+        "squareFootage": sqft, "yearBuilt": rng.integers(1920, 2020, n).astype("float64"),
+        "lotSize": rng.uniform(2000, 9000, n), "hoa": np.nan,
+        "price": price.round(-3),
+    })
+    df.loc[rng.random(n) < 0.1, "yearBuilt"] = np.nan  # exercises the missing columns
+    return df
+
+
+def _dense_ridge(model: HedonicModel, df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """The same ridge problem with one-hot ZIP columns, solved directly."""
+    y = model._target(df)
+    ok = np.isfinite(y)
+    df, y = df[ok], y[ok]
+    x = model._design(df)
+    onehot = np.zeros((len(df), len(model.zips)))
+    onehot[np.arange(len(df)), [model.zips[z] for z in df["zipCode"].astype(str)]] = 1.0
+    a = np.column_stack([x, onehot])
+    penalty = np.r_[0.0, np.full(x.shape[1] - 1, model.alpha), np.full(len(model.zips), model.zip_alpha)]
+    beta = np.linalg.lstsq(a.T @ a + np.diag(penalty), a.T @ y, rcond=None)[0]
+    return beta[:x.shape[1]], beta[x.shape[1]:]
+
+
+def test_fit_matches_dense_ridge():
+    df = _listings(800)
+    model = HedonicModel().fit(df)
+    coef, zip_effect = _dense_ridge(model, df)
+    np.testing.assert_allclose(model.coef, coef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(model.zip_effect, zip_effect, rtol=1e-8, atol=1e-10)
+
+
+def test_sync_matches_a_fit_on_the_new_table():
+    old = _listings(800)
+    model = HedonicModel().fit(old)
+    new = pd.concat([old.iloc[50:], _listings(120, seed=1, start=800)], ignore_index=True)
+    new.loc[10, "price"] *= 1.5  # same id, new price: a remove + add
+    assert model.sync(new) == (121, 51)
+    assert model.n == len(new)
+    coef, zip_effect = _dense_ridge(model, new)  # same frozen centering and scaling
+    np.testing.assert_allclose(model.coef, coef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(model.zip_effect, zip_effect, rtol=1e-8, atol=1e-10)
+    assert model.sync(new) == (0, 0)
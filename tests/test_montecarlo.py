@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from utils.montecarlo import PortfolioSimulator
+
+
+def _portfolio(n: int = 120):
+    rng = np.random.default_rng(0)
+    return rng.uniform(1e5, 1e6, n), rng.normal(0.03, 0.05, n), np.full(n, 0.2)
+
+
+@pytest.mark.parametrize("method", ["mc", "antithetic"])
+def test_path_engine_ignores_memory_ceiling_and_run_splits(method):
+    prices, mu, sigma = _portfolio()
+    kw = dict(seed=3, engine="paths", method=method, rent_yield=0.04,
+              take_profit=0.3, stop_loss=0.1)
+    small = PortfolioSimulator(prices, mu, sigma, 8, 0.01, max_bytes=1 << 14, **kw).run(400)
+    large = PortfolioSimulator(prices, mu, sigma, 8, 0.01, max_bytes=1 << 24, **kw).run(400)
+    split = PortfolioSimulator(prices, mu, sigma, 8, 0.01, max_bytes=1 << 14, **kw)
+    split.run(200).run(200)
+    np.testing.assert_array_equal(small.port_net, large.port_net)
+    np.testing.assert_array_equal(small.sold, large.sold)
+    np.testing.assert_array_equal(small.port_net, split.port_net)
+    assert small.summary() == large.summary()
+
+
+def test_terminal_engine_ignores_memory_ceiling_and_run_splits():
+    prices, mu, sigma = _portfolio()
+    small = PortfolioSimulator(prices, mu, sigma, 5, 0.01, seed=3, max_bytes=1 << 12).run(400)
+    large = PortfolioSimulator(prices, mu, sigma, 5, 0.01, seed=3).run(400)
+    split = PortfolioSimulator(prices, mu, sigma, 5, 0.01, seed=3).run(200).run(200)
+    np.testing.assert_array_equal(small.port_net, large.port_net)
+    np.testing.assert_array_equal(small.port_net, split.port_net)
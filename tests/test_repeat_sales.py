@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import ast
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.repeat_sales import RepeatSalesIndex, price_events, sale_pairs
+
+DATA = Path(__file__).resolve().parents[1] / "data" / "listings_RentCastAPI.csv"
+
+HISTORY = (
+    "{'2024-01-17': {'event': 'Sale Listing', 'price': 539000, 'listingType': 'Standard', "
+    "'listedDate': '2024-01-17T00:00:00.000Z', 'removedDate': '2025-01-02T00:00:00.000Z', "
+    "'daysOnMarket': 351}, '2025-04-22': {'event': 'Sale Listing', 'price': 549000, "
+    "'listingType': 'Standard', 'listedDate': '2025-04-22T00:00:00.000Z', "
+    "'removedDate': '2025-05-11T00:00:00.000Z', 'daysOnMarket': 19}, '2025-08-07': "
+    "{'event': 'Sale Listing', 'price': 519000, 'listingType': 'Standard', "
+    "'listedDate': '2025-08-07T00:00:00.000Z', 'removedDate': None, 'daysOnMarket': 101}}"
+)
+
+
+def test_price_events_parses_history():
+    df = pd.DataFrame({"history": [
+        HISTORY,
+        None,
+        "{'2023-05-01': {'event': 'Sale Listing', 'listingType': 'Standard'}}",
+    ]})
+    ev = price_events(df)
+    assert ev["row"].tolist() == [0, 0, 0, 2]
+    assert ev["date"].dt.strftime("%Y-%m-%d").tolist() == \
+        ["2024-01-17", "2025-04-22", "2025-08-07", "2023-05-01"]
+    np.testing.assert_array_equal(ev["price"].to_numpy()[:3], [539000, 549000, 519000])
+    assert np.isnan(ev["price"].iloc[3])
+
+
+@pytest.mark.skipif(not DATA.exists(), reason="sample listings CSV not present")
+def test_price_events_matches_literal_eval_on_sample_data():
+    df = pd.read_csv(DATA)
+    want = []
+    for row, text in enumerate(df["history"]):
+        if isinstance(text, str):
+            for date, event in ast.literal_eval(text).items():
+                want.append((row, date, float(event.get("price", np.nan))))
+    ev = price_events(df)
+    got = list(zip(ev["row"].tolist(), ev["date"].dt.strftime("%Y-%m-%d").tolist(),
+                   ev["price"].tolist()))
+    assert len(got) == len(want)
+    for g, w in zip(got, want):
+        assert g[:2] == w[:2] and (g[2] == w[2] or np.isnan(g[2]) and np.isnan(w[2]))
+
+
+def _synthetic_pairs(noise: float, seed: int = 1):
+    """Pairs from a known quarterly log index per ZIP (first quarter = 0)."""
+    rng = np.random.default_rng(seed)
+    T, start = 12, pd.Period("2020Q1", freq="Q").ordinal
+    truth = {"90001": np.r_[0, np.cumsum(rng.normal(0.01, 0.02, T - 1))],
+             "98101": np.r_[0, np.cumsum(rng.normal(0.02, 0.03, T - 1))]}
+    zips, rows = [], []
+    for z, level in truth.items():
+        for _ in range(300):
+            t0, t1 = np.sort(rng.choice(T, 2, replace=False))
+            rows.append((len(zips), start + t0, start + t1,
+                         level[t1] - level[t0] + rng.normal(0, noise)))
+            zips.append(z)
+    pairs = pd.DataFrame(rows, columns=["row", "t0", "t1", "dlog"])
+    return pd.DataFrame({"zipCode": zips}), pairs, truth
+
+
+def test_index_recovers_a_known_index():
+    df, pairs, truth = _synthetic_pairs(noise=0.0)
+    rsi = RepeatSalesIndex(df, pairs, "zipCode")
+    for z, level in truth.items():
+        np.testing.assert_allclose(rsi.level[rsi.groups.get_loc(z)], level, atol=1e-9)
+
+
+def test_index_matches_dense_least_squares():
+    df, pairs, _ = _synthetic_pairs(noise=0.05)
+    rsi = RepeatSalesIndex(df, pairs, "zipCode")
+    T = len(rsi.periods)
+    start = rsi.periods[0].ordinal
+    for gi, z in enumerate(rsi.groups):
+        p = pairs[df["zipCode"].to_numpy()[pairs["row"]] == z]
+        # one column per period after the first (its level is pinned at 0)
+        X = np.zeros((len(p), T))
+        X[np.arange(len(p)), p["t1"] - start] += 1
+        X[np.arange(len(p)), p["t0"] - start] -= 1
+        beta = np.linalg.lstsq(X[:, 1:], p["dlog"].to_numpy(), rcond=None)[0]
+        np.testing.assert_allclose(rsi.level[gi], np.r_[0.0, beta], atol=1e-8)
+
+
+def test_sale_pairs_skips_quick_relists():
+    ev_df = pd.DataFrame({"history": [HISTORY]})
+    pairs = sale_pairs(ev_df)
+    # 2024-01-17 -> 2025-04-22 is kept; 2025-04-22 -> 2025-08-07 is < 180 days
+    assert len(pairs) == 1
+    np.testing.assert_allclose(pairs["dlog"], np.log(549000 / 539000))
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from utils.returns import estimate_zip_returns
+
+
+def _old_returns(df: pd.DataFrame, date_col: str) -> tuple[float, float, dict]:
+    """The ROI page's original per-ZIP groupby loop."""
+    d = df[[date_col, "price", "zipCode"]].dropna().copy()
+    d["year"] = d[date_col].dt.year
+    yearly = d.groupby(["zipCode", "year"])["price"].median().reset_index()
+    per_zip = {}
+    for z, g in yearly.groupby("zipCode"):
+        g = g.sort_values("year")
+        if len(g) >= 3:
+            r = np.diff(np.log(g["price"].to_numpy()))
+            if np.isfinite(r).any():
+                per_zip[z] = (float(np.mean(r)), float(
+                    np.std(r, ddof=1) if len(r) > 1 else 0.10))
+    all_years = yearly.groupby("year")["price"].median().sort_index()
+    if len(all_years) >= 3:
+        r_all = np.diff(np.log(all_years.to_numpy()))
+        mu_g, sig_g = float(np.mean(r_all)), float(np.std(r_all, ddof=1))
+    else:
+        mu_g, sig_g = 0.03, 0.12
+    return mu_g, sig_g, per_zip
+
+
+def _sales(n: int, n_zips: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    zips = rng.integers(0, n_zips, n)
+    # ZIPs see different year spans, so some have gaps or < 3 years
+    year = 2010 + (rng.integers(0, 12, n) * (1 + zips % 3)) % 12
+    year = np.where(zips % 7 == 0, 2010 + rng.integers(0, 2, n), year)
+    day = pd.to_datetime(year.astype(str) + "-01-01") \
+        + pd.to_timedelta(rng.integers(0, 365, n), "D")
+    price = 3e5 * np.exp(0.04 * (year - 2010) + rng.normal(0, 0.2, n))
+    df = pd.DataFrame({"listedDate": day, "price": price.round(-2),
+                       "zipCode": pd.Series(zips + 90000).astype(str)})
+    df.loc[rng.random(n) < 0.05, "price"] = np.nan
+    return df
+
+
+def test_matches_the_groupby_loop():
+    for n, n_zips in ((40, 8), (3000, 60), (20000, 400)):
+        df = _sales(n, n_zips, seed=n)
+        got = estimate_zip_returns(df, "listedDate")
+        mu_g, sig_g, per_zip = _old_returns(df, "listedDate")
+        assert got.mu_g == mu_g and got.sig_g == sig_g
+        assert sorted(per_zip) == list(got.zips)
+        for i, z in enumerate(got.zips):
+            np.testing.assert_allclose((got.mu[i], got.sigma[i]), per_zip[z],
+                                       rtol=1e-12, atol=1e-15)
+
+
+def test_take_gathers_zip_params_with_defaults():
+    df = _sales(3000, 60)
+    est = estimate_zip_returns(df, "listedDate")
+    _, _, per_zip = _old_returns(df, "listedDate")
+    rows = pd.Series(["99999", *list(df["zipCode"].head(200))])
+    mu, sg = est.take(est.codes(rows), 0.01, 0.2)
+    want = [per_zip.get(z, (0.01, 0.2)) for z in rows]
+    np.testing.assert_allclose(np.column_stack([mu, sg]), want, rtol=1e-12, atol=1e-15)
+
+
+def test_no_dates_falls_back_to_defaults():
+    est = estimate_zip_returns(_sales(100, 5), None)
+    assert (est.mu_g, est.sig_g, len(est)) == (0.03, 0.12, 0)
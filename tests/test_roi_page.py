@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+
+
+def _page_errors(at: AppTest) -> list[str]:
+    # the footer's page links can't resolve outside a multipage run
+    return [e.value for e in at.exception if "Could not find page" not in e.value]
+
+
+def test_deterministic_holding_cost_off_the_grid(monkeypatch):
+    monkeypatch.chdir(ROOT)  # pages read data/ relative to the working directory
+    at = AppTest.from_file(str(ROOT / "app" / "pages" / "3_⏳_ROI.py"), default_timeout=120)
+    at.run()
+    hold = next(n for n in at.number_input if n.label == "Annual holding cost %")
+    hold.set_value(0.3).run()
+    assert not _page_errors(at)
+    rates = next(m for m in at.multiselect if m.label == "Holding cost %")
+    assert "0.3" in rates.options  # AppTest reports options as strings
+    assert 0.3 in rates.value
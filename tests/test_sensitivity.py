@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from utils.sensitivity import SensitivityGrid, net_factor
+
+GROWTH = np.array([-0.05, -0.01, 0.0, 0.02, 0.06])
+YEARS = np.array([1.0, 5.0, 10.0, 25.0])
+HOLD = np.array([0.0, 0.01, 0.03])
+
+
+def _old_net(prices: np.ndarray, g: float, years: float, r: float) -> np.ndarray:
+    """The ROI page's deterministic net gain, one scenario at a time."""
+    fv = prices * np.power(1.0 + g, years)
+    geom_sum = years if g == 0 else (np.power(1.0 + g, years) - 1.0) / g
+    return fv - prices - prices * r * geom_sum
+
+
+def _listings(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    price = rng.lognormal(13, 0.5, n)
+    price[rng.random(n) < 0.05] = np.nan
+    return pd.DataFrame({"price": price, "zipCode": rng.choice(["90001", "90002", "90003"], n)})
+
+
+def test_net_factor_matches_the_page_formula():
+    f = net_factor(GROWTH[:, None, None], YEARS[None, :, None], HOLD[None, None, :])
+    for i, g in enumerate(GROWTH):
+        for j, y in enumerate(YEARS):
+            for k, r in enumerate(HOLD):
+                np.testing.assert_allclose(f[i, j, k], _old_net(np.ones(1), g, y, r)[0],
+                                           rtol=1e-12, atol=1e-15)
+
+
+def test_grid_matches_brute_force():
+    df = _listings(2000)
+    codes, zips = pd.factorize(df["zipCode"])
+    prices = df["price"].to_numpy()
+    grid = SensitivityGrid(prices, codes, len(zips))
+    f = net_factor(GROWTH[:, None, None], YEARS[None, :, None], HOLD[None, None, :])
+    for thresh in (0.0, 25_000.0, -10_000.0):
+        med_all, share_all = grid.medians(f), grid.shares(f, thresh)
+        med_zip, share_zip = grid.medians(f, group=None), grid.shares(f, thresh, group=None)
+        for i, g in enumerate(GROWTH):
+            for j, y in enumerate(YEARS):
+                for k, r in enumerate(HOLD):
+                    net = _old_net(prices, g, y, r)
+                    np.testing.assert_allclose(med_all[i, j, k], np.nanmedian(net), rtol=1e-9)
+                    assert share_all[i, j, k] == (net > thresh).mean()
+                    for z in range(len(zips)):
+                        mine = net[codes == z]
+                        np.testing.assert_allclose(med_zip[z, i, j, k], np.nanmedian(mine),
+                                                   rtol=1e-9)
+                        assert share_zip[z, i, j, k] == (mine > thresh).mean()
+                        assert grid.shares(f, thresh, group=z)[i, j, k] == share_zip[z, i, j, k]
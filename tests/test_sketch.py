@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.sketch import QuantileSketch, SketchStore
+
+QS = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _listings(n: int = 3000, seed: int = 2) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    price = rng.lognormal(13, 0.5, n)
+    price[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({
+        "id": [f"L{i}" for i in range(n)],
+        "state": "CA",
+        "city": rng.choice(["Los Angeles", "Pasadena", "Glendale"], n),
+        "zipCode": rng.choice(["90001", "90002", "91101", "91201"], n),
+        "bedrooms": rng.integers(1, 5, n).astype("float64"),
+        "status": "Active",
+        "propertyType": rng.choice(["Single Family", "Condo"], n),
+        "price": price,
+    })
+
+
+def _sketch(df: pd.DataFrame) -> QuantileSketch:
+    return QuantileSketch(0.01).update(df, df["price"].to_numpy())
+
+
+def _quantiles(sk: QuantileSketch, by: tuple[str, ...]) -> pd.DataFrame:
+    return sk.grouped(by).table(QS).sort_index()
+
+
+@pytest.mark.parametrize("by", [("zipCode",), ("city", "bedrooms"), ("propertyType",)])
+def test_quantiles_within_relative_error(by):
+    df = _listings()
+    table = _quantiles(_sketch(df), by)
+    got = {k if isinstance(k, tuple) else (k,): r
+           for k, r in zip(table.index, table.to_dict("records"))}
+    key = df[list(by)].astype({"bedrooms": "Int64"} if "bedrooms" in by else {}).astype(str)
+    for label, sub in df.groupby([key[c] for c in by]):
+        x = sub["price"].dropna().to_numpy()
+        row = got[label]
+        assert row["n"] == x.size
+        for q in QS:
+            exact = np.quantile(x, q)
+            assert abs(row[q] - exact) <= 0.01 * exact * (1 + 1e-9), (label, q)
+
+
+def test_merge_is_associative_and_matches_one_pass():
+    df = _listings()
+    a, b, c = np.array_split(np.arange(len(df)), 3)
+    parts = [df.iloc[p] for p in (a, b, c)]
+    left = _sketch(parts[0]).merge(_sketch(parts[1])).merge(_sketch(parts[2]))
+    right = _sketch(parts[0]).merge(_sketch(parts[1]).merge(_sketch(parts[2])))
+    whole = _sketch(df)
+    for by in [("zipCode",), ("city", "bedrooms")]:
+        pd.testing.assert_frame_equal(_quantiles(left, by), _quantiles(whole, by))
+        pd.testing.assert_frame_equal(_quantiles(right, by), _quantiles(whole, by))
+
+
+def test_sync_rebuilds_when_a_listing_changes_under_the_same_id():
+    df = _listings()
+    store = SketchStore(("price",))
+    assert store.sync("v1", df) == len(df)
+
+    grown = pd.concat([df, _listings(5, seed=9).assign(id=[f"N{i}" for i in range(5)])],
+                      ignore_index=True)
+    assert store.sync("v2", grown) == 5  # only the new listings are fed
+
+    changed = grown.copy()
+    changed.loc[0, "price"] = changed.loc[0, "price"] * 3
+    assert store.sync("v3", changed) == len(changed)  # rebuilt, not double counted
+    pd.testing.assert_frame_equal(_quantiles(store.sketches["price"], ("zipCode",)),
+                                  _quantiles(_sketch(changed), ("zipCode",)))
+    assert store.sync("v3", changed) == 0
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from utils.spatial import SpatialIndex
+
+R = 6_371_008.8
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.deg2rad, (lat1, lon1, lat2, lon2))
+    h = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * R * np.arcsin(np.sqrt(h))
+
+
+@pytest.fixture(scope="module")
+def two_metros():
+    # LA and Seattle in one index: ~13.5 degrees of latitude apart
+    rng = np.random.default_rng(5)
+    lat = np.r_[rng.normal(34.05, 0.15, 3000), rng.normal(47.6, 0.15, 3000)]
+    lon = np.r_[rng.normal(-118.3, 0.15, 3000), rng.normal(-122.3, 0.15, 3000)]
+    return lat, lon, SpatialIndex(lat, lon)
+
+
+def _queries(lat, lon):
+    return lat[::150], lon[::150]
+
+
+def test_query_radius_matches_brute_force(two_metros):
+    lat, lon, index = two_metros
+    qlat, qlon = _queries(lat, lon)
+    qi, pi, d = index.query_radius(qlat, qlon, 2500.0)
+    for i in range(qlat.size):
+        dist = _haversine(qlat[i], qlon[i], lat, lon)
+        want = np.flatnonzero(dist <= 2500.0)
+        got = pi[qi == i]
+        np.testing.assert_array_equal(np.sort(got), want)
+        np.testing.assert_allclose(d[qi == i][np.argsort(got)], dist[want], rtol=1e-9)
+
+
+@pytest.mark.parametrize("skip_self", [False, True])
+def test_query_knn_matches_brute_force(two_metros, skip_self):
+    lat, lon, index = two_metros
+    # skip_self needs query i to be indexed point i, so query every point
+    idx, dist = index.query_knn(lat, lon, 8, skip_self=skip_self)
+    for i in range(0, lat.size, 150):
+        d = _haversine(lat[i], lon[i], lat, lon)
+        if skip_self:
+            d[i] = np.inf
+        np.testing.assert_allclose(dist[i], np.sort(d)[:8], rtol=1e-9)
+        np.testing.assert_allclose(d[idx[i]], dist[i], rtol=1e-9)
+
+
+def test_query_knn_max_radius(two_metros):
+    lat, lon, index = two_metros
+    qlat, qlon = _queries(lat, lon)
+    idx, dist = index.query_knn(qlat, qlon, 50, max_radius_m=800.0)
+    for i in range(qlat.size):
+        d = np.sort(_haversine(qlat[i], qlon[i], lat, lon))
+        want = d[d <= 800.0][:50]
+        found = idx[i] >= 0
+        np.testing.assert_allclose(dist[i][found], want, rtol=1e-9)
+        assert np.isinf(dist[i][~found]).all()
+
+
+def test_query_knn_k_above_point_count():
+    lat = np.array([34.0, 34.01, 47.6])
+    lon = np.array([-118.0, -118.01, -122.3])
+    idx, dist = SpatialIndex(lat, lon).query_knn(lat, lon, 5, skip_self=True)
+    assert idx.shape == (3, 5)
+    # every other point is found, however far away, and the rest are padded
+    assert (idx[:, :2] >= 0).all() and (idx[:, 2:] == -1).all()
+    assert np.isinf(dist[:, 2:]).all()
+    assert idx[0, 0] == 1 and idx[1, 0] == 0 and idx[2, 0] in (0, 1)
+    assert not (idx[:, :2] == np.arange(3)[:, None]).any()
+
+
+def test_query_bbox_matches_brute_force(two_metros):
+    lat, lon, index = two_metros
+    for box in [(33.9, -118.5, 34.2, -118.1), (47.5, -122.5, 47.7, -122.2), (30, -125, 50, -115)]:
+        south, west, north, east = box
+        want = np.flatnonzero((lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+        np.testing.assert_array_equal(index.query_bbox(*box), want)
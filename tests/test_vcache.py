@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import vcache
+from utils.vcache import version_cache
+
+
+def test_underscore_args_are_not_keyed():
+    calls = []
+
+    @version_cache
+    def summary(version, col, _df):
+        calls.append(col)
+        return _df[col].sum()
+
+    df = pd.DataFrame({"a": [1, 2], "b": [3, 4]})
+    assert summary("v1", "a", df) == 3
+    assert summary("v1", "a", df.assign(a=[10, 20])) == 3  # same key, cached
+    assert summary("v1", "b", _df=df) == 7
+    assert calls == ["a", "b"]
+    assert summary.cache_stats()["hits"] == 1
+
+
+def test_frames_and_arrays_are_refused_as_keys():
+    @version_cache
+    def total(version, df):
+        return df.sum()
+
+    for bad in (pd.DataFrame({"a": [1]}), pd.Series([1]), np.ones(2)):
+        with pytest.raises(TypeError, match="pass 'df' as _df"):
+            total("v1", bad)
+
+
+def test_new_version_evicts_older_entries():
+    @version_cache
+    def square(version, x):
+        return x * x
+
+    square("v1", 2), square("v1", 3)
+    square("v2", 2)
+    stats = square.cache_stats()
+    assert (stats["entries"], stats["evicted_version"], stats["misses"]) == (1, 2, 3)
+    square("v2", 2)
+    assert square.cache_stats()["hits"] == 1
+
+
+def test_max_bytes_evicts_least_recent_and_skips_oversize():
+    @version_cache(max_bytes=3 * 8000 + 1000)
+    def block(version, n):
+        return np.zeros(n)
+
+    for n in (1000, 1001, 1002):
+        block("v1", n)
+    block("v1", 1000)  # refresh: 1001 is now the oldest
+    block("v1", 1003)
+    stats = block.cache_stats()
+    assert (stats["entries"], stats["evicted_size"]) == (3, 1)
+    assert stats["bytes"] <= 3 * 8000 + 1000
+    assert block("v1", 100_000).size == 100_000  # returned, not kept
+    stats = block.cache_stats()
+    assert (stats["oversize"], stats["entries"]) == (1, 3)
+    misses = stats["misses"]
+    block("v1", 1001)
+    assert block.cache_stats()["misses"] == misses + 1
+
+
+def test_ttl_expires_entries(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(vcache, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+
+    @version_cache(ttl=60)
+    def stamp(version):
+        return clock[0]
+
+    assert stamp("v1") == 0.0
+    clock[0] = 30.0
+    assert stamp("v1") == 0.0
+    clock[0] = 90.0
+    assert stamp("v1") == 90.0
+    assert stamp.cache_stats()["evicted_ttl"] == 1
+